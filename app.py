@@ -7,6 +7,20 @@ from backend.routes.auth import auth_bp
 from backend.routes.messages import messages_bp
 from backend.routes.calls import calls_bp
 from backend.routes.users import users_bp
+from backend.routes.metrics import metrics_bp
+from backend.routes.media import media_bp
+from backend.routes.bootstrap import bootstrap_bp
+from backend import metrics
+from backend.offload import cpu_offload, io_offload
+from backend.broker import socketio_queue_options
+from backend.session_cache import session_cache
+from backend.message_cache import message_cache
+from backend.media_pipeline import media_pipeline
+from backend.media_cache import media_cache
+from backend.presence import presence
+from backend.call_registry import call_registry, SIGNAL_ACTIONS
+from backend.ice_relay import ice_relay
+from backend.telegram_storage import telegram_storage
 from dotenv import load_dotenv
 import os
 
@@ -29,21 +43,50 @@ db.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login_page'
-socketio = SocketIO(app, cors_allowed_origins="*", path='/wa/socket.io')
+# Multi-worker deployments share room emits through a message queue, see backend/broker.py
+socketio = SocketIO(app, cors_allowed_origins="*", path='/wa/socket.io',
+                    **socketio_queue_options(os.getenv('SOCKETIO_MESSAGE_QUEUE')))
+cpu_offload.init_app(app)
+io_offload.init_app(app)
+media_pipeline.init_app(app, socketio)
+presence.init_app(app, socketio)
+call_registry.init_app(app, socketio)
+ice_relay.init_app(socketio)
+media_cache.init_app(socketio)
+# Resume Telegram uploads a previous process left pending
+media_pipeline.start()
+# Settle calls a previous process left ringing
+call_registry.start()
+
+metrics.register('cpu_offload', cpu_offload.stats)
+metrics.register('io_offload', io_offload.stats)
+metrics.register('session_cache', session_cache.stats)
+metrics.register('message_cache', message_cache.stats)
+metrics.register('media_pipeline', media_pipeline.stats)
+metrics.register('media_cache', media_cache.stats)
+metrics.register('presence', presence.stats)
+metrics.register('calls', call_registry.stats)
+metrics.register('ice_relay', ice_relay.stats)
+if telegram_storage:
+    metrics.register('telegram', telegram_storage.stats)
 
 @login_manager.user_loader
 def load_user(user_id):
+    # Recently validated sessions skip the primary-key read
+    cached_user = session_cache.get(int(user_id), session.get('user_session_id'))
+    if cached_user is not None:
+        return cached_user
+    
     user = db.session.get(User, int(user_id))
     if user:
         try:
             # Validate session integrity
             session_id = session.get('user_session_id')
             if hasattr(user, 'session_id') and (not session_id or user.session_id != session_id):
-                # Invalid session, force logout
-                user.is_online = False
-                user.session_id = None
-                db.session.commit()
+                # Stale session (logged out or replaced by a newer login). Leave the
+                # stored session_id alone: it may belong to the newer, valid session.
                 return None
+            session_cache.put(user)
         except Exception:
             # Handle cases where session_id column doesn't exist yet
             pass
@@ -54,6 +97,9 @@ app.register_blueprint(auth_bp, url_prefix='/wa/api/auth')
 app.register_blueprint(messages_bp, url_prefix='/wa/api/messages')
 app.register_blueprint(calls_bp, url_prefix='/wa/api/calls')
 app.register_blueprint(users_bp, url_prefix='/wa/api/users')
+app.register_blueprint(metrics_bp, url_prefix='/wa/api/metrics')
+app.register_blueprint(media_bp, url_prefix='/wa/media')
+app.register_blueprint(bootstrap_bp, url_prefix='/wa/api/bootstrap')
 
 # Routes
 @app.route('/')
@@ -88,17 +134,55 @@ def static_files(filename):
 # Socket.IO events
 @socketio.on('connect')
 def handle_connect():
+    from flask_login import current_user
     import logging
     logging.info('Client connected')
+    
+    if current_user.is_authenticated:
+        # Server-side rooms for pushes: per user and per login session
+        join_room(f'user_{current_user.id}')
+        session_id = session.get('user_session_id')
+        if session_id:
+            join_room(f'session_{session_id}')
+        presence.connect(current_user.id, request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     import logging
     logging.info('Client disconnected')
+    presence.disconnect(request.sid)
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    """Keeps last_seen fresh while the client is connected"""
+    from flask_login import current_user
+    if not presence.heartbeat(request.sid) and current_user.is_authenticated:
+        # Dropped as silent earlier, the socket is evidently still alive
+        presence.connect(current_user.id, request.sid)
+    return {'interval': presence.heartbeat_interval}
+
+def may_join(room):
+    """Whether the current user may join a room: its own user, session and conversation rooms"""
+    from flask_login import current_user
+    if not current_user.is_authenticated or not isinstance(room, str):
+        return False
+    if room.startswith('user_'):
+        return room == f'user_{current_user.id}'
+    if room.startswith('session_'):
+        return room == f"session_{session.get('user_session_id')}"
+    if room.startswith('chat_'):
+        return str(current_user.id) in room[len('chat_'):].split('_')
+    return True
 
 @socketio.on('join_room')
 def handle_join_room(data):
     room = data['room']
+    if isinstance(room, str) and room.startswith('call_') and signal_call(data) is None:
+        # Call rooms carry media negotiation, participants only
+        return {'error': 'Unknown call'}
+    if not may_join(room):
+        # Message fan-out relies on user rooms being private
+        return {'error': 'Unauthorized'}
     join_room(room)
     import logging
     logging.info(f'User joined room: {room}')
@@ -130,51 +214,104 @@ def handle_leave_room(data):
 
 @socketio.on('send_message')
 def handle_message(data):
-    room = data['room']
-    import logging
-    logging.info(f'Broadcasting message to room: {room}')
-    emit('receive_message', data, room=room, include_self=False)
+    """Persist a text message, fan it out to the receiver and ack with the stored id"""
+    from flask_login import current_user
+    from backend.encryption import message_encryption
+    from backend.messaging import create_text_message, message_payload, fanout_message
     
-    # Auto-emit delivery confirmation for the message
-    if 'message' in data and 'id' in data['message']:
-        socketio.sleep(0.1)  # Small delay to ensure message is saved
-        socketio.emit('message_delivered', {
-            'message_id': data['message']['id']
-        })
+    if not isinstance(data, dict):
+        return {'error': 'Invalid message data'}
+    
+    if not current_user.is_authenticated:
+        return {'error': 'Unauthorized'}
+    
+    encrypted_token = data.get('receiver_id')
+    content = data.get('content')
+    if not encrypted_token:
+        return {'error': 'Receiver token required'}
+    if not isinstance(content, str) or not content.strip():
+        return {'error': 'Message content required'}
+    
+    receiver_id = message_encryption.validate_secure_token(encrypted_token, current_user.id)
+    if receiver_id is None:
+        return {'error': 'Invalid or unauthorized token'}
+    
+    try:
+        message = create_text_message(current_user.id, receiver_id, content)
+    except Exception as e:
+        db.session.rollback()
+        import logging
+        logging.error(f'Failed to send message: {e}')
+        return {'error': 'Failed to send message'}
+    
+    fanout_message(message, content, current_user)
+    return {'message': message_payload(message, content), 'client_id': data.get('client_id')}
+
+def signal_call(data):
+    """Call a signal belongs to when the current user takes part in it, else None"""
+    from flask_login import current_user
+    if not current_user.is_authenticated or not isinstance(data, dict):
+        return None
+    call_id = data.get('call_id') or data.get('callId')
+    room = data.get('room')
+    if call_id is None and isinstance(room, str) and room.startswith('call_'):
+        call_id = room[len('call_'):]
+    return call_registry.route(call_id, current_user.id)
 
 @socketio.on('call_signal')
 def handle_call_signal(data):
-    if not data or not isinstance(data, dict):
-        return
-        
-    if 'receiver_id' in data and 'type' in data:
-        receiver_room = f'user_{data["receiver_id"]}'
-        import logging
-        logging.info(f'Call signal: {data["type"]} to receiver: {data["receiver_id"]}')
-        logging.info(f'Broadcasting to room: {receiver_room}')
-        emit('call_signal', data, room=receiver_room, include_self=False)
-    elif 'room' in data and 'type' in data:
-        room = data['room']
-        import logging
-        logging.info(f'Call signal: {data["type"]} to room: {room}')
-        emit('call_signal', data, room=room, include_self=False)
-    elif data.get('type') == 'call_cancelled':
-        # Handle call cancellation - broadcast to all users
-        import logging
-        logging.info(f'Call cancelled: {data["call_id"]}')
-        emit('call_signal', data, broadcast=True, include_self=False)
+    """Relay a call signal to the other participant only, applying any state change"""
+    from flask_login import current_user
+    call = signal_call(data)
+    if call is None or 'type' not in data:
+        return {'error': 'Unknown call'}
+    
+    action = SIGNAL_ACTIONS.get(data['type'])
+    if action:
+        error = call_registry.transition(call, current_user.id, action)
+        if error:
+            return {'error': error}
+    
+    if data['type'] in ('call_initiated', 'call_cancelled'):
+        # The callee has not joined the call room yet, ring or stop ringing all their tabs
+        emit('call_signal', data, room=f'user_{call.peer_of(current_user.id)}')
+    else:
+        emit('call_signal', data, room=f'call_{call.id}', include_self=False)
 
 @socketio.on('webrtc_offer')
 def handle_webrtc_offer(data):
-    emit('webrtc_offer', data, room=data['room'], include_self=False)
+    call = signal_call(data)
+    if call is not None:
+        call_registry.mark(call, 'offer')
+        emit('webrtc_offer', data, room=f'call_{call.id}', include_self=False)
 
 @socketio.on('webrtc_answer')
 def handle_webrtc_answer(data):
-    emit('webrtc_answer', data, room=data['room'], include_self=False)
+    call = signal_call(data)
+    if call is not None:
+        call_registry.mark(call, 'answer')
+        emit('webrtc_answer', data, room=f'call_{call.id}', include_self=False)
 
 @socketio.on('webrtc_ice')
 def handle_webrtc_ice(data):
-    emit('webrtc_ice', data, room=data['room'], include_self=False)
+    """Single candidate from older clients, coalesced into batches on the server"""
+    call = signal_call(data)
+    if call is not None and data.get('candidate'):
+        ice_relay.add(call.id, request.sid, [data['candidate']])
+
+@socketio.on('webrtc_ice_batch')
+def handle_webrtc_ice_batch(data):
+    """Several trickle-ICE candidates; done marks the sender's end-of-candidates"""
+    from flask_login import current_user
+    call = signal_call(data)
+    candidates = data.get('candidates') if call is not None else None
+    if not isinstance(candidates, list):
+        return
+    done = bool(data.get('done'))
+    # Already coalesced by the client, no second wait here
+    ice_relay.forward(call.id, request.sid, candidates, done)
+    if done:
+        call_registry.mark(call, 'ice_done', current_user.id)
 
 @socketio.on('message_delivered')
 def handle_message_delivered(data):
@@ -198,7 +335,7 @@ def handle_message_delivered(data):
 
 @socketio.on('message_read')
 def handle_message_read(data):
-    from backend.models import Message
+    from backend.models import Message, Conversation
     from datetime import datetime
     
     message_id = data.get('message_id')
@@ -208,6 +345,8 @@ def handle_message_read(data):
             if not message.is_delivered:
                 message.is_delivered = True
                 message.delivered_at = datetime.utcnow()
+            if not message.is_read:
+                Conversation.mark_read(message.receiver_id, message.sender_id, 1)
             message.is_read = True
             message.read_at = datetime.utcnow()
             db.session.commit()
@@ -219,8 +358,36 @@ def handle_message_read(data):
                 'status': 'read'
             }, room=sender_room)
 
+@socketio.on('message_receipts')
+def handle_message_receipts(data):
+    """Batch receipt: {status, peer_id, up_to_id} or {status, message_ids}"""
+    from flask_login import current_user
+    from backend.receipts import apply_receipts, notify_senders
+    
+    if not current_user.is_authenticated or not isinstance(data, dict):
+        return {'error': 'Unauthorized'}
+    
+    status = data.get('status', 'read')
+    try:
+        changed = apply_receipts(
+            current_user.id, status,
+            peer_id=data.get('peer_id'),
+            up_to_id=data.get('up_to_id'),
+            message_ids=data.get('message_ids')
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        import logging
+        logging.error(f'Batch receipt failed: {e}')
+        return {'error': 'Failed to apply receipts'}
+    
+    notify_senders(changed, status)
+    return {'updated': sum(len(ids) for ids in changed.values())}
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
     debug_mode = os.getenv('FLASK_ENV') == 'development'
-socketio.run(app, debug=debug_mode, host='0.0.0.0', port=5001, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # Single process development server; use start_cluster.sh for multiple workers
+    socketio.run(app, debug=debug_mode, host='0.0.0.0', port=int(os.getenv('PORT', 5001)), allow_unsafe_werkzeug=True)
@@ -0,0 +1,138 @@
+"""
+Local message broker for running several Socket.IO workers on one box.
+
+Workers share room emits through a Flask-SocketIO client manager. For
+production any ``SOCKETIO_MESSAGE_QUEUE`` URL supported by Flask-SocketIO
+works (redis://, amqp://, kafka://, zmq+tcp://). For a single machine without
+external services use ``unix:///path/to/broker.sock`` and start the broker
+with ``python -m backend.broker /path/to/broker.sock``.
+
+Like the other Flask-SocketIO message queues, this needs a monkey patched
+eventlet process (gunicorn's eventlet worker does that automatically).
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+import socketio
+
+DEFAULT_SOCKET_PATH = '/tmp/whatsapp-broker.sock'
+
+def _socket_path(url):
+    path = url[len('unix://'):] if url.startswith('unix://') else url
+    return path or DEFAULT_SOCKET_PATH
+
+class UnixSocketManager(socketio.PubSubManager):
+    """Socket.IO client manager that publishes through the local unix socket broker"""
+    name = 'unix'
+
+    def __init__(self, url='unix://' + DEFAULT_SOCKET_PATH, channel='flask-socketio', write_only=False, logger=None):
+        self.socket_path = _socket_path(url)
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _connect(self, role):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        sock.sendall(role + b'\n')
+        return sock
+
+    def _publish(self, data):
+        line = (json.dumps({'channel': self.channel, 'data': data}) + '\n').encode()
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect(b'pub')
+                    self._publisher.sendall(line)
+                    return
+                except OSError:
+                    # Broker restarted, reconnect once
+                    self._publisher = None
+                    if attempt:
+                        raise
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                sock = self._connect(b'sub')
+                retry_sleep = 1
+                with sock.makefile('rb') as stream:
+                    for line in stream:
+                        try:
+                            message = json.loads(line)
+                        except ValueError:
+                            continue
+                        if message.get('channel') == self.channel:
+                            yield message['data']
+            except OSError as e:
+                logging.error(f'Broker connection lost ({e}), retrying in {retry_sleep}s')
+            time.sleep(retry_sleep)
+            retry_sleep = min(retry_sleep * 2, 60)
+
+def socketio_queue_options(url):
+    """SocketIO() keyword arguments for the configured message queue URL"""
+    if not url:
+        return {}
+    if url.startswith('unix://'):
+        return {'client_manager': UnixSocketManager(url)}
+    return {'message_queue': url}
+
+class BrokerServer:
+    """Relays every line published by a client to all subscribed clients.
+
+    Clients open with a "pub" or "sub" line; only subscribers receive traffic,
+    so publish-only connections never fill up their receive buffers.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(128)
+        logging.info(f'Broker listening on {self.path}')
+        while True:
+            client, _ = server.accept()
+            threading.Thread(target=self._relay, args=(client,), daemon=True).start()
+
+    def _relay(self, client):
+        try:
+            with client.makefile('rb') as stream:
+                if stream.readline().strip() == b'sub':
+                    with self.lock:
+                        self.clients.add(client)
+                for line in stream:
+                    self.broadcast(line)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.clients.discard(client)
+            client.close()
+
+    def broadcast(self, line):
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.sendall(line)
+            except OSError:
+                with self.lock:
+                    self.clients.discard(client)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    BrokerServer(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOCKET_PATH).serve_forever()
@@ -0,0 +1,422 @@
+from sqlalchemy import bindparam
+from backend.models import Call, db
+from backend.metrics import LatencyWindow
+from backend.call_stats import record_finished_calls
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+import time
+
+# Call setup phases measured by the registry, see CallRegistry.mark
+SETUP_PHASES = ('ring_to_answer', 'answer_to_offer', 'offer_to_answer', 'answer_to_ice_complete', 'setup_total')
+
+# Socket signal types that move a call to another state
+SIGNAL_ACTIONS = {
+    'call_answered': 'answer',
+    'call_rejected': 'reject',
+    'call_cancelled': 'cancel',
+    'call_ended': 'end'
+}
+
+class CallState:
+    __slots__ = ('id', 'caller_id', 'receiver_id', 'call_type', 'status', 'started_at', 'answered_at', 'ended_at', 'duration', 'timeline', 'ice_done')
+
+    def __init__(self, call):
+        self.id = call.id
+        self.caller_id = call.caller_id
+        self.receiver_id = call.receiver_id
+        self.call_type = call.call_type
+        self.status = call.status
+        self.started_at = call.started_at or datetime.utcnow()
+        self.answered_at = None
+        self.ended_at = call.ended_at
+        self.duration = call.duration or 0
+        self.timeline = {}  # setup event -> monotonic time it was seen on this worker
+        self.ice_done = set()  # participants that sent end-of-candidates
+
+    @property
+    def finished(self):
+        return self.status in ('ended', 'missed')
+
+    def is_participant(self, user_id):
+        return user_id in (self.caller_id, self.receiver_id)
+
+    def peer_of(self, user_id):
+        return self.receiver_id if user_id == self.caller_id else self.caller_id
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule and cancel, one slot visited per tick"""
+
+    def __init__(self, slots=64, tick=1.0):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]  # key -> remaining full rotations
+        self._where = {}  # key -> slot index
+        self._cursor = 0
+
+    def schedule(self, key, delay):
+        self.cancel(key)
+        ticks = max(int(round(delay / self.tick)), 1)
+        index = (self._cursor + ticks) % len(self._slots)
+        self._slots[index][key] = (ticks - 1) // len(self._slots)
+        self._where[key] = index
+
+    def cancel(self, key):
+        index = self._where.pop(key, None)
+        if index is not None:
+            self._slots[index].pop(key, None)
+
+    def advance(self):
+        """Move one tick forward and return the keys that expired"""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        expired = []
+        for key, rounds in list(slot.items()):
+            if rounds:
+                slot[key] = rounds - 1
+            else:
+                del slot[key]
+                del self._where[key]
+                expired.append(key)
+        return expired
+
+    def __len__(self):
+        return len(self._where)
+
+class CallRegistry:
+    """Live call state, signal routing and ring timeouts.
+
+    Calls are tracked in memory from initiation to their final state. Signals
+    are only relayed between the two participants, unanswered calls are
+    marked missed after CALL_RING_TIMEOUT seconds by a timer wheel, and state
+    changes are written in batched UPDATEs every CALL_FLUSH_INTERVAL seconds.
+
+    Another worker learns about a call by loading its row on first use. The
+    row is the shared state while a call rings: answers and ring timeouts
+    are written at once with UPDATEs guarded on status = 'initiated', and
+    only the one that changes the row takes effect, so a timer on the
+    caller's worker cannot end a call answered on the callee's. Ringing
+    calls are re-read on every lookup to pick up such changes.
+    """
+
+    def __init__(self):
+        self.ring_timeout = float(os.getenv('CALL_RING_TIMEOUT', 45))
+        self.flush_interval = float(os.getenv('CALL_FLUSH_INTERVAL', 1))
+        self.app = None
+        self.socketio = None
+        self._calls = {}  # call id -> CallState
+        self._pending = {}  # call id -> status to write
+        self._wheel = TimerWheel()
+        self._started = False
+        self._lock = threading.Lock()
+        self.timeouts = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.signals_routed = 0
+        self.signals_rejected = 0
+        self.setup_latency = {phase: LatencyWindow() for phase in SETUP_PHASES}
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+
+    def start(self):
+        """Start the timers and expire calls a previous process left ringing"""
+        self._ensure_started()
+
+    def register(self, call):
+        """Track a freshly inserted call and start its ring timer"""
+        self._ensure_started()
+        state = CallState(call)
+        state.timeline['initiated'] = time.monotonic()
+        with self._lock:
+            self._calls[state.id] = state
+            if state.status == 'initiated':
+                self._wheel.schedule(state.id, self.ring_timeout)
+        return state
+
+    def get(self, call_id):
+        """Live state of a call, loading it from the database on first use"""
+        try:
+            call_id = int(call_id)
+        except (TypeError, ValueError):
+            return None
+        with self._lock:
+            state = self._calls.get(call_id)
+        if state is not None:
+            if state.status == 'initiated':
+                # May have been answered or timed out on another worker
+                self._refresh(state)
+            return state
+        call = db.session.get(Call, call_id)
+        if call is None:
+            return None
+        self._ensure_started()
+        state = CallState(call)
+        with self._lock:
+            state = self._calls.setdefault(call_id, state)
+            if state.status == 'initiated' and call_id not in self._pending:
+                started = (datetime.utcnow() - state.started_at).total_seconds()
+                self._wheel.schedule(call_id, max(self.ring_timeout - started, self._wheel.tick))
+        return state
+
+    def _refresh(self, state):
+        """Adopt the stored status of a ringing call; returns it"""
+        stored = db.session.execute(db.select(Call.status).where(Call.id == state.id)).scalar()
+        with self._lock:
+            if state.status == 'initiated' and stored not in (None, 'initiated'):
+                state.status = stored
+                state.ended_at = state.ended_at or (datetime.utcnow() if state.finished else None)
+                self._wheel.cancel(state.id)
+            return state.status
+
+    def peek(self, call_id):
+        """Live state if this worker tracks the call, without touching the database"""
+        with self._lock:
+            return self._calls.get(call_id)
+
+    def route(self, call_id, user_id):
+        """The call if user_id takes part in it, else None"""
+        state = self.get(call_id)
+        allowed = state is not None and state.is_participant(user_id)
+        with self._lock:
+            if allowed:
+                self.signals_routed += 1
+            else:
+                self.signals_rejected += 1
+        return state if allowed else None
+
+    def transition(self, state, user_id, action):
+        """Apply answer, reject, cancel or end by user_id; returns an error string or None.
+
+        Repeating a transition that already happened is accepted, clients send
+        the same change over REST and over the socket.
+        """
+        if action == 'answer':
+            return self._answer(state, user_id)
+        now = datetime.utcnow()
+        with self._lock:
+            if action in ('reject', 'cancel'):
+                if user_id != (state.receiver_id if action == 'reject' else state.caller_id):
+                    return 'Unauthorized'
+                if state.status != 'initiated':
+                    return None
+                state.status = 'missed'
+                state.ended_at = now
+            elif action == 'end':
+                if not state.is_participant(user_id):
+                    return 'Unauthorized'
+                if state.finished:
+                    return None
+                # Hanging up before the other side answered is a missed call
+                state.status = 'missed' if state.status == 'initiated' else 'ended'
+                state.ended_at = now
+                if state.status == 'ended':
+                    state.duration = int((now - (state.answered_at or state.started_at)).total_seconds())
+            else:
+                return 'Unknown action'
+            self._wheel.cancel(state.id)
+            self._pending[state.id] = state.status
+        return None
+
+    def _answer(self, state, user_id):
+        """Write the answer at once, unless the call stopped ringing first"""
+        if user_id != state.receiver_id:
+            return 'Unauthorized'
+        with self._lock:
+            status = state.status
+        if status == 'answered':
+            return None
+        if status != 'initiated':
+            return f'Call already {status}'
+        table = Call.__table__
+        answered = db.session.execute(
+            table.update().where(table.c.id == state.id, table.c.status == 'initiated').values(status='answered')
+        ).rowcount == 1
+        db.session.commit()
+        if not answered:
+            status = self._refresh(state)
+            return None if status == 'answered' else f'Call already {status}'
+        with self._lock:
+            if state.status == 'initiated':
+                state.status = 'answered'
+                state.answered_at = datetime.utcnow()
+                self._mark(state, 'answered')
+            self._wheel.cancel(state.id)
+        return None
+
+    def mark(self, state, event, user_id=None):
+        """Record a signaling step of call setup: offer, answer or ice_done (per sender)"""
+        with self._lock:
+            if event == 'ice_done':
+                state.ice_done.add(user_id)
+                if len(state.ice_done) < 2:
+                    return
+                event = 'ice_complete'
+            self._mark(state, event)
+
+    def _mark(self, state, event):
+        if event in state.timeline:
+            return  # Renegotiation, only the first setup is measured
+        timeline = state.timeline
+        timeline[event] = time.monotonic()
+        # (phase, from event, to event); a phase is recorded once both ends were seen here
+        for phase, start, end in (
+            ('ring_to_answer', 'initiated', 'answered'),
+            ('answer_to_offer', 'answered', 'offer'),
+            ('offer_to_answer', 'offer', 'answer'),
+            ('answer_to_ice_complete', 'answer', 'ice_complete'),
+            ('setup_total', 'answered', 'ice_complete')
+        ):
+            if event == end and start in timeline:
+                self.setup_latency[phase].record(timeline[end] - timeline[start])
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        self._expire_stale()
+        elapsed = 0.0
+        while True:
+            self.socketio.sleep(self._wheel.tick)
+            with self._lock:
+                expired = [self._calls[call_id] for call_id in self._wheel.advance() if call_id in self._calls]
+                expired = [state for state in expired if state.status == 'initiated']
+            if expired:
+                self._expire(expired)
+            elapsed += self._wheel.tick
+            if elapsed >= self.flush_interval:
+                self.flush()
+                elapsed = 0.0
+
+    def _expire(self, states):
+        """Mark ringing calls missed, each only if no worker changed its row meanwhile"""
+        table = Call.__table__
+        now = datetime.utcnow()
+        missed = []
+        with self.app.app_context():
+            try:
+                for state in states:
+                    if db.session.execute(
+                        table.update().where(table.c.id == state.id, table.c.status == 'initiated')
+                        .values(status='missed', ended_at=now)
+                    ).rowcount == 1:
+                        missed.append(state)
+                record_finished_calls([state.id for state in missed])
+                db.session.commit()
+                # The others were answered or ended elsewhere, pick up their state
+                for state in states:
+                    if state not in missed:
+                        self._refresh(state)
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Could not time out ringing calls: {e}")
+                with self._lock:
+                    # Try again on the next tick
+                    for state in states:
+                        self._wheel.schedule(state.id, self._wheel.tick)
+                return
+            finally:
+                db.session.remove()
+        with self._lock:
+            for state in missed:
+                if state.status == 'initiated':
+                    state.status = 'missed'
+                    state.ended_at = now
+                self.timeouts += 1
+            # Stored already; forget it unless a transition is still to be written
+            for state in missed:
+                if state.id not in self._pending:
+                    self._calls.pop(state.id, None)
+        for state in missed:
+            self._notify_missed(state)
+
+    def _notify_missed(self, state):
+        payload = {'type': 'call_missed', 'call_id': state.id, 'reason': 'timeout'}
+        for user_id in (state.caller_id, state.receiver_id):
+            self.socketio.emit('call_signal', payload, room=f'user_{user_id}')
+
+    def _expire_stale(self):
+        """Calls left ringing by a previous process will never be answered"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ring_timeout)
+        with self.app.app_context():
+            try:
+                Call.query.filter(Call.status == 'initiated', Call.started_at < cutoff).update(
+                    {'status': 'missed', 'ended_at': datetime.utcnow()}, synchronize_session=False
+                )
+                db.session.commit()
+                # Also catches calls finished while stats could not be written
+                while record_finished_calls():
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Could not expire stale calls: {e}")
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        """Write pending state changes, one guarded executemany UPDATE per target status"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            rows = {'ended': [], 'missed': []}
+            for call_id, status in pending.items():
+                state = self._calls[call_id]
+                rows[status].append({
+                    'call_id': call_id,
+                    'ended_at': state.ended_at,
+                    'duration': state.duration
+                })
+        if not pending:
+            return
+        table = Call.__table__
+        statements = {
+            'ended': table.update().where(table.c.id == bindparam('call_id'), (table.c.status == 'initiated') | (table.c.status == 'answered'))
+                .values(status='ended', ended_at=bindparam('ended_at'), duration=bindparam('duration')),
+            'missed': table.update().where(table.c.id == bindparam('call_id'), table.c.status == 'initiated')
+                .values(status='missed', ended_at=bindparam('ended_at'))
+        }
+        with self.app.app_context():
+            try:
+                for status in ('ended', 'missed'):
+                    if rows[status]:
+                        db.session.execute(statements[status], rows[status])
+                record_finished_calls([row['call_id'] for row in rows['ended'] + rows['missed']])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Call state flush failed: {e}")
+                with self._lock:
+                    for call_id, status in pending.items():
+                        self._pending.setdefault(call_id, status)
+                return
+            finally:
+                db.session.remove()
+        with self._lock:
+            # Finished calls are forgotten once stored; a late signal reloads the final row
+            for call_id in pending:
+                state = self._calls.get(call_id)
+                if state is not None and state.finished and call_id not in self._pending:
+                    del self._calls[call_id]
+            self.flushes += 1
+            self.rows_flushed += len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_calls': len(self._calls),
+                'ringing': len(self._wheel),
+                'pending_writes': len(self._pending),
+                'timeouts': self.timeouts,
+                'flushes': self.flushes,
+                'rows_flushed': self.rows_flushed,
+                'signals_routed': self.signals_routed,
+                'signals_rejected': self.signals_rejected,
+                'setup_latency': {phase: window.summary() for phase, window in self.setup_latency.items()}
+            }
+
+# Global instance
+call_registry = CallRegistry()
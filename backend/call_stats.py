@@ -0,0 +1,97 @@
+"""
+Incremental per-contact call statistics.
+
+Each finished call (ended or missed) is folded once into the CallStat rows
+of both participants and flagged with Call.stats_counted, so the stats
+endpoint reads one row per contact instead of scanning the call history.
+"""
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from backend.models import Call, CallStat, db
+import os
+
+FINAL_STATUSES = ('ended', 'missed')
+BATCH_SIZE = int(os.getenv('CALL_STATS_BATCH_SIZE', 1000))
+COUNTERS = ('calls', 'outgoing', 'incoming', 'answered', 'missed', 'total_duration')
+
+def record_finished_calls(call_ids=None):
+    """Fold finished, not yet counted calls into CallStat; the caller commits.
+
+    call_ids restricts the work to those calls, None takes the next
+    BATCH_SIZE uncounted ones. Returns how many calls were counted.
+    """
+    query = Call.query.filter(Call.stats_counted == False, Call.status.in_(FINAL_STATUSES))
+    if call_ids is not None:
+        if not call_ids:
+            return 0
+        query = query.filter(Call.id.in_(call_ids))
+    else:
+        query = query.order_by(Call.id).limit(BATCH_SIZE)
+    calls = query.with_for_update().all()
+    if not calls:
+        return 0
+
+    ids = [call.id for call in calls]
+    claimed = Call.query.filter(Call.id.in_(ids), Call.stats_counted == False).update(
+        {'stats_counted': True}, synchronize_session=False
+    )
+    if claimed != len(ids):
+        # Another writer counted some of them first; retry the batch later
+        raise RuntimeError('Call stats batch claimed concurrently')
+
+    deltas = {}
+    for call in calls:
+        answered = call.status == 'ended'
+        for user_id, peer_id, direction in (
+            (call.caller_id, call.receiver_id, 'outgoing'),
+            (call.receiver_id, call.caller_id, 'incoming')
+        ):
+            delta = deltas.setdefault((user_id, peer_id), dict.fromkeys(COUNTERS, 0))
+            delta['calls'] += 1
+            delta[direction] += 1
+            delta['answered' if answered else 'missed'] += 1
+            delta['total_duration'] += (call.duration or 0) if answered else 0
+            if call.started_at and (delta.get('last_call_at') is None or call.started_at > delta['last_call_at']):
+                delta['last_call_at'] = call.started_at
+
+    _ensure_rows(deltas.keys())
+    table = CallStat.__table__
+    values = {name: table.c[name] + bindparam(f'add_{name}') for name in COUNTERS}
+    values['last_call_at'] = db.case(
+        ((table.c.last_call_at.is_(None)) | (table.c.last_call_at < bindparam('last_at')), bindparam('last_at')),
+        else_=table.c.last_call_at
+    )
+    statement = table.update().where(
+        table.c.user_id == bindparam('stat_user'), table.c.peer_id == bindparam('stat_peer')
+    ).values(values)
+    db.session.execute(statement, [
+        {
+            'stat_user': user_id,
+            'stat_peer': peer_id,
+            'last_at': delta.get('last_call_at'),
+            **{f'add_{name}': delta[name] for name in COUNTERS}
+        }
+        for (user_id, peer_id), delta in deltas.items()
+    ])
+    return len(calls)
+
+def _ensure_rows(pairs):
+    """Insert zeroed CallStat rows for pairs that have none yet"""
+    pairs = set(pairs)
+    user_ids = {user_id for user_id, _ in pairs}
+    existing = {tuple(row) for row in db.session.execute(
+        db.select(CallStat.user_id, CallStat.peer_id).where(CallStat.user_id.in_(user_ids))
+    )}
+    for user_id, peer_id in pairs - existing:
+        try:
+            with db.session.begin_nested():
+                db.session.add(CallStat(user_id=user_id, peer_id=peer_id, **dict.fromkeys(COUNTERS, 0)))
+        except IntegrityError:
+            pass  # Created concurrently, the UPDATE applies to that row
+
+def stats_for(user_id):
+    """CallStat rows of a user with the contact loaded, most recent contact first"""
+    return CallStat.query.options(joinedload(CallStat.peer)).filter(
+        CallStat.user_id == user_id
+    ).order_by(CallStat.last_call_at.desc()).all()
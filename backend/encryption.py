@@ -1,14 +1,26 @@
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from collections import OrderedDict
 import base64
+import hashlib
+import hmac
 import os
 import json
+import threading
+
+TOKEN_VERSION = 'v1'
+TOKEN_SIGNATURE_BYTES = 16
 
 class MessageEncryption:
     def __init__(self):
         self.key = self._get_or_create_key()
         self.cipher = Fernet(self.key)
+        # Separate key for conversation tokens so they never share a MAC with message content
+        self.token_key = hmac.new(self.key, b'conversation-token', hashlib.sha256).digest()
+        self.token_cache_size = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+        self._verified_tokens = OrderedDict()
+        self._token_lock = threading.Lock()
     
     def _get_or_create_key(self):
         """Get encryption key from environment or create new one"""
@@ -22,20 +34,57 @@ class MessageEncryption:
         logging.warning("Generated new encryption key - add ENCRYPTION_KEY to .env file")
         return key
     
+    def _token_signature(self, current_user_id, target_user_id):
+        payload = f"{TOKEN_VERSION}.{current_user_id}.{target_user_id}".encode()
+        digest = hmac.new(self.token_key, payload, hashlib.sha256).digest()[:TOKEN_SIGNATURE_BYTES]
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+    
     def create_secure_token(self, current_user_id, target_user_id):
-        """Create secure token that only works for specific user pair"""
-        token_data = f"{current_user_id}:{target_user_id}"
-        return self.cipher.encrypt(token_data.encode()).decode()
+        """Create secure token that only works for specific user pair.
+        
+        Format is v1.<current>.<target>.<hmac>, a short signed token that is
+        verified with one HMAC instead of a Fernet decrypt.
+        """
+        signature = self._token_signature(current_user_id, target_user_id)
+        return f"{TOKEN_VERSION}.{current_user_id}.{target_user_id}.{signature}"
+    
+    def create_secure_tokens(self, current_user_id, target_user_ids):
+        """Tokens for many targets at once, keyed by target user ID"""
+        return {target_id: self.create_secure_token(current_user_id, target_id) for target_id in target_user_ids}
     
     def validate_secure_token(self, token, current_user_id):
         """Validate token and return target user ID if valid"""
+        if not token:
+            return None
+        with self._token_lock:
+            cached = self._verified_tokens.get(token)
+            if cached is not None:
+                self._verified_tokens.move_to_end(token)
+        if cached is None:
+            cached = self._verify_token(token)
+            if cached is None:
+                return None
+            with self._token_lock:
+                self._verified_tokens[token] = cached
+                if len(self._verified_tokens) > self.token_cache_size:
+                    self._verified_tokens.popitem(last=False)
+        token_current_id, target_id = cached
+        return target_id if token_current_id == current_user_id else None
+    
+    def _verify_token(self, token):
+        """Return (current_id, target_id) for an authentic token, else None"""
         try:
+            if token.startswith(TOKEN_VERSION + '.'):
+                _, token_current_id, target_id, signature = token.split('.')
+                token_current_id, target_id = int(token_current_id), int(target_id)
+                expected = self._token_signature(token_current_id, target_id)
+                if not hmac.compare_digest(signature, expected):
+                    return None
+                return token_current_id, target_id
+            # Legacy Fernet tokens issued before the compact format
             decrypted = self.cipher.decrypt(token.encode()).decode()
             token_current_id, target_id = decrypted.split(':')
-            
-            if int(token_current_id) == current_user_id:
-                return int(target_id)
-            return None
+            return int(token_current_id), int(target_id)
         except:
             return None
     
@@ -54,6 +103,10 @@ class MessageEncryption:
         except:
             return encrypted_content  # Return as-is if decryption fails
     
+    def decrypt_messages(self, encrypted_contents):
+        """Decrypt a batch of message contents in one pass"""
+        return [self.decrypt_message(content) for content in encrypted_contents]
+    
     def encrypt_api_response(self, data):
         """Encrypt entire API response"""
         json_str = json.dumps(data)
@@ -0,0 +1,84 @@
+from backend.metrics import LatencyWindow
+import os
+import threading
+import time
+
+class IceRelay:
+    """Relays trickle-ICE candidates to the call room as webrtc_ice_batch events.
+
+    Clients that send webrtc_ice_batch already coalesce on their side, their
+    batches are forwarded at once. Single candidates from older clients are
+    buffered per (call, sending socket) for ICE_BATCH_WINDOW seconds and sent
+    as one event, early when the buffer reaches ICE_BATCH_MAX candidates.
+    The end-of-candidates marker (done) is always delivered.
+    """
+
+    def __init__(self):
+        self.window = float(os.getenv('ICE_BATCH_WINDOW', 0.05))
+        self.max_batch = int(os.getenv('ICE_BATCH_MAX', 20))
+        self.socketio = None
+        self._buffers = {}  # (call id, sid) -> (monotonic time of the first candidate, candidates)
+        self._lock = threading.Lock()
+        self.hold_time = LatencyWindow()
+        self.candidates_relayed = 0
+        self.batches_relayed = 0
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    def forward(self, call_id, sid, candidates, done=False):
+        """Relay a client batch now, after anything still buffered from the same socket"""
+        self._flush((call_id, sid), done, candidates)
+
+    def add(self, call_id, sid, candidates):
+        """Buffer single candidates for the batch window"""
+        key = (call_id, sid)
+        with self._lock:
+            buffered = self._buffers.get(key)
+            first = buffered is None
+            if first:
+                buffered = self._buffers[key] = (time.monotonic(), [])
+            buffered[1].extend(candidates)
+            send_now = len(buffered[1]) >= self.max_batch
+        if send_now:
+            self._flush(key, False)
+        elif first:
+            self.socketio.start_background_task(self._flush_later, key)
+
+    def _flush_later(self, key):
+        self.socketio.sleep(self.window)
+        self._flush(key, False)
+
+    def _flush(self, key, done, extra=()):
+        with self._lock:
+            buffered = self._buffers.pop(key, None)
+        since, candidates = buffered or (None, [])
+        candidates = candidates + list(extra)
+        if not candidates and not done:
+            return  # Already sent early
+        call_id, sid = key
+        self.socketio.emit('webrtc_ice_batch', {
+            'call_id': call_id,
+            'room': f'call_{call_id}',
+            'candidates': candidates,
+            'done': done
+        }, room=f'call_{call_id}', skip_sid=sid)
+        if since is not None:
+            self.hold_time.record(time.monotonic() - since)
+        with self._lock:
+            self.candidates_relayed += len(candidates)
+            self.batches_relayed += 1
+
+    def stats(self):
+        with self._lock:
+            batches, candidates = self.batches_relayed, self.candidates_relayed
+        return {
+            'batches_relayed': batches,
+            'candidates_relayed': candidates,
+            'candidates_per_batch': round(candidates / batches, 2) if batches else 0.0,
+            'buffered': len(self._buffers),
+            'hold_time': self.hold_time.summary()
+        }
+
+# Global instance
+ice_relay = IceRelay()
@@ -0,0 +1,135 @@
+from sqlalchemy.exc import IntegrityError
+from backend.models import MediaBlob, db
+from backend.media_cache import media_cache
+from backend.thumbnails import remove_derivatives
+import hashlib
+import os
+import uuid
+
+UPLOAD_DIR = 'uploads'
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def save_upload(file):
+    """Stream an uploaded file to a temporary path, hashing it on the way.
+
+    Returns (temp_path, sha256 hex digest, size in bytes).
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    temp_path = os.path.join(UPLOAD_DIR, f'.{uuid.uuid4().hex}.part')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+    except Exception:
+        _remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+def hash_file(path):
+    """SHA-256 hex digest and size of a file on disk; CPU-bound for large files"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def acquire_blob(file, extension):
+    """Store an upload as a MediaBlob, linking to an existing blob with the same bytes.
+
+    Returns (blob, created) with the reference already counted; the caller commits.
+    """
+    temp_path, sha256, size = save_upload(file)
+    return acquire_stored_blob(temp_path, sha256, size, file.mimetype, extension)
+
+def acquire_stored_blob(temp_path, sha256, size, mime_type, extension):
+    """Same as acquire_blob for content already written to temp_path, which is consumed"""
+    try:
+        blob = _link_existing(sha256, temp_path, extension)
+        if blob is not None:
+            return blob, False
+
+        blob = MediaBlob(
+            sha256=sha256,
+            size=size,
+            mime_type=mime_type,
+            local_path=_place(temp_path, sha256, extension),
+            refcount=1
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # Same content sent concurrently, use the row that won
+            blob = _link_existing(sha256, temp_path, extension)
+            if blob is None:
+                raise
+            return blob, False
+        return blob, True
+    finally:
+        # No-op once the upload has been moved into place
+        _remove(temp_path)
+
+def _link_existing(sha256, temp_path, extension):
+    blob = MediaBlob.query.filter_by(sha256=sha256).first()
+    if blob is None:
+        return None
+    linked = MediaBlob.query.filter_by(id=blob.id).update(
+        {'refcount': MediaBlob.refcount + 1}, synchronize_session=False
+    )
+    if not linked:
+        return None  # Reclaimed in the meantime
+    if not blob.telegram_file_id and not (blob.local_path and os.path.exists(blob.local_path)):
+        # Neither copy survived, this upload restores the content
+        blob.local_path = _place(temp_path, sha256, extension)
+    return blob
+
+def _place(temp_path, sha256, extension):
+    path = os.path.join(UPLOAD_DIR, f'{sha256}.{extension}')
+    os.replace(temp_path, path)
+    return path
+
+def release_blob(blob_id):
+    """Drop one reference; returns (local_path, telegram_file_id, sha256) if the blob was deleted.
+
+    The caller commits and then passes the result to reclaim_blob_files.
+    """
+    MediaBlob.query.filter_by(id=blob_id).update(
+        {'refcount': MediaBlob.refcount - 1}, synchronize_session=False
+    )
+    blob = db.session.get(MediaBlob, blob_id, populate_existing=True)
+    if blob is None or blob.refcount > 0:
+        return None
+    released = (blob.local_path, blob.telegram_file_id, blob.sha256)
+    # Conditional delete so a concurrent send that just linked the blob keeps it
+    deleted = MediaBlob.query.filter(MediaBlob.id == blob_id, MediaBlob.refcount <= 0).delete(synchronize_session=False)
+    db.session.expunge(blob)
+    return released if deleted else None
+
+def reclaim_blob_files(released):
+    """Remove the local and cached copies of a deleted blob, thumbnails included"""
+    if not released:
+        return
+    local_path, telegram_file_id, sha256 = released
+    if local_path:
+        _remove(local_path)
+    remove_derivatives(sha256)
+    if telegram_file_id:
+        media_cache.discard(telegram_file_id)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,270 @@
+from collections import OrderedDict
+from flask import send_file
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+from backend.offload import io_offload, native_threading
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+class CacheEntry:
+    __slots__ = ('digest', 'path', 'size', 'mimetype', 'created')
+
+    def __init__(self, digest, path, size, mimetype, created):
+        self.digest = digest
+        self.path = path
+        self.size = size
+        self.mimetype = mimetype
+        self.created = created
+
+class MediaDiskCache:
+    """Content-addressed disk cache for Telegram-backed media.
+
+    Blobs live under UPLOAD_FOLDER/cache named by their SHA-256, with a small
+    JSON sidecar holding the mimetype and the Telegram file ids that map to
+    it. The total size is capped at MEDIA_CACHE_MAX_BYTES with LRU eviction.
+    Concurrent first requests for one file share a single download.
+
+    fetch() is called from the request's green thread: the single-flight
+    bookkeeping happens there and only the download itself goes to
+    io_offload. The index lock is also taken on those pool threads, so it
+    is a native lock and is never held across a wait. Range requests should
+    not wait for a whole file: prefetch() fills the cache in the background
+    while the caller streams from upstream.
+    """
+
+    def __init__(self):
+        self.directory = os.path.join(os.getenv('UPLOAD_FOLDER', 'uploads'), 'cache')
+        self.max_bytes = int(os.getenv('MEDIA_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        # Larger files are streamed straight through instead of evicting the whole cache
+        self.max_entry_bytes = int(os.getenv('MEDIA_CACHE_MAX_ENTRY_BYTES', self.max_bytes // 4))
+        self._entries = OrderedDict()  # digest -> CacheEntry, least recently used first
+        self._keys = {}  # telegram file id -> digest
+        self._flights = {}  # telegram file id -> Event while downloading
+        self._bytes = 0
+        self._loaded = False
+        self._lock = native_threading().Lock()
+        # Green events under eventlet once init_app has run
+        self._create_event = threading.Event
+        self.socketio = None
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.shared_downloads = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+        self._create_event = socketio.server.eio.create_event
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def lookup(self, key):
+        """Cached entry for a Telegram file id, or None"""
+        self._ensure_loaded()
+        with self._lock:
+            entry = self._entries.get(self._keys.get(key))
+            if entry is not None and not os.path.exists(entry.path):
+                # Removed behind our back, e.g. by another worker's eviction
+                self._drop(entry.digest)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry.digest)
+            self.hits += 1
+            return entry
+
+    def fetch(self, key, open_upstream):
+        """Download into the cache, sharing the download between concurrent callers"""
+        self._ensure_loaded()
+        with self._lock:
+            entry = self._entries.get(self._keys.get(key))
+            if entry is not None:
+                return entry
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = self._create_event()
+            else:
+                self.shared_downloads += 1
+
+        if not leader:
+            flight.wait(60)
+            with self._lock:
+                return self._entries.get(self._keys.get(key))
+
+        try:
+            return io_offload.run(self._download, key, open_upstream)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.set()
+
+    def prefetch(self, key, open_upstream):
+        """Start filling the cache for key in the background, unless already under way"""
+        with self._lock:
+            busy = key in self._flights
+        if not busy and self.socketio is not None:
+            self.socketio.start_background_task(self.fetch, key, open_upstream)
+
+    def discard(self, key):
+        """Forget a file id, deleting the blob once nothing maps to it"""
+        self._ensure_loaded()
+        with self._lock:
+            digest = self._keys.pop(key, None)
+            if digest is not None and digest not in self._keys.values() and digest in self._entries:
+                self._drop(digest)
+
+    def send(self, entry, max_age=3600):
+        """Serve a cached blob with ETag, Last-Modified and Range handling"""
+        response = send_file(
+            entry.path,
+            mimetype=entry.mimetype,
+            conditional=True,
+            etag=entry.digest,
+            last_modified=entry.created,
+            max_age=max_age
+        )
+        if response.status_code in (200, 206):
+            with self._lock:
+                self.bytes_served += response.content_length or 0
+        return response
+
+    def _download(self, key, open_upstream):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = os.path.join(self.directory, f'.{uuid.uuid4().hex}.part')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            response = open_upstream()
+            if response is None:
+                return None
+            with response:
+                if response.status_code != 200:
+                    return None
+                mimetype = response.headers.get('content-type', 'application/octet-stream')
+                with open(temp_path, 'wb') as out:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_entry_bytes:
+                            return None
+                        digest.update(chunk)
+                        out.write(chunk)
+            entry = self._store(key, digest.hexdigest(), temp_path, size, mimetype)
+        except (requests.RequestException, OSError) as e:
+            logging.error(f"Media cache download failed: {e}")
+            return None
+        finally:
+            # No-op once the blob has been moved into place
+            self._remove(temp_path)
+        with self._lock:
+            self.downloads += 1
+        return entry
+
+    def _store(self, key, digest, temp_path, size, mimetype):
+        path = os.path.join(self.directory, digest)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                # Same content under another file id
+                self._remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+                entry = CacheEntry(digest, path, size, mimetype, time.time())
+                self._entries[digest] = entry
+                self._bytes += size
+            self._keys[key] = digest
+            keys = [k for k, d in self._keys.items() if d == digest]
+            self._evict()
+        self._write_meta(entry, keys)
+        return entry
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest)
+        self._bytes -= entry.size
+        for key in [k for k, d in self._keys.items() if d == digest]:
+            del self._keys[key]
+        self._remove(entry.path)
+        self._remove(entry.path + '.json')
+
+    def _write_meta(self, entry, keys):
+        try:
+            with open(entry.path + '.json', 'w') as meta:
+                json.dump({'mimetype': entry.mimetype, 'created': entry.created, 'keys': keys}, meta)
+        except OSError as e:
+            logging.error(f"Media cache metadata write failed: {e}")
+
+    def _ensure_loaded(self):
+        """Rebuild the index from disk once per process, oldest access first"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.isdir(self.directory):
+                return
+            found = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.startswith('.'):
+                    self._remove(path)  # Interrupted download
+                    continue
+                if name.endswith('.json'):
+                    continue
+                try:
+                    with open(path + '.json') as meta_file:
+                        meta = json.load(meta_file)
+                    stat = os.stat(path)
+                except (OSError, ValueError):
+                    self._remove(path)
+                    continue
+                found.append((stat.st_atime, CacheEntry(name, path, stat.st_size, meta['mimetype'], meta['created']), meta.get('keys', [])))
+            for _, entry, keys in sorted(found, key=lambda item: item[0]):
+                self._entries[entry.digest] = entry
+                self._bytes += entry.size
+                for key in keys:
+                    self._keys[key] = entry.digest
+            self._evict()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'downloads': self.downloads,
+                'shared_downloads': self.shared_downloads,
+                'evictions': self.evictions,
+                'bytes_served': self.bytes_served
+            }
+
+# Global instance
+media_cache = MediaDiskCache()
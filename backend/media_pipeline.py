@@ -0,0 +1,346 @@
+from backend.models import Message, MediaBlob, User, Conversation, ChangeLog, db
+from backend.telegram_storage import telegram_storage
+from backend.offload import cpu_offload, io_offload
+from backend.session_cache import session_cache
+from backend.messaging import media_fields
+from backend import thumbnails
+from backend.media_urls import TELEGRAM_AVATAR_PREFIX
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+import uuid
+
+TELEGRAM_TYPES = {'image': 'photo', 'video': 'video'}
+
+class MediaUploadPipeline:
+    """Background Telegram uploads and thumbnails for media messages and avatars.
+
+    The request commits the row with the local file and returns; workers
+    generate thumbnails, upload to Telegram with retries and exponential
+    backoff, then swap the row over to the Telegram file and notify the
+    clients. Until then the local copy is served, so media is viewable
+    immediately.
+
+    Uploads left pending by a previous process are resumed at start-up. In a
+    multi-worker deployment every worker resumes them, so each upload first
+    takes a lease on its row (upload_owner, upload_lease_until) with a
+    guarded UPDATE; only the holder uploads, and an expired lease can be
+    taken over after a crash.
+    """
+
+    def __init__(self):
+        self.workers = int(os.getenv('MEDIA_UPLOAD_WORKERS', 2))
+        self.max_attempts = int(os.getenv('MEDIA_UPLOAD_ATTEMPTS', 4))
+        self.backoff = float(os.getenv('MEDIA_UPLOAD_BACKOFF', 2))
+        self.lease = float(os.getenv('MEDIA_UPLOAD_LEASE', 600))
+        self.storage = telegram_storage
+        self.app = None
+        self.socketio = None
+        self._queue = None
+        self._started = False
+        self._queued_messages = set()
+        self._uploading_blobs = set()
+        self._lock = threading.Lock()
+        self._instance = uuid.uuid4().hex[:8]
+        self.submitted = 0
+        self.uploaded = 0
+        self.retried = 0
+        self.failed = 0
+        self.claimed_elsewhere = 0
+
+    @property
+    def enabled(self):
+        """Telegram uploads happen in the background"""
+        return self.storage is not None and self.workers > 0
+
+    @property
+    def active(self):
+        """Workers have something to do: Telegram uploads or thumbnails"""
+        return self.workers > 0 and (self.storage is not None or thumbnails.available())
+
+    @property
+    def worker_id(self):
+        # Includes the pid, so processes forked from one import still differ
+        return f'{socket.gethostname()[:40]}:{os.getpid()}:{self._instance}'
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+
+    def start(self):
+        """Start the workers and resume pending uploads; otherwise the first submit does"""
+        if self.enabled:
+            self._ensure_started()
+
+    def submit_message(self, message_id):
+        """Queue a media message for thumbnails and, when pending, upload"""
+        with self._lock:
+            if message_id in self._queued_messages:
+                return
+            self._queued_messages.add(message_id)
+        self._submit(('message', message_id, 0))
+
+    def submit_avatar(self, user_id, file_path):
+        """Queue a locally stored avatar for thumbnails and upload"""
+        self._submit(('avatar', (user_id, file_path), 0))
+
+    def _submit(self, job):
+        self._ensure_started()
+        with self._lock:
+            self.submitted += 1
+        self._queue.put(job)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            # Green threads under eventlet, plain threads otherwise
+            self._queue = self.socketio.server.eio.create_queue()
+            for _ in range(self.workers):
+                self.socketio.start_background_task(self._worker)
+        self.socketio.start_background_task(self._resume_pending)
+
+    def _resume_pending(self):
+        """Re-queue uploads left pending by a previous process"""
+        with self.app.app_context():
+            try:
+                pending = db.session.query(Message.id).filter(
+                    Message.media_status == 'pending',
+                    Message.upload_owner.is_(None) | (Message.upload_lease_until < datetime.utcnow())
+                ).order_by(Message.id).all()
+            except Exception as e:
+                logging.error(f"Could not load pending media uploads: {e}")
+                return
+            finally:
+                db.session.remove()
+        for (message_id,) in pending:
+            self.submit_message(message_id)
+
+    def _worker(self):
+        while True:
+            kind, target, attempt = self._queue.get()
+            with self.app.app_context():
+                try:
+                    if kind == 'message':
+                        done = self._upload_message(target)
+                    else:
+                        done = self._upload_avatar(*target)
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f"Media upload job {kind} {target} crashed: {e}")
+                    done = False
+                finally:
+                    db.session.remove()
+            if done is None:
+                # Shared content is being uploaded by another job, settle after it
+                self.socketio.start_background_task(self._retry_later, (kind, target, attempt), self.backoff)
+                continue
+            if done:
+                self._finish(kind, target)
+                continue
+            if attempt + 1 < self.max_attempts:
+                with self._lock:
+                    self.retried += 1
+                self.socketio.start_background_task(self._retry_later, (kind, target, attempt + 1), self.backoff * 2 ** attempt)
+            else:
+                with self.app.app_context():
+                    self._give_up(kind, target)
+                self._finish(kind, target)
+
+    def _finish(self, kind, target):
+        if kind == 'message':
+            with self._lock:
+                self._queued_messages.discard(target)
+
+    def _retry_later(self, job, delay):
+        self.socketio.sleep(delay)
+        self._queue.put(job)
+
+    def _upload(self, file_path, telegram_type):
+        # The Telegram HTTP calls block, keep them off the event loop and out of the CPU pool
+        return io_offload.run(self.storage.upload_file, file_path, telegram_type)
+
+    def _claim(self, model, row_id):
+        """Take or renew the upload lease of a row; False while another worker holds it"""
+        table = model.__table__
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            table.update().where(
+                table.c.id == row_id,
+                table.c.upload_owner.is_(None) | (table.c.upload_owner == self.worker_id) |
+                (table.c.upload_lease_until < now)
+            ).values(upload_owner=self.worker_id, upload_lease_until=now + timedelta(seconds=self.lease))
+        ).rowcount == 1
+        db.session.commit()
+        if not claimed:
+            with self._lock:
+                self.claimed_elsewhere += 1
+        return claimed
+
+    def _upload_message(self, message_id):
+        message = db.session.get(Message, message_id)
+        if message is None:
+            return True
+        if message.blob is not None:
+            return self._upload_blob(message.blob, message)
+        if message.media_status != 'pending':
+            return True
+        if not message.file_path or not os.path.exists(message.file_path):
+            message.media_status = 'failed'
+            db.session.commit()
+            self.notify(message)
+            return True
+        if not self._claim(Message, message.id):
+            return True  # The holder finishes it, or resumes it after a restart
+
+        result = self._upload(message.file_path, TELEGRAM_TYPES.get(message.message_type, 'document'))
+        if not result:
+            return False
+
+        local_path = message.file_path
+        message.telegram_file_id, message.telegram_file_url = result
+        message.file_path = None
+        message.media_status = 'ready'
+        db.session.commit()
+        try:
+            os.remove(local_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.uploaded += 1
+        self.notify(message)
+        return True
+
+    def _upload_blob(self, blob, message):
+        """Upload shared content once and settle every message waiting on it"""
+        with self._lock:
+            if blob.id in self._uploading_blobs:
+                return None
+            self._uploading_blobs.add(blob.id)
+        try:
+            return self._settle_blob(blob, message)
+        finally:
+            with self._lock:
+                self._uploading_blobs.discard(blob.id)
+
+    def _settle_blob(self, blob, message):
+        has_local = bool(blob.local_path) and os.path.exists(blob.local_path)
+        if has_local and blob.thumbnails is None:
+            self._derive_blob(blob, message)
+            db.session.commit()
+            self.notify(message)
+        if message.media_status != 'pending' or not self.enabled:
+            return True
+
+        local_path = None
+        if not blob.telegram_file_id:
+            if not blob.local_path or not os.path.exists(blob.local_path):
+                message.media_status = 'failed'
+                db.session.commit()
+                self.notify(message)
+                return True
+            if not self._claim(MediaBlob, blob.id):
+                return None  # Settle this message once the other worker's upload is stored
+            result = self._upload(blob.local_path, TELEGRAM_TYPES.get(message.message_type, 'document'))
+            if not result:
+                return False
+            local_path = blob.local_path
+            blob.telegram_file_id, blob.telegram_file_url = result
+            blob.local_path = None
+            with self._lock:
+                self.uploaded += 1
+
+        waiting = Message.query.filter_by(blob_id=blob.id, media_status='pending').all()
+        for pending in waiting:
+            pending.telegram_file_id = blob.telegram_file_id
+            pending.telegram_file_url = blob.telegram_file_url
+            pending.file_path = None
+            pending.media_status = 'ready'
+        db.session.commit()
+        if local_path:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+        for pending in waiting:
+            self.notify(pending)
+        return True
+
+    def _derive_blob(self, blob, message):
+        """Generate thumbnails once per content, before the local copy goes away"""
+        sizes, placeholder = cpu_offload.run(thumbnails.generate, blob.local_path, blob.sha256, message.message_type)
+        blob.thumbnails = ','.join(sizes)
+        blob.placeholder = placeholder
+
+    def _upload_avatar(self, user_id, file_path):
+        if not os.path.exists(file_path):
+            return True
+        key = f'avatar_{user_id}'
+        if thumbnails.available() and not os.path.exists(thumbnails.derivative_path(key, 'small')):
+            cpu_offload.run(thumbnails.generate, file_path, key)
+        if not self.enabled:
+            return True  # Local avatar, nothing to upload
+        result = self._upload(file_path, 'photo')
+        if not result:
+            return False
+
+        local_url = f'/wa/uploads/{os.path.basename(file_path)}'
+        # Only swap if the user has not picked another avatar meanwhile
+        updated = User.query.filter_by(id=user_id, avatar=local_url).update({'avatar': TELEGRAM_AVATAR_PREFIX + result[0]})
+        if updated:
+            ChangeLog.append(db.session, [(peer_id, 'contact', user_id) for peer_id in Conversation.peer_ids(user_id)])
+        db.session.commit()
+        if updated:
+            session_cache.invalidate(user_id)
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.uploaded += 1
+        return True
+
+    def _give_up(self, kind, target):
+        with self._lock:
+            self.failed += 1
+        logging.error(f"Telegram upload for {kind} {target} failed after {self.max_attempts} attempts")
+        if kind != 'message':
+            return  # Avatar keeps its local copy
+        try:
+            message = db.session.get(Message, target)
+            if message is not None and message.media_status == 'pending':
+                # The local copy keeps being served
+                message.media_status = 'failed'
+                db.session.commit()
+                self.notify(message)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Could not mark media message {target} as failed: {e}")
+        finally:
+            db.session.remove()
+
+    def notify(self, message):
+        """Push the media state of a message to both participants"""
+        payload = {'message_id': message.id, **media_fields(message, message.blob)}
+        for user_id in {message.sender_id, message.receiver_id}:
+            self.socketio.emit('media_status', payload, room=f'user_{user_id}')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                'in_flight': len(self._queued_messages),
+                'submitted': self.submitted,
+                'uploaded': self.uploaded,
+                'retried': self.retried,
+                'failed': self.failed,
+                'claimed_elsewhere': self.claimed_elsewhere
+            }
+
+# Global instance
+media_pipeline = MediaUploadPipeline()
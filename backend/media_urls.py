@@ -0,0 +1,90 @@
+"""
+Signed, expiring media URLs.
+
+/wa/media/<message_id>/<kind>/<ref>?exp=<unix time>&sig=<hmac> names the
+stored bytes directly, so serving one needs neither a session nor a
+database lookup. Kinds: f = local upload, d = generated thumbnail, t =
+Telegram file id. Expiry is rounded up to a bucket so the URL for a file
+stays the same for a while and browsers and edge proxies can cache it.
+"""
+from flask import send_file, Response
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+from backend.encryption import message_encryption
+
+MEDIA_URL_TTL = int(os.getenv('MEDIA_URL_TTL', 3600))
+MEDIA_URL_BUCKET = int(os.getenv('MEDIA_URL_BUCKET', 900))
+# '' serves from Python, 'x-accel' hands off to nginx, 'x-sendfile' to Apache/lighttpd
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '').lower()
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/wa/_protected/')
+UPLOAD_DIR = 'uploads'
+# Avatars uploaded to Telegram are stored as this prefix plus the file id
+TELEGRAM_AVATAR_PREFIX = 'tg:'
+
+_key = hmac.new(message_encryption.key, b'media-url', hashlib.sha256).digest()
+
+def _signature(message_id, kind, ref, expires):
+    payload = f'{message_id}/{kind}/{ref}/{expires}'.encode()
+    digest = hmac.new(_key, payload, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+def signed_url(message_id, kind, ref):
+    now = int(time.time())
+    expires = now + MEDIA_URL_TTL
+    if MEDIA_URL_BUCKET > 0:
+        expires += -expires % MEDIA_URL_BUCKET
+    return f'/wa/media/{message_id}/{kind}/{ref}?exp={expires}&sig={_signature(message_id, kind, ref, expires)}'
+
+def verify(message_id, kind, ref, expires, signature):
+    """Seconds the URL stays valid, or None if it is forged or expired"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return None
+    remaining = expires - int(time.time())
+    if remaining <= 0 or not signature:
+        return None
+    if not hmac.compare_digest(signature, _signature(message_id, kind, ref, expires)):
+        return None
+    return remaining
+
+def media_urls(message, blob):
+    """Signed URLs for a media message's original and thumbnail"""
+    urls = {}
+    if message.telegram_file_id:
+        urls['media_url'] = signed_url(message.id, 't', message.telegram_file_id)
+    elif message.file_path:
+        urls['media_url'] = signed_url(message.id, 'f', os.path.basename(message.file_path))
+    if blob is not None and 'thumb' in blob.thumbnail_sizes():
+        urls['thumbnail_url'] = signed_url(message.id, 'd', f'{blob.sha256}_thumb.jpg')
+    return urls
+
+def avatar_url(user):
+    """Avatar URL for clients; Telegram-backed avatars go through the avatar route"""
+    avatar = user.avatar
+    if avatar and (avatar.startswith(TELEGRAM_AVATAR_PREFIX) or avatar.startswith('http')):
+        # Older rows hold the Telegram download URL itself, which carries the bot token
+        return f'/wa/api/users/{user.id}/avatar?size=original'
+    return avatar
+
+def serve_local(relative_path, mimetype=None, max_age=None):
+    """Serve a file under UPLOAD_DIR, handing the bytes to the front proxy when configured"""
+    path = os.path.join(UPLOAD_DIR, relative_path)
+    if not os.path.isfile(path):
+        return None
+    if MEDIA_OFFLOAD == 'x-accel':
+        response = Response(mimetype=mimetype or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + relative_path
+    elif MEDIA_OFFLOAD == 'x-sendfile':
+        response = Response(mimetype=mimetype or 'application/octet-stream')
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        return send_file(path, mimetype=mimetype, conditional=True, max_age=max_age)
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+import os
+import sys
+import threading
+
+# Rough per-entry bookkeeping cost on top of the string itself
+ENTRY_OVERHEAD = 120
+
+class MessageCache:
+    """Memory-capped LRU of decrypted message content keyed by message id.
+
+    Message content never changes after insert, so entries only leave the
+    cache through eviction or explicit invalidation.
+    """
+
+    def __init__(self):
+        self.max_bytes = int(os.getenv('MESSAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, message_ids):
+        """Return {message_id: content} for the ids that are cached"""
+        found = {}
+        with self._lock:
+            for message_id in message_ids:
+                entry = self._entries.get(message_id)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(message_id)
+                found[message_id] = entry[0]
+                self.hits += 1
+        return found
+
+    def put(self, message_id, content):
+        self.put_many({message_id: content})
+
+    def put_many(self, items):
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            for message_id, content in items.items():
+                size = sys.getsizeof(content) + ENTRY_OVERHEAD
+                if size > self.max_bytes:
+                    continue
+                previous = self._entries.pop(message_id, None)
+                if previous is not None:
+                    self._bytes -= previous[1]
+                self._entries[message_id] = (content, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+
+    def invalidate(self, message_id):
+        with self._lock:
+            entry = self._entries.pop(message_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+# Global instance
+message_cache = MessageCache()
@@ -0,0 +1,102 @@
+from flask import current_app
+from backend.models import Message, Conversation, db, conversation_key_for
+from backend.media_blobs import release_blob
+from backend.encryption import message_encryption
+from backend.message_cache import message_cache
+from backend.media_urls import media_urls, avatar_url
+from backend.presence import presence
+
+PREVIEW_LENGTH = 100
+
+def message_preview(message_type, content):
+    """Preview stored on the conversation summary, encrypted like text content"""
+    if message_type == 'text':
+        return message_encryption.encrypt_message((content or '')[:PREVIEW_LENGTH])
+    return (content or '')[:PREVIEW_LENGTH]
+
+def create_text_message(sender_id, receiver_id, content):
+    """Encrypt and persist a text message together with its conversation summary"""
+    message = Message(
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        content=message_encryption.encrypt_message(content),
+        message_type='text'
+    )
+    db.session.add(message)
+    db.session.flush()
+    Conversation.record_message(message, message_preview('text', content))
+    db.session.commit()
+    message_cache.put(message.id, content)
+    return message
+
+def delete_message(message):
+    """Delete a message, repair its conversation summary and drop its media reference.
+    
+    Returns the released blob (see release_blob) for reclaim_blob_files once the
+    caller has committed.
+    """
+    conversation = Conversation.query.filter_by(
+        conversation_key=conversation_key_for(message.sender_id, message.receiver_id)
+    ).first()
+    if conversation and not message.is_read:
+        conversation.add_unread(message.receiver_id, -1)
+    
+    blob_id = message.blob_id
+    db.session.delete(message)
+    db.session.flush()
+    message_cache.invalidate(message.id)
+    
+    if conversation and conversation.last_message_id == message.id:
+        previous = Message.query.filter_by(conversation_key=conversation.conversation_key).order_by(Message.id.desc()).first()
+        if previous is None:
+            db.session.delete(conversation)
+        else:
+            content = message_encryption.decrypt_message(previous.content) if previous.message_type == 'text' else previous.content
+            conversation.set_last_message(previous, message_preview(previous.message_type, content))
+    
+    return release_blob(blob_id) if blob_id else None
+
+def message_payload(message, content):
+    """Client representation of a message; content is the plaintext"""
+    payload = {
+        'id': message.id,
+        'content': content,
+        'message_type': message.message_type,
+        'timestamp': message.timestamp.isoformat(),
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'is_read': bool(message.is_read),
+        'is_delivered': bool(message.is_delivered)
+    }
+    payload.update(media_fields(message, message.blob))
+    return payload
+
+def media_fields(message, blob):
+    """Media-specific payload fields; blob is the message's MediaBlob or None"""
+    if message.message_type not in ['image', 'video', 'audio']:
+        return {}
+    fields = {'secure_file_id': message.id, 'media_status': message.media_status}
+    if blob is not None and blob.thumbnails:
+        fields['thumbnails'] = blob.thumbnail_sizes()
+        fields['placeholder'] = blob.placeholder
+    fields.update(media_urls(message, blob))
+    return fields
+
+def sender_payload(user):
+    return {
+        'id': user.id,
+        'name': user.name,
+        'phone': user.phone,
+        'avatar': avatar_url(user),
+        'is_online': presence.is_online(user.id, user.is_online)
+    }
+
+def fanout_message(message, content, sender):
+    """Push a stored message to the receiver's personal room"""
+    socketio = current_app.extensions.get('socketio')
+    if not socketio:
+        return
+    socketio.emit('receive_message', {
+        'message': message_payload(message, content),
+        'sender': sender_payload(sender)
+    }, room=f'user_{message.receiver_id}')
@@ -0,0 +1,40 @@
+"""Registry of runtime statistics exposed by /wa/api/metrics"""
+from collections import deque
+import threading
+
+_providers = {}
+
+def register(name, provider):
+    """Register a zero-argument callable returning a JSON-serializable dict"""
+    _providers[name] = provider
+
+def snapshot():
+    stats = {}
+    for name, provider in _providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {'error': str(e)}
+    return stats
+
+class LatencyWindow:
+    """Most recent samples of one latency, summarized as percentiles in milliseconds"""
+
+    def __init__(self, size=1000):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds * 1000)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {'count': 0}
+        pick = lambda q: round(samples[min(int(q * len(samples)), len(samples) - 1)], 1)
+        return {'count': count, 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'max_ms': round(samples[-1], 1)}
@@ -1,10 +1,18 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, inspect as inspect_state
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import bcrypt
+from backend.offload import cpu_offload
 
 db = SQLAlchemy()
 
+def conversation_key_for(user_a_id, user_b_id):
+    """Normalized key shared by both directions of a conversation"""
+    low, high = sorted((int(user_a_id), int(user_b_id)))
+    return f"{low}:{high}"
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -22,11 +30,24 @@ class User(UserMixin, db.Model):
     sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender')
     received_messages = db.relationship('Message', foreign_keys='Message.receiver_id', backref='receiver')
     
+    # bcrypt takes ~250 ms of CPU, keep it off the event loop
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = cpu_offload.run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return cpu_offload.run(bcrypt.checkpw, password.encode('utf-8'), self.password_hash.encode('utf-8'))
+
+class PresenceClaim(db.Model):
+    """A worker process holding sockets of a user, see backend/presence.py"""
+    __tablename__ = 'presence_claims'
+    
+    worker_id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    seen_at = db.Column(db.DateTime, nullable=False)  # Refreshed by the worker's flushes while the user stays
+    
+    __table_args__ = (
+        db.Index('ix_presence_claims_user', 'user_id', 'seen_at'),
+    )
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -39,12 +60,188 @@ class Message(db.Model):
     file_path = db.Column(db.String(255))
     telegram_file_id = db.Column(db.String(255))
     telegram_file_url = db.Column(db.String(500))
+    media_status = db.Column(db.String(10), default='ready')  # pending, ready, failed (Telegram upload)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
     is_delivered = db.Column(db.Boolean, default=False)
     delivered_at = db.Column(db.DateTime)
     read_at = db.Column(db.DateTime)
+    conversation_key = db.Column(db.String(32))  # "min_id:max_id", see conversation_key_for
+    seq = db.Column(db.Integer)  # Monotonic position within the conversation
+    blob_id = db.Column(db.Integer, db.ForeignKey('media_blobs.id'))  # Shared media content, see MediaBlob
+    upload_owner = db.Column(db.String(64))  # Worker holding the Telegram upload lease
+    upload_lease_until = db.Column(db.DateTime)
+    
+    blob = db.relationship('MediaBlob')
+    
+    __table_args__ = (
+        db.Index('ix_messages_conversation_id', 'conversation_key', 'id'),
+        db.Index('ux_messages_conversation_seq', 'conversation_key', 'seq', unique=True),
+        db.Index('ix_messages_receiver_unread', 'receiver_id', 'is_read'),
+    )
+
+@event.listens_for(Message, 'before_insert')
+def assign_conversation_sequence(mapper, connection, message):
+    """Fill conversation_key and the next per-conversation seq on insert"""
+    message.conversation_key = conversation_key_for(message.sender_id, message.receiver_id)
+    message.seq = Conversation.allocate_seq(connection, message.sender_id, message.receiver_id)
+
+class Conversation(db.Model):
+    """Per user-pair summary kept in step with messages for the contacts list"""
+    __tablename__ = 'conversations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_key = db.Column(db.String(32), unique=True, nullable=False)
+    user_low_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_high_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    last_message_id = db.Column(db.Integer)
+    last_message_at = db.Column(db.DateTime)
+    last_message_type = db.Column(db.String(20))
+    last_message_preview = db.Column(db.Text)  # Encrypted like Message.content for text messages
+    last_sender_id = db.Column(db.Integer)
+    unread_low = db.Column(db.Integer, default=0, nullable=False)  # Unread by user_low_id
+    unread_high = db.Column(db.Integer, default=0, nullable=False)  # Unread by user_high_id
+    last_seq = db.Column(db.Integer, default=0, nullable=False)  # Last Message.seq handed out
+    
+    __table_args__ = (
+        db.Index('ix_conversations_low_recent', 'user_low_id', 'last_message_at'),
+        db.Index('ix_conversations_high_recent', 'user_high_id', 'last_message_at'),
+    )
+    
+    @classmethod
+    def get_or_create(cls, user_a_id, user_b_id):
+        key = conversation_key_for(user_a_id, user_b_id)
+        conversation = cls.query.filter_by(conversation_key=key).first()
+        if not conversation:
+            low, high = sorted((int(user_a_id), int(user_b_id)))
+            conversation = cls(conversation_key=key, user_low_id=low, user_high_id=high,
+                               unread_low=0, unread_high=0, last_seq=0)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(conversation)
+            except IntegrityError:
+                # The other side's first message created it concurrently
+                conversation = cls.query.filter_by(conversation_key=key).one()
+        return conversation
+    
+    @classmethod
+    def allocate_seq(cls, connection, user_a_id, user_b_id):
+        """Reserve the next seq of a conversation, creating its row if needed.
+        
+        The increment locks the conversation row until the inserting
+        transaction ends, so concurrent sends get distinct numbers instead of
+        racing on max(seq) + 1.
+        """
+        table = cls.__table__
+        key = conversation_key_for(user_a_id, user_b_id)
+        increment = table.update().where(table.c.conversation_key == key).values(last_seq=table.c.last_seq + 1)
+        if connection.execute(increment).rowcount == 0:
+            low, high = sorted((int(user_a_id), int(user_b_id)))
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(
+                        conversation_key=key, user_low_id=low, user_high_id=high,
+                        unread_low=0, unread_high=0, last_seq=0
+                    ))
+            except IntegrityError:
+                pass  # Created concurrently, the increment below waits for it
+            connection.execute(increment)
+        return connection.execute(db.select(table.c.last_seq).where(table.c.conversation_key == key)).scalar()
+    
+    @classmethod
+    def record_message(cls, message, preview):
+        """Point the summary at a newly added message; caller commits"""
+        conversation = cls.get_or_create(message.sender_id, message.receiver_id)
+        conversation.set_last_message(message, preview)
+        conversation.add_unread(message.receiver_id, 1)
+        return conversation
+    
+    def set_last_message(self, message, preview):
+        self.last_message_id = message.id
+        self.last_message_at = message.timestamp or datetime.utcnow()
+        self.last_message_type = message.message_type
+        self.last_message_preview = preview
+        self.last_sender_id = message.sender_id
+    
+    @classmethod
+    def mark_read(cls, reader_id, other_id, count):
+        """Drop the reader's unread counter by count messages; caller commits"""
+        if count <= 0:
+            return
+        conversation = cls.query.filter_by(conversation_key=conversation_key_for(reader_id, other_id)).first()
+        if conversation:
+            conversation.add_unread(reader_id, -count)
+    
+    def add_unread(self, user_id, delta):
+        if self.id is None:
+            # Not inserted yet, plain values are safe
+            if user_id == self.user_low_id:
+                self.unread_low = max((self.unread_low or 0) + delta, 0)
+            else:
+                self.unread_high = max((self.unread_high or 0) + delta, 0)
+            return
+        # SQL-side arithmetic so concurrent writers don't lose updates
+        if user_id == self.user_low_id:
+            self.unread_low = db.case((Conversation.unread_low + delta < 0, 0), else_=Conversation.unread_low + delta)
+        else:
+            self.unread_high = db.case((Conversation.unread_high + delta < 0, 0), else_=Conversation.unread_high + delta)
+    
+    def peer_id(self, user_id):
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+    
+    @classmethod
+    def peer_ids(cls, user_id, connection=None):
+        """Users sharing a conversation with user_id, i.e. who list them as a contact"""
+        query = db.select(cls.user_low_id, cls.user_high_id).where(
+            (cls.user_low_id == user_id) | (cls.user_high_id == user_id)
+        )
+        rows = (connection or db.session).execute(query).all()
+        return {high if low == user_id else low for low, high in rows}
+    
+    def unread_for(self, user_id):
+        return self.unread_low if user_id == self.user_low_id else self.unread_high
+
+class MediaBlob(db.Model):
+    """Uploaded media content shared by every message that sent the same bytes"""
+    __tablename__ = 'media_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    mime_type = db.Column(db.String(100))
+    telegram_file_id = db.Column(db.String(255))
+    telegram_file_url = db.Column(db.String(500))
+    local_path = db.Column(db.String(255))  # Until uploaded to Telegram, or when Telegram is not configured
+    refcount = db.Column(db.Integer, default=0, nullable=False)
+    thumbnails = db.Column(db.String(50))  # Comma separated generated sizes, '' when none could be made
+    placeholder = db.Column(db.Text)  # Tiny JPEG data URI shown while the media loads
+    upload_owner = db.Column(db.String(64))  # Worker holding the Telegram upload lease
+    upload_lease_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def thumbnail_sizes(self):
+        return self.thumbnails.split(',') if self.thumbnails else []
+
+class UploadSession(db.Model):
+    """Resumable media upload in progress; chunks are appended to temp_path"""
+    __tablename__ = 'upload_sessions'
     
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    mime_type = db.Column(db.String(100))
+    caption = db.Column(db.Text)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, default=0, nullable=False)
+    temp_path = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_upload_sessions_updated', 'updated_at'),
+    )
+
 class Call(db.Model):
     __tablename__ = 'calls'
     
@@ -56,6 +253,139 @@ class Call(db.Model):
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     ended_at = db.Column(db.DateTime)
     duration = db.Column(db.Integer, default=0)
+    stats_counted = db.Column(db.Boolean, default=False)  # Folded into CallStat once finished
     
     caller = db.relationship('User', foreign_keys=[caller_id])
-    receiver = db.relationship('User', foreign_keys=[receiver_id])
\ No newline at end of file
+    receiver = db.relationship('User', foreign_keys=[receiver_id])
+    
+    __table_args__ = (
+        # History pages seek on id (newest first) within each side of the call
+        db.Index('ix_calls_caller_recent', 'caller_id', 'id'),
+        db.Index('ix_calls_receiver_recent', 'receiver_id', 'id'),
+        db.Index('ix_calls_stats_pending', 'stats_counted', 'status'),
+    )
+
+class CallStat(db.Model):
+    """Running call totals of one user with one contact, see backend/call_stats.py"""
+    __tablename__ = 'call_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    calls = db.Column(db.Integer, default=0, nullable=False)
+    outgoing = db.Column(db.Integer, default=0, nullable=False)
+    incoming = db.Column(db.Integer, default=0, nullable=False)
+    answered = db.Column(db.Integer, default=0, nullable=False)
+    missed = db.Column(db.Integer, default=0, nullable=False)
+    total_duration = db.Column(db.Integer, default=0, nullable=False)
+    last_call_at = db.Column(db.DateTime)
+    
+    peer = db.relationship('User', foreign_keys=[peer_id])
+    
+    __table_args__ = (
+        db.Index('ux_call_stats_user_peer', 'user_id', 'peer_id', unique=True),
+    )
+class ChangeLog(db.Model):
+    """Append-only feed of changes per user, read by /api/messages/sync.
+
+    kind is message (new or updated, ref_id = message id), receipt (delivery
+    or read state, ref_id = message id), delete (ref_id = message id) or
+    contact (profile or conversation summary, ref_id = the contact's user id).
+    Entries are written in the transaction of the change itself.
+    """
+    __tablename__ = 'change_log'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_change_log_user_id', 'user_id', 'id'),
+        db.Index('ix_change_log_created', 'created_at'),
+        # Cursors are log ids: SQLite must not reuse them once pruning empties the table
+        {'sqlite_autoincrement': True},
+    )
+    
+    @classmethod
+    def append(cls, connection, entries):
+        """Insert (user_id, kind, ref_id) entries in one executemany"""
+        if not entries:
+            return
+        now = datetime.utcnow()
+        connection.execute(cls.__table__.insert(), [
+            {'user_id': user_id, 'kind': kind, 'ref_id': ref_id, 'created_at': now}
+            for user_id, kind, ref_id in entries
+        ])
+
+class ChangeLogPrune(db.Model):
+    """Single row holding the highest change log id pruned so far.
+
+    Sync cursors below it may have missed pruned entries. Ids themselves are
+    not contiguous (rollbacks, auto_increment_increment), so gaps in the log
+    say nothing about pruning.
+    """
+    __tablename__ = 'change_log_prune'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    pruned_through = db.Column(db.Integer, default=0, nullable=False)
+    pruned_at = db.Column(db.DateTime)
+    
+    @classmethod
+    def watermark(cls):
+        return db.session.execute(db.select(cls.pruned_through).where(cls.id == 1)).scalar() or 0
+    
+    @classmethod
+    def advance(cls, pruned_id):
+        """Raise the watermark to pruned_id; caller commits"""
+        table = cls.__table__
+        raise_mark = table.update().where(table.c.id == 1, table.c.pruned_through < pruned_id).values(
+            pruned_through=pruned_id, pruned_at=datetime.utcnow()
+        )
+        if db.session.execute(raise_mark).rowcount == 0 and not db.session.get(cls, 1):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(id=1, pruned_through=0))
+            except IntegrityError:
+                pass  # Created concurrently, the update below waits for it
+            db.session.execute(raise_mark)
+
+def _changed(target, *names):
+    state = inspect_state(target)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+@event.listens_for(Message, 'after_insert')
+def log_message_insert(mapper, connection, message):
+    ChangeLog.append(connection, [
+        (message.sender_id, 'message', message.id),
+        (message.receiver_id, 'message', message.id)
+    ])
+
+@event.listens_for(Message, 'after_update')
+def log_message_update(mapper, connection, message):
+    entries = []
+    if _changed(message, 'media_status', 'telegram_file_id', 'file_path'):
+        entries += [(message.sender_id, 'message', message.id), (message.receiver_id, 'message', message.id)]
+    if _changed(message, 'is_delivered', 'is_read'):
+        entries.append((message.sender_id, 'receipt', message.id))
+        if _changed(message, 'is_read'):
+            # The reader's unread counter for this contact moved
+            entries.append((message.receiver_id, 'contact', message.sender_id))
+    ChangeLog.append(connection, entries)
+
+@event.listens_for(Message, 'after_delete')
+def log_message_delete(mapper, connection, message):
+    ChangeLog.append(connection, [
+        (message.sender_id, 'delete', message.id),
+        (message.receiver_id, 'delete', message.id),
+        # Last message preview and unread count may have moved
+        (message.sender_id, 'contact', message.receiver_id),
+        (message.receiver_id, 'contact', message.sender_id)
+    ])
+
+@event.listens_for(User, 'after_update')
+def log_profile_update(mapper, connection, user):
+    if _changed(user, 'name', 'avatar'):
+        peers = Conversation.peer_ids(user.id, connection)
+        ChangeLog.append(connection, [(peer_id, 'contact', user.id) for peer_id in peers])
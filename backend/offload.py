@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+def native_threading():
+    """The unpatched threading module, for locks shared with eventlet's tpool threads.
+
+    Monkey patching turns threading.Lock and Event into green primitives that
+    only work within the hub's thread; a native thread blocking on one never
+    wakes up, and releasing one from there raises greenlet.error.
+    """
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return threading
+    return patcher.original('threading')
+
+class CPUOffload:
+    """Runs CPU-bound work (bcrypt, bulk decryption) off the eventlet hub.
+
+    Under eventlet the work goes to eventlet.tpool's native threads, so only
+    the calling green thread waits. Otherwise a ThreadPoolExecutor is used.
+    CPU_OFFLOAD_WORKERS sets the pool size; 0 runs everything inline.
+    """
+
+    # Whether this pool sizes eventlet's process-wide tpool
+    owns_tpool = True
+
+    def __init__(self, env_prefix='CPU_OFFLOAD', default_workers=4):
+        self.name = env_prefix.lower().replace('_', '-')
+        self.workers = int(os.getenv(f'{env_prefix}_WORKERS', default_workers))
+        self.mode = os.getenv(f'{env_prefix}_MODE', 'auto')  # auto, tpool, thread, inline
+        self._executor = None
+        # Taken on tpool threads too, see native_threading
+        self._lock = native_threading().Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    def init_app(self, app):
+        """Pick tpool when the Socket.IO server runs on eventlet"""
+        if self.workers <= 0:
+            self.mode = 'inline'
+        elif self.mode == 'auto':
+            socketio = app.extensions.get('socketio')
+            self.mode = 'tpool' if socketio is not None and socketio.async_mode == 'eventlet' else 'thread'
+        if self.mode == 'tpool' and self.owns_tpool:
+            from eventlet import tpool
+            tpool.set_num_threads(self.workers)
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and wait for its result"""
+        if self.mode == 'inline' or self.workers <= 0:
+            return fn(*args, **kwargs)
+
+        submitted = time.monotonic()
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def task():
+            started = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += started - submitted
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.total_run += time.monotonic() - started
+
+        try:
+            if self.mode == 'tpool':
+                from eventlet import tpool
+                result = tpool.execute(task)
+            else:
+                result = self._get_executor().submit(task).result()
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'mode': self.mode,
+                'workers': self.workers,
+                'queue_depth': self.queued,
+                'max_queue_depth': self.max_queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.total_wait * 1000 / finished, 2) if finished else 0.0,
+                'avg_run_ms': round(self.total_run * 1000 / finished, 2) if finished else 0.0
+            }
+
+class IOOffload(CPUOffload):
+    """Runs blocking network calls (Telegram uploads and downloads) off the eventlet hub.
+
+    Separate from the CPU pool so slow uploads do not queue in front of
+    bcrypt and decryption and are measured on their own. When eventlet has
+    patched sockets (gunicorn -k eventlet) the calls already yield to the
+    hub and run in the calling green thread; without patching they share
+    tpool's threads, otherwise a ThreadPoolExecutor of IO_OFFLOAD_WORKERS.
+    """
+
+    owns_tpool = False
+
+    def __init__(self):
+        super().__init__('IO_OFFLOAD', 8)
+
+    def init_app(self, app):
+        socketio = app.extensions.get('socketio')
+        if self.mode == 'auto' and socketio is not None and socketio.async_mode == 'eventlet':
+            from eventlet import patcher
+            if patcher.is_monkey_patched('socket'):
+                self.mode = 'inline'
+        super().init_app(app)
+
+# Global instances
+cpu_offload = CPUOffload()
+io_offload = IOOffload()
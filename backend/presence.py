@@ -0,0 +1,241 @@
+from sqlalchemy import bindparam
+from backend.models import User, Conversation, PresenceClaim, db
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+class PresenceRegistry:
+    """Who is connected, tracked from Socket.IO connect, disconnect and heartbeat.
+
+    Connections are counted per user in memory, so a user with several tabs
+    goes offline only when the last one closes, and only after a short grace
+    period so page reloads do not flap. last_seen and is_online changes are
+    coalesced and written in one bulk UPDATE per flush interval instead of a
+    row write per event. user_status is pushed only to the user's
+    conversation peers.
+
+    Each worker of a multi-process deployment counts only its own sockets, so
+    the workers holding a user are recorded in presence_claims: a claim is
+    written as soon as a worker gets the user's first socket and refreshed by
+    every flush. When a worker's last socket of a user closes it drops its
+    claim, and the user goes offline only if no other worker has a claim
+    seen within the presence timeout (crashed workers' claims age out).
+    """
+
+    def __init__(self):
+        self.heartbeat_interval = float(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', 30))
+        # Connections silent for this long are dropped, e.g. a disconnect that never arrived
+        self.timeout = float(os.getenv('PRESENCE_TIMEOUT', self.heartbeat_interval * 3))
+        self.offline_grace = float(os.getenv('PRESENCE_OFFLINE_GRACE', 5))
+        self.flush_interval = float(os.getenv('PRESENCE_FLUSH_INTERVAL', 10))
+        self.app = None
+        self.socketio = None
+        self._connections = {}  # user_id -> {sid: monotonic time of last heartbeat}
+        self._users = {}  # sid -> user_id
+        self._going_offline = {}  # user_id -> monotonic deadline
+        self._dirty = {}  # user_id -> (last_seen, is_online) awaiting the next flush
+        self._started = False
+        self._lock = threading.Lock()
+        self._instance = uuid.uuid4().hex[:8]
+        self.status_pushes = 0
+        self.held_elsewhere = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    @property
+    def worker_id(self):
+        # Includes the pid, so processes forked from one import still differ
+        return f'{socket.gethostname()[:40]}:{os.getpid()}:{self._instance}'
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+
+    def connect(self, user_id, sid):
+        """Register a socket; pushes online status on the user's first connection"""
+        self._ensure_started()
+        with self._lock:
+            sockets = self._connections.setdefault(user_id, {})
+            came_online = not sockets and self._going_offline.pop(user_id, None) is None
+            sockets[sid] = time.monotonic()
+            self._users[sid] = user_id
+            self._dirty[user_id] = (datetime.utcnow(), True)
+        if came_online:
+            # Claim the user at once, other workers check claims before going offline
+            self.flush()
+            self._push_status(user_id, True)
+
+    def heartbeat(self, sid):
+        with self._lock:
+            user_id = self._users.get(sid)
+            if user_id is None:
+                return False
+            self._connections[user_id][sid] = time.monotonic()
+            self._dirty[user_id] = (datetime.utcnow(), True)
+        return True
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._drop(sid)
+
+    def _drop(self, sid):
+        """Forget a socket; the user goes offline after the grace period if it was the last"""
+        user_id = self._users.pop(sid, None)
+        if user_id is None:
+            return
+        sockets = self._connections.get(user_id, {})
+        sockets.pop(sid, None)
+        self._dirty[user_id] = (datetime.utcnow(), True)
+        if not sockets:
+            self._connections.pop(user_id, None)
+            self._going_offline[user_id] = time.monotonic() + self.offline_grace
+
+    def is_online(self, user_id, default=False):
+        """Live status when this worker knows the user, else the stored flag"""
+        with self._lock:
+            if user_id in self._connections or user_id in self._going_offline:
+                return True
+        return default
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            self.socketio.sleep(1)
+            now = time.monotonic()
+            if self._sweep(now) or now >= next_flush:
+                self.flush()
+                next_flush = now + self.flush_interval
+
+    def _sweep(self, now):
+        """Drop silent sockets and settle users whose grace period ran out; True if any did"""
+        with self._lock:
+            for sid, user_id in list(self._users.items()):
+                if now - self._connections[user_id][sid] > self.timeout:
+                    self._drop(sid)
+            expired = [user_id for user_id, deadline in self._going_offline.items() if deadline <= now]
+        if not expired:
+            return False
+        elsewhere = self._claimed_elsewhere(expired)
+        went_offline = []
+        with self._lock:
+            for user_id in expired:
+                if self._going_offline.get(user_id, now + 1) > now:
+                    continue  # Reconnected meanwhile
+                del self._going_offline[user_id]
+                last_seen = self._dirty.get(user_id, (datetime.utcnow(), False))[0]
+                # The flush drops this worker's claim either way
+                self._dirty[user_id] = (last_seen, user_id in elsewhere)
+                if user_id in elsewhere:
+                    self.held_elsewhere += 1
+                else:
+                    went_offline.append(user_id)
+        for user_id in went_offline:
+            self._push_status(user_id, False)
+        return True
+
+    def _claimed_elsewhere(self, user_ids):
+        """Users another worker still holds, by claims refreshed within the timeout"""
+        since = datetime.utcnow() - timedelta(seconds=self.timeout)
+        with self.app.app_context():
+            try:
+                return set(db.session.execute(
+                    db.select(PresenceClaim.user_id).where(
+                        PresenceClaim.user_id.in_(user_ids),
+                        PresenceClaim.worker_id != self.worker_id,
+                        PresenceClaim.seen_at >= since
+                    )
+                ).scalars())
+            except Exception as e:
+                logging.error(f"Presence claims lookup failed: {e}")
+                return set()
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        """Write the pending last_seen/is_online changes in a single executemany UPDATE
+
+        This worker's claims on the same users are replaced in the same
+        transaction: refreshed for users it still holds, dropped for the rest.
+        """
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            held = [
+                user_id for user_id in pending
+                if user_id in self._connections or user_id in self._going_offline
+            ]
+        if not pending:
+            return
+        rows = [
+            {'user_id': user_id, 'seen': last_seen, 'online': online}
+            for user_id, (last_seen, online) in pending.items()
+        ]
+        statement = User.__table__.update().where(
+            User.__table__.c.id == bindparam('user_id')
+        ).values(last_seen=bindparam('seen'), is_online=bindparam('online'))
+        claims = PresenceClaim.__table__
+        with self.app.app_context():
+            try:
+                db.session.execute(statement, rows)
+                db.session.execute(claims.delete().where(
+                    claims.c.worker_id == self.worker_id, claims.c.user_id.in_(list(pending))
+                ))
+                if held:
+                    db.session.execute(claims.insert(), [
+                        {'worker_id': self.worker_id, 'user_id': user_id, 'seen_at': pending[user_id][0]}
+                        for user_id in held
+                    ])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Presence flush failed: {e}")
+                with self._lock:
+                    # Keep the newer values that arrived meanwhile
+                    for user_id, value in pending.items():
+                        self._dirty.setdefault(user_id, value)
+                return
+            finally:
+                db.session.remove()
+        with self._lock:
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+
+    def _push_status(self, user_id, is_online):
+        with self.app.app_context():
+            try:
+                peers = Conversation.peer_ids(user_id)
+            except Exception as e:
+                logging.error(f"Presence peers lookup failed for user {user_id}: {e}")
+                return
+            finally:
+                db.session.remove()
+        payload = {'userId': user_id, 'isOnline': is_online, 'lastSeen': datetime.utcnow().isoformat()}
+        for peer_id in peers:
+            self.socketio.emit('user_status', payload, room=f'user_{peer_id}')
+        with self._lock:
+            self.status_pushes += len(peers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'online_users': len(self._connections) + len(self._going_offline),
+                'connections': len(self._users),
+                'pending_writes': len(self._dirty),
+                'flushes': self.flushes,
+                'rows_flushed': self.rows_flushed,
+                'status_pushes': self.status_pushes,
+                'held_elsewhere': self.held_elsewhere
+            }
+
+# Global instance
+presence = PresenceRegistry()
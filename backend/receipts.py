@@ -0,0 +1,72 @@
+from flask import current_app
+from backend.models import Message, Conversation, ChangeLog, db, conversation_key_for
+from datetime import datetime
+
+# Upper bound on explicit id lists per receipt batch
+MAX_RECEIPT_IDS = 1000
+
+def apply_receipts(reader_id, status, peer_id=None, up_to_id=None, message_ids=None):
+    """Mark messages received by reader_id as delivered or read in one bulk UPDATE.
+
+    Select either everything from peer_id up to and including up_to_id, or an
+    explicit list of message_ids. Returns {sender_id: [message_id, ...]} for the
+    messages whose state changed. The caller commits.
+    """
+    if status not in ('delivered', 'read'):
+        return {}
+
+    query = db.select(Message.id, Message.sender_id).where(Message.receiver_id == reader_id)
+    if message_ids:
+        query = query.where(Message.id.in_([int(message_id) for message_id in message_ids[:MAX_RECEIPT_IDS]]))
+    elif peer_id is not None and up_to_id is not None:
+        query = query.where(
+            (Message.conversation_key == conversation_key_for(reader_id, peer_id)) &
+            (Message.id <= int(up_to_id))
+        )
+    else:
+        return {}
+
+    if status == 'read':
+        query = query.where(db.or_(Message.is_read == False, Message.is_read.is_(None)))
+    else:
+        query = query.where(db.or_(Message.is_delivered == False, Message.is_delivered.is_(None)))
+
+    changed = {}
+    for message_id, sender_id in db.session.execute(query).all():
+        changed.setdefault(sender_id, []).append(message_id)
+    if not changed:
+        return {}
+
+    ids = [message_id for sender_ids in changed.values() for message_id in sender_ids]
+    now = datetime.utcnow()
+    values = {
+        'is_delivered': True,
+        'delivered_at': db.func.coalesce(Message.delivered_at, now)
+    }
+    if status == 'read':
+        values.update({'is_read': True, 'read_at': now})
+        for sender_id, sender_ids in changed.items():
+            Conversation.mark_read(reader_id, sender_id, len(sender_ids))
+
+    db.session.execute(
+        db.update(Message).where(Message.id.in_(ids)).values(**values),
+        execution_options={'synchronize_session': False}
+    )
+    # Bulk UPDATEs bypass the mapper events, so feed the sync log here
+    entries = [(sender_id, 'receipt', message_id) for sender_id, sender_ids in changed.items() for message_id in sender_ids]
+    if status == 'read':
+        entries += [(reader_id, 'contact', sender_id) for sender_id in changed]
+    ChangeLog.append(db.session, entries)
+    return changed
+
+def notify_senders(changed, status):
+    """Send one coalesced message_status_update to each affected sender"""
+    socketio = current_app.extensions.get('socketio')
+    if not socketio:
+        return
+    for sender_id, message_ids in changed.items():
+        socketio.emit('message_status_update', {
+            'message_ids': sorted(message_ids),
+            'message_id': max(message_ids),
+            'status': status
+        }, room=f'user_{sender_id}')
@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from backend.models import User, db
-from backend.telegram_storage import telegram_storage
+from backend.media_pipeline import media_pipeline
+from backend import thumbnails
+from backend.session_cache import session_cache
+from backend.media_urls import avatar_url
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
@@ -9,6 +12,23 @@ import uuid
 
 auth_bp = Blueprint('auth', __name__)
 
+def revoke_session(session_id, reason):
+    """Tell every socket of a login session that it is no longer valid"""
+    socketio = current_app.extensions.get('socketio')
+    if socketio and session_id:
+        socketio.emit('session_revoked', {'reason': reason}, room=f'session_{session_id}')
+
+def user_payload(user):
+    """Profile of the logged-in user as returned by /me"""
+    return {
+        'id': user.id,
+        'phone': user.phone,
+        'name': user.name,
+        'avatar': avatar_url(user),
+        'is_online': user.is_online,
+        'is_private': user.is_private
+    }
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -67,9 +87,12 @@ def login():
             
             # Force logout from other sessions
             if user.session_id:
+                previous_session_id = user.session_id
                 user.session_id = None
                 user.is_online = False
                 db.session.commit()
+                session_cache.invalidate(user.id)
+                revoke_session(previous_session_id, 'logged_in_elsewhere')
             
             # Generate new session ID and login
             new_session_id = str(uuid.uuid4())
@@ -79,6 +102,7 @@ def login():
             login_user(user)
             session['user_session_id'] = new_session_id
             db.session.commit()
+            session_cache.invalidate(user.id)
             
             return jsonify({
                 'message': 'Login successful',
@@ -86,7 +110,7 @@ def login():
                     'id': user.id,
                     'phone': user.phone,
                     'name': user.name,
-                    'avatar': user.avatar
+                    'avatar': avatar_url(user)
                 }
             }), 200
         except Exception as e:
@@ -99,10 +123,13 @@ def login():
 @login_required
 def logout():
     try:
+        previous_session_id = current_user.session_id
         current_user.is_online = False
         current_user.session_id = None
         session.pop('user_session_id', None)
         db.session.commit()
+        session_cache.invalidate(current_user.id)
+        revoke_session(previous_session_id, 'logged_out')
         logout_user()
         return jsonify({'message': 'Logged out successfully'}), 200
     except Exception as e:
@@ -117,14 +144,7 @@ def get_current_user():
     if not session_id or current_user.session_id != session_id:
         return jsonify({'error': 'Session expired'}), 401
     
-    return jsonify({
-        'id': current_user.id,
-        'phone': current_user.phone,
-        'name': current_user.name,
-        'avatar': current_user.avatar,
-        'is_online': current_user.is_online,
-        'is_private': current_user.is_private
-    }), 200
+    return jsonify(user_payload(current_user)), 200
 
 @auth_bp.route('/check-session', methods=['GET'])
 def check_session():
@@ -150,6 +170,7 @@ def update_profile():
         if is_private is not None:
             current_user.is_private = bool(is_private)
         db.session.commit()
+        session_cache.invalidate(current_user.id)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Profile update failed'}), 500
@@ -160,7 +181,7 @@ def update_profile():
             'id': current_user.id,
             'phone': current_user.phone,
             'name': current_user.name,
-            'avatar': current_user.avatar,
+            'avatar': avatar_url(current_user),
             'is_private': current_user.is_private
         }
     }), 200
@@ -181,36 +202,23 @@ def upload_avatar():
         return jsonify({'error': 'Invalid file type. Only PNG, JPG, JPEG, GIF allowed'}), 400
     
     try:
-        # Save temporarily for Telegram upload
+        # Save locally; the Telegram upload runs in the background and swaps the URL
         filename = f"avatar_{current_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}"
         temp_path = os.path.join('uploads', filename)
         
         # Ensure uploads directory exists
         os.makedirs('uploads', exist_ok=True)
         file.save(temp_path)
-        
-        # Upload to Telegram
-        avatar_url = None
-        if telegram_storage:
-            try:
-                telegram_result = telegram_storage.upload_file(temp_path, 'photo')
-                if telegram_result:
-                    _, avatar_url = telegram_result
-                    # Delete local file after successful upload
-                    try:
-                        os.remove(temp_path)
-                    except OSError:
-                        pass
-            except Exception as e:
-                print(f"Telegram avatar upload error: {e}")
-        
-        if not avatar_url:
-            # Fallback to local storage if Telegram fails
-            avatar_url = f'/wa/uploads/{filename}'
+        avatar_url = f'/wa/uploads/{filename}'
         
         # Update user avatar
         current_user.avatar = avatar_url
         db.session.commit()
+        session_cache.invalidate(current_user.id)
+        # Old thumbnails go now; the pipeline makes new ones and uploads to Telegram
+        thumbnails.remove_derivatives(f'avatar_{current_user.id}')
+        if media_pipeline.active:
+            media_pipeline.submit_avatar(current_user.id, temp_path)
         
         return jsonify({
             'message': 'Avatar updated successfully',
@@ -219,7 +227,7 @@ def upload_avatar():
                 'id': current_user.id,
                 'phone': current_user.phone,
                 'name': current_user.name,
-                'avatar': current_user.avatar
+                'avatar': avatar_url(current_user)
             }
         }), 200
         
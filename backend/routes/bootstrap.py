@@ -0,0 +1,70 @@
+from flask import Blueprint, request, jsonify, session
+from flask_login import login_required, current_user
+from backend.models import Message, db, conversation_key_for
+from backend.routes.auth import user_payload
+from backend.routes.messages import contact_summaries, message_payloads, encode_cursor, settled_change_log_id
+
+bootstrap_bp = Blueprint('bootstrap', __name__)
+
+# Caps on how many conversations are preloaded and how many messages each
+MAX_BOOTSTRAP_CONVERSATIONS = 20
+MAX_BOOTSTRAP_MESSAGES = 50
+
+@bootstrap_bp.route('', methods=['GET'])
+@login_required
+def bootstrap():
+    """Everything the chat screen needs for first paint in one response.
+
+    The current user, the contact list with conversation tokens, the latest
+    messages of the most recent conversations and a sync cursor, read with a
+    fixed number of queries however many conversations are preloaded.
+    """
+    session_id = session.get('user_session_id')
+    if not session_id or current_user.session_id != session_id:
+        return jsonify({'error': 'Session expired'}), 401
+
+    top = min(max(request.args.get('conversations', 5, type=int), 0), MAX_BOOTSTRAP_CONVERSATIONS)
+    per_conversation = min(max(request.args.get('messages', 30, type=int), 1), MAX_BOOTSTRAP_MESSAGES)
+
+    try:
+        # Taken first so changes made while this response is built are replayed by sync
+        sync_id = settled_change_log_id()
+        contacts = contact_summaries(current_user.id)
+
+        peers = {conversation_key_for(current_user.id, contact['id']): contact['id'] for contact in contacts[:top]}
+        messages = []
+        if peers:
+            # Newest rows of each conversation in one query; one extra row tells whether there are older ones
+            ranked = db.select(
+                Message.id,
+                db.func.row_number().over(
+                    partition_by=Message.conversation_key, order_by=Message.id.desc()
+                ).label('rank')
+            ).where(Message.conversation_key.in_(peers)).subquery()
+            messages = Message.query.join(ranked, Message.id == ranked.c.id).filter(
+                ranked.c.rank <= per_conversation + 1
+            ).order_by(Message.id).all()
+    except Exception as e:
+        return jsonify({'error': 'Failed to load app data'}), 500
+
+    grouped = {key: [] for key in peers}
+    for msg in messages:
+        grouped[msg.conversation_key].append(msg)
+    has_more = {key: len(rows) > per_conversation for key, rows in grouped.items()}
+    grouped = {key: rows[-per_conversation:] for key, rows in grouped.items()}
+    # Decrypt and load media rows for all preloaded messages at once
+    payloads = message_payloads([msg for rows in grouped.values() for msg in rows])
+    by_id = {payload['id']: payload for payload in payloads}
+    conversations = [{
+        'contact_id': peers[key],
+        'messages': [by_id[msg.id] for msg in rows],
+        'has_more': has_more[key],
+        'next_cursor': encode_cursor('before', rows[0].id) if rows else None
+    } for key, rows in grouped.items()]
+
+    return jsonify({
+        'user': user_payload(current_user),
+        'contacts': contacts,
+        'conversations': conversations,
+        'sync_cursor': encode_cursor('after', sync_id)
+    }), 200
@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
 from backend.models import Call, User, db
-from datetime import datetime
+from backend.call_registry import call_registry
+from backend.call_stats import stats_for
+from backend.routes.messages import encode_cursor, decode_cursor
+from sqlalchemy.orm import joinedload
 
 calls_bp = Blueprint('calls', __name__)
 
@@ -32,6 +35,7 @@ def initiate_call():
         db.session.rollback()
         return jsonify({'error': 'Failed to initiate call'}), 500
     
+    call_registry.register(call)
     return jsonify({
         'call_id': call.id,
         'caller': {
@@ -48,94 +52,82 @@ def initiate_call():
         'status': 'initiated'
     }), 201
 
+def live_call(call_id):
+    """Registry state of a call, 404 when it does not exist"""
+    try:
+        state = call_registry.get(call_id)
+    except Exception as e:
+        return None, (jsonify({'error': 'Failed to load call'}), 500)
+    if state is None:
+        return None, (jsonify({'error': 'Call not found'}), 404)
+    return state, None
+
+def apply_transition(state, action):
+    """Run a state change; errors map to 403 for non-participants and 409 otherwise"""
+    error = call_registry.transition(state, current_user.id, action)
+    if error == 'Unauthorized':
+        return jsonify({'error': 'Unauthorized'}), 403
+    if error:
+        return jsonify({'error': error}), 409
+    return None
+
 @calls_bp.route('/<int:call_id>/answer', methods=['POST'])
 @login_required
 def answer_call(call_id):
-    call = Call.query.get_or_404(call_id)
-    
-    if call.receiver_id != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    try:
-        call.status = 'answered'
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': 'Failed to answer call'}), 500
+    state, failure = live_call(call_id)
+    if failure:
+        return failure
+    failure = apply_transition(state, 'answer')
+    if failure:
+        return failure
     
+    caller = db.session.get(User, state.caller_id)
     return jsonify({
-        'call_id': call.id,
+        'call_id': state.id,
         'status': 'answered',
         'caller': {
-            'id': call.caller.id,
-            'name': call.caller.name,
-            'phone': call.caller.phone
+            'id': caller.id,
+            'name': caller.name,
+            'phone': caller.phone
         }
     }), 200
 
 @calls_bp.route('/<int:call_id>/end', methods=['POST'])
 @login_required
 def end_call(call_id):
-    call = Call.query.get_or_404(call_id)
-    
-    if call.caller_id != current_user.id and call.receiver_id != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    try:
-        # If call was never answered, mark as missed
-        if call.status == 'initiated':
-            call.status = 'missed'
-        else:
-            call.status = 'ended'
-            
-        call.ended_at = datetime.utcnow()
-        if call.status == 'ended':
-            duration = (call.ended_at - call.started_at).total_seconds()
-            call.duration = int(duration)
-        
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': 'Failed to end call'}), 500
+    state, failure = live_call(call_id)
+    if failure:
+        return failure
+    # If the call was never answered it is recorded as missed
+    failure = apply_transition(state, 'end')
+    if failure:
+        return failure
     
     return jsonify({
-        'call_id': call.id,
-        'status': call.status,
-        'duration': call.duration
+        'call_id': state.id,
+        'status': state.status,
+        'duration': state.duration
     }), 200
 
 @calls_bp.route('/<int:call_id>/reject', methods=['POST'])
 @login_required
 def reject_call(call_id):
-    call = Call.query.get_or_404(call_id)
-    
-    if call.receiver_id != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    try:
-        call.status = 'missed'
-        call.ended_at = datetime.utcnow()
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': 'Failed to reject call'}), 500
+    state, failure = live_call(call_id)
+    if failure:
+        return failure
+    failure = apply_transition(state, 'reject')
+    if failure:
+        return failure
     
     return jsonify({
-        'call_id': call.id,
-        'status': 'missed'
+        'call_id': state.id,
+        'status': state.status
     }), 200
 
-@calls_bp.route('/history', methods=['GET'])
-@login_required
-def call_history():
-    try:
-        calls = Call.query.filter(
-            (Call.caller_id == current_user.id) | (Call.receiver_id == current_user.id)
-        ).order_by(Call.started_at.desc()).limit(50).all()
-    except Exception as e:
-        return jsonify({'error': 'Failed to load call history'}), 500
-    
-    return jsonify([{
+def call_payload(call):
+    # Calls this worker is tracking may have a newer state than the stored row
+    state = call_registry.peek(call.id)
+    return {
         'id': call.id,
         'caller': {
             'id': call.caller.id,
@@ -148,7 +140,83 @@ def call_history():
             'phone': call.receiver.phone
         },
         'call_type': call.call_type,
-        'status': call.status,
+        'status': state.status if state else call.status,
         'started_at': call.started_at.isoformat(),
-        'duration': call.duration
-    } for call in calls]), 200
\ No newline at end of file
+        'duration': state.duration if state else call.duration
+    }
+
+@calls_bp.route('/history', methods=['GET'])
+@login_required
+def call_history():
+    per_page = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    # Keyset mode: seek on the primary key, newest first
+    keyset_mode = any(arg in request.args for arg in ('cursor', 'before_id'))
+    before_id = request.args.get('before_id', type=int)
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args['cursor'])
+        if cursor is None or cursor[0] != 'before':
+            return jsonify({'error': 'Invalid cursor'}), 400
+        before_id = cursor[1]
+    
+    try:
+        query = Call.query.options(joinedload(Call.caller), joinedload(Call.receiver)).filter(
+            (Call.caller_id == current_user.id) | (Call.receiver_id == current_user.id)
+        )
+        if before_id is not None:
+            query = query.filter(Call.id < before_id)
+        calls = query.order_by(Call.id.desc()).limit(per_page + 1).all()
+    except Exception as e:
+        return jsonify({'error': 'Failed to load call history'}), 500
+    
+    has_more = len(calls) > per_page
+    calls = calls[:per_page]
+    history = [call_payload(call) for call in calls]
+    if not keyset_mode:
+        return jsonify(history), 200
+    
+    return jsonify({
+        'calls': history,
+        'has_more': has_more,
+        'next_cursor': encode_cursor('before', calls[-1].id) if has_more else None
+    }), 200
+
+@calls_bp.route('/stats', methods=['GET'])
+@login_required
+def call_stats():
+    try:
+        rows = stats_for(current_user.id)
+    except Exception as e:
+        return jsonify({'error': 'Failed to load call stats'}), 500
+    
+    def summary(calls, answered, missed, total_duration):
+        return {
+            'calls': calls,
+            'answered': answered,
+            'missed': missed,
+            'total_duration': total_duration,
+            'average_duration': round(total_duration / answered, 1) if answered else 0,
+            'missed_rate': round(missed / calls, 4) if calls else 0.0
+        }
+    
+    contacts = []
+    for row in rows:
+        contact = summary(row.calls, row.answered, row.missed, row.total_duration)
+        contact.update({
+            'contact': {
+                'id': row.peer.id,
+                'name': row.peer.name,
+                'phone': row.peer.phone
+            },
+            'outgoing': row.outgoing,
+            'incoming': row.incoming,
+            'last_call_at': row.last_call_at.isoformat() if row.last_call_at else None
+        })
+        contacts.append(contact)
+    
+    totals = summary(
+        sum(row.calls for row in rows),
+        sum(row.answered for row in rows),
+        sum(row.missed for row in rows),
+        sum(row.total_duration for row in rows)
+    )
+    return jsonify({'totals': totals, 'contacts': contacts}), 200
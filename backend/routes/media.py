@@ -0,0 +1,63 @@
+from flask import Blueprint, request, jsonify, redirect
+from backend.models import Message, db
+from backend.telegram_storage import telegram_storage
+from backend.media_cache import media_cache
+from backend.routes.messages import stream_upstream_file
+from backend import media_urls
+import os
+import requests
+
+media_bp = Blueprint('media', __name__)
+
+@media_bp.route('/<int:message_id>/<kind>/<path:ref>', methods=['GET'])
+def get_signed_media(message_id, kind, ref):
+    # The signature is the authorization, no session or database needed
+    remaining = media_urls.verify(message_id, kind, ref, request.args.get('exp'), request.args.get('sig'))
+    if remaining is None:
+        return jsonify({'error': 'Invalid or expired media URL'}), 403
+    if '/' in ref or ref.startswith('.'):
+        return jsonify({'error': 'File not found'}), 404
+    max_age = min(remaining, media_urls.MEDIA_URL_TTL)
+
+    if kind == 'd':
+        response = media_urls.serve_local(os.path.join('thumbs', ref), 'image/jpeg', max_age)
+        return response or (jsonify({'error': 'File not found'}), 404)
+
+    if kind == 'f':
+        response = media_urls.serve_local(ref, max_age=max_age)
+        if response is not None:
+            return response
+        # Local copy is gone once the Telegram upload finished; re-sign from the row
+        try:
+            message = db.session.get(Message, message_id)
+        except Exception as e:
+            return jsonify({'error': 'File access failed'}), 500
+        if message is None or not message.telegram_file_id:
+            return jsonify({'error': 'File not found'}), 404
+        return redirect(media_urls.signed_url(message.id, 't', message.telegram_file_id))
+
+    if kind == 't' and telegram_storage:
+        try:
+            if media_cache.enabled:
+                entry = media_cache.lookup(ref)
+                if entry is None and 'Range' in request.headers:
+                    # Seeking into a first view: stream it now, fill the cache behind it
+                    media_cache.prefetch(ref, lambda: telegram_storage.open_file(ref))
+                elif entry is None:
+                    entry = media_cache.fetch(ref, lambda: telegram_storage.open_file(ref))
+                if entry is not None:
+                    if not media_urls.MEDIA_OFFLOAD:
+                        return media_cache.send(entry, max_age)
+                    response = media_urls.serve_local(
+                        os.path.relpath(entry.path, media_urls.UPLOAD_DIR), entry.mimetype, max_age
+                    )
+                    if response is not None:
+                        return response
+            response = stream_upstream_file(lambda headers: telegram_storage.open_file(ref, headers))
+        except requests.RequestException:
+            return jsonify({'error': 'File temporarily unavailable'}), 502
+        if getattr(response, 'status_code', 0) in (200, 206):
+            response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        return response
+
+    return jsonify({'error': 'File not found'}), 404
@@ -1,20 +1,83 @@
-from flask import Blueprint, request, jsonify, redirect, Response
+from flask import Blueprint, request, jsonify, redirect, Response, current_app, send_file
 from flask_login import login_required, current_user
-from backend.models import Message, User, db
+from backend.models import Message, User, Conversation, MediaBlob, UploadSession, ChangeLog, ChangeLogPrune, db, conversation_key_for
 from backend.telegram_storage import telegram_storage
+from backend.media_pipeline import media_pipeline
+from backend.media_cache import media_cache
 from backend.encryption import message_encryption
+from backend.offload import cpu_offload
+from backend.message_cache import message_cache
+from backend.receipts import apply_receipts, notify_senders
+from backend.messaging import message_preview, create_text_message, message_payload, fanout_message, delete_message, media_fields
+from backend.media_blobs import acquire_blob, acquire_stored_blob, hash_file, reclaim_blob_files
+from backend import thumbnails
+from backend.presence import presence
+from backend.media_urls import avatar_url
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 import requests
+import base64
 import os
+import uuid
 
 messages_bp = Blueprint('messages', __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mp3', 'wav', 'webm', 'ogg'}
 
+# Resumable uploads: size cap (may exceed MAX_CONTENT_LENGTH), advertised chunk size and expiry
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 512 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 86400))
+UPLOAD_PARTIAL_DIR = os.path.join('uploads', 'partial')
+
+# Media proxy: chunk size and the headers relayed in each direction
+MEDIA_CHUNK_SIZE = 64 * 1024
+PROXY_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+PROXY_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Content-Encoding', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+# Conversation history: largest page a client may ask for
+CONVERSATION_MAX_LIMIT = 200
+
+# Delta sync: page size cap, how long change log entries are kept and how far
+# cursors trail the newest entry (log ids can commit out of order)
+SYNC_MAX_LIMIT = 1000
+SYNC_SETTLE_SECONDS = float(os.getenv('SYNC_SETTLE_SECONDS', 5))
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', 30))
+CHANGE_LOG_PRUNE_INTERVAL = 3600
+change_log_next_prune = {'at': datetime.min}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def upload_filename(filename):
+    """Stored name for an uploaded file, or None when it has no allowed extension.
+
+    secure_filename can strip the stem and the dot of non-ASCII names
+    ("日本.png" becomes "png"), so the sanitized name is checked again.
+    """
+    if filename == 'voice_message.webm':
+        return 'voice.webm'
+    if not allowed_file(filename):
+        return None
+    filename = secure_filename(filename)
+    return filename if allowed_file(filename) else None
+
+def encode_cursor(direction, message_id):
+    """Encode a pagination position as an opaque cursor string"""
+    raw = f"{direction}:{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into (direction, message_id), or None if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        if direction not in ('before', 'after'):
+            return None
+        return direction, int(message_id)
+    except Exception:
+        return None
+
 @messages_bp.route('/send', methods=['POST'])
 @login_required
 def send_message():
@@ -46,28 +109,16 @@ def send_message():
     if not content or not content.strip():
         return jsonify({'error': 'Message content required'}), 400
     
-    # Encrypt message content
-    encrypted_content = message_encryption.encrypt_message(content)
-    
     try:
-        message = Message(
-            sender_id=current_user.id,
-            receiver_id=receiver_id,
-            content=encrypted_content,
-            message_type='text'
-        )
-        db.session.add(message)
-        db.session.commit()
+        message = create_text_message(current_user.id, receiver_id, content)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to send message'}), 500
     
-    return jsonify({
-        'id': message.id,
-        'content': content,  # Return original content, not encrypted
-        'timestamp': message.timestamp.isoformat(),
-        'sender_id': message.sender_id
-    }), 201
+    # Deliver to the receiver from here; clients no longer relay messages
+    fanout_message(message, content, current_user)
+    
+    return jsonify(message_payload(message, content)), 201
 
 @messages_bp.route('/send-media', methods=['POST'])
 @login_required
@@ -93,79 +144,196 @@ def send_media():
         return jsonify({'error': 'Invalid receiver ID'}), 400
     
     # Handle files without extension (like voice messages)
-    if file and (allowed_file(file.filename) or file.filename == 'voice_message.webm'):
-        # Handle voice messages and other files
-        if file.filename == 'voice_message.webm':
-            filename = f"voice_{datetime.now().strftime('%Y%m%d_%H%M%S')}.webm"
-        else:
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
-        file_path = os.path.join('uploads', filename)
-        file.save(file_path)
-        
-        # Determine message type based on file extension
+    filename = upload_filename(file.filename or '')
+    if filename:
         ext = filename.rsplit('.', 1)[1].lower()
-        if ext in ['png', 'jpg', 'jpeg', 'gif']:
-            message_type = 'image'
-            telegram_type = 'photo'
-        elif ext in ['mp4']:
-            message_type = 'video'
-            telegram_type = 'video'
-        elif ext in ['mp3', 'wav', 'webm', 'ogg']:
-            message_type = 'audio'
-            telegram_type = 'document'
-        else:
-            message_type = 'file'
-            telegram_type = 'document'
-        
-        # Upload to Telegram (prioritize Telegram storage)
-        telegram_file_id = None
-        telegram_file_url = None
-        
-        if telegram_storage:
-            try:
-                telegram_result = telegram_storage.upload_file(file_path, telegram_type)
-                if telegram_result:
-                    telegram_file_id, telegram_file_url = telegram_result
-                    # Delete local file after successful upload to save space
-                    try:
-                        os.remove(file_path)
-                        file_path = None
-                    except OSError:
-                        pass
-                else:
-                    print(f"Telegram upload failed for {file_path}")
-            except Exception as e:
-                print(f"Telegram storage error: {e}")
-                # Continue with local storage if Telegram fails
-                pass
+        return create_media_message(receiver_id, ext, caption, lambda: acquire_blob(file, ext))
+    
+    return jsonify({'error': 'Invalid file type'}), 400
+
+def media_type_for(ext):
+    """Message type for a file extension"""
+    if ext in ['png', 'jpg', 'jpeg', 'gif']:
+        return 'image'
+    if ext in ['mp4']:
+        return 'video'
+    if ext in ['mp3', 'wav', 'webm', 'ogg']:
+        return 'audio'
+    return 'file'
+
+def create_media_message(receiver_id, ext, caption, store_blob):
+    """Create, queue and fan out a media message; store_blob() returns (blob, created)"""
+    message_type = media_type_for(ext)
+    content = caption if caption else f"Sent a {message_type}"
+    try:
+        # Content-addressed: repeat sends of the same bytes share one stored copy
+        blob, created = store_blob()
+        if blob.telegram_file_id:
+            media_status = 'ready'
         else:
-            print("Telegram storage not configured, using local storage")
-        
-        content = caption if caption else f"Sent a {message_type}"
+            # Telegram upload runs in the background, the local copy is served meanwhile
+            media_status = 'pending' if media_pipeline.enabled else 'ready'
         message = Message(
             sender_id=current_user.id,
             receiver_id=receiver_id,
             content=content,
             message_type=message_type,
-            file_path=file_path,
-            telegram_file_id=telegram_file_id,
-            telegram_file_url=telegram_file_url
+            file_path=None if blob.telegram_file_id else blob.local_path,
+            telegram_file_id=blob.telegram_file_id,
+            telegram_file_url=blob.telegram_file_url,
+            blob_id=blob.id,
+            media_status=media_status
         )
         db.session.add(message)
+        db.session.flush()
+        Conversation.record_message(message, message_preview(message_type, content))
         db.session.commit()
-        
-        # Return secure response without exposing URLs
-        return jsonify({
-            'id': message.id,
-            'content': message.content,
-            'message_type': message.message_type,
-            'secure_file_id': message.id,  # Use message ID as secure identifier
-            'timestamp': message.timestamp.isoformat()
-        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to send media'}), 500
     
-    return jsonify({'error': 'Invalid file type'}), 400
+    # Background Telegram upload and/or thumbnail generation
+    if media_status == 'pending' or (created and media_pipeline.active):
+        media_pipeline.submit_message(message.id)
+    fanout_message(message, content, current_user)
+    
+    # Return secure response without exposing URLs (secure_file_id is the message ID)
+    return jsonify(message_payload(message, content)), 201
+
+@messages_bp.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """Start a resumable upload: {receiver_id, filename, size, caption?}"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid JSON data'}), 400
+    
+    try:
+        receiver_id = int(data.get('receiver_id'))
+        total_size = int(data.get('size'))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'receiver_id and size required'}), 400
+    
+    filename = upload_filename(data.get('filename') or '')
+    if not filename:
+        return jsonify({'error': 'Invalid file type'}), 400
+    if total_size <= 0 or total_size > MAX_UPLOAD_SIZE:
+        return jsonify({'error': f'File size must be between 1 and {MAX_UPLOAD_SIZE} bytes'}), 413
+    
+    upload_id = uuid.uuid4().hex
+    temp_path = os.path.join(UPLOAD_PARTIAL_DIR, f'{upload_id}.part')
+    try:
+        purge_expired_uploads()
+        os.makedirs(UPLOAD_PARTIAL_DIR, exist_ok=True)
+        open(temp_path, 'wb').close()
+        db.session.add(UploadSession(
+            id=upload_id,
+            user_id=current_user.id,
+            receiver_id=receiver_id,
+            filename=filename,
+            mime_type=data.get('mime_type'),
+            caption=data.get('caption', ''),
+            total_size=total_size,
+            received=0,
+            temp_path=temp_path
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to start upload'}), 500
+    
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'size': total_size, 'chunk_size': UPLOAD_CHUNK_SIZE}), 201
+
+@messages_bp.route('/uploads/<string:upload_id>', methods=['GET'])
+@login_required
+def get_upload(upload_id):
+    """Where to resume: the number of bytes received so far"""
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'upload_id': upload.id, 'offset': upload.received, 'size': upload.total_size}), 200
+
+@messages_bp.route('/uploads/<string:upload_id>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id):
+    """Append the raw request body at ?offset=, which must equal the bytes received so far"""
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset required'}), 400
+    if offset != upload.received:
+        # Client is out of step (e.g. a lost response), tell it where to resume
+        return jsonify({'error': 'Offset mismatch', 'offset': upload.received}), 409
+    
+    written = 0
+    try:
+        # Stream the body straight to disk without buffering the whole chunk
+        with open(upload.temp_path, 'r+b') as out:
+            out.seek(offset)
+            out.truncate()
+            while True:
+                chunk = request.stream.read(64 * 1024)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if offset + written > upload.total_size:
+                    return jsonify({'error': 'Chunk exceeds declared size', 'offset': upload.received}), 413
+                out.write(chunk)
+        # Conditional so a concurrent retry of the same chunk can't double count
+        UploadSession.query.filter_by(id=upload.id, received=offset).update(
+            {'received': offset + written, 'updated_at': datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+    except OSError:
+        db.session.rollback()
+        return jsonify({'error': 'Upload not found'}), 404
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to store chunk'}), 500
+    
+    return jsonify({'upload_id': upload.id, 'offset': offset + written, 'size': upload.total_size}), 200
+
+@messages_bp.route('/uploads/<string:upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    """Turn a fully received upload into a media message"""
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload.received != upload.total_size:
+        return jsonify({'error': 'Upload incomplete', 'offset': upload.received}), 409
+    
+    try:
+        sha256, size = cpu_offload.run(hash_file, upload.temp_path)
+    except OSError:
+        return jsonify({'error': 'Upload not found'}), 404
+    if size != upload.total_size:
+        return jsonify({'error': 'Upload incomplete', 'offset': size}), 409
+    
+    receiver_id, caption, temp_path = upload.receiver_id, upload.caption, upload.temp_path
+    ext = upload.filename.rsplit('.', 1)[1].lower()
+    mime_type = upload.mime_type
+    
+    def store_blob():
+        # The session row goes in the same commit as the message
+        db.session.delete(upload)
+        return acquire_stored_blob(temp_path, sha256, size, mime_type, ext)
+    
+    return create_media_message(receiver_id, ext, caption, store_blob)
+
+def purge_expired_uploads():
+    """Drop abandoned upload sessions and their partial files; caller commits"""
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL)
+    for upload in UploadSession.query.filter(UploadSession.updated_at < cutoff).limit(100).all():
+        try:
+            os.remove(upload.temp_path)
+        except OSError:
+            pass
+        db.session.delete(upload)
 
 @messages_bp.route('/conversation/<string:encrypted_token>', methods=['GET'])
 @login_required
@@ -175,85 +343,274 @@ def get_conversation(encrypted_token):
     if target_user_id is None:
         return jsonify({'error': 'Invalid or unauthorized token'}), 403
     
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('limit', 50, type=int)
-    offset = (page - 1) * per_page
+    per_page = min(max(request.args.get('limit', 50, type=int), 1), CONVERSATION_MAX_LIMIT)
+    # Single index range on (conversation_key, id) instead of an OR over both directions
+    conversation_filter = Message.conversation_key == conversation_key_for(current_user.id, target_user_id)
+    
+    # Keyset mode: seek on the primary key instead of OFFSET + COUNT
+    keyset_mode = any(arg in request.args for arg in ('cursor', 'before_id', 'after_id'))
     
     try:
-        total_messages = Message.query.filter(
-            ((Message.sender_id == current_user.id) & (Message.receiver_id == target_user_id)) |
-            ((Message.sender_id == target_user_id) & (Message.receiver_id == current_user.id))
-        ).count()
-        
-        messages = Message.query.filter(
-            ((Message.sender_id == current_user.id) & (Message.receiver_id == target_user_id)) |
-            ((Message.sender_id == target_user_id) & (Message.receiver_id == current_user.id))
-        ).order_by(Message.timestamp.desc()).offset(offset).limit(per_page).all()
-        
-        # Reverse to show oldest first within the page
-        messages = list(reversed(messages))
+        if keyset_mode:
+            before_id = request.args.get('before_id', type=int)
+            after_id = request.args.get('after_id', type=int)
+            if request.args.get('cursor'):
+                cursor = decode_cursor(request.args['cursor'])
+                if cursor is None:
+                    return jsonify({'error': 'Invalid cursor'}), 400
+                direction, cursor_id = cursor
+                if direction == 'after':
+                    after_id = cursor_id
+                else:
+                    before_id = cursor_id
+            
+            query = Message.query.filter(conversation_filter)
+            if after_id is not None:
+                # Newer messages, oldest first
+                messages = query.filter(Message.id > after_id).order_by(Message.id.asc()).limit(per_page + 1).all()
+                has_more = len(messages) > per_page
+                messages = messages[:per_page]
+            else:
+                if before_id is not None:
+                    query = query.filter(Message.id < before_id)
+                messages = query.order_by(Message.id.desc()).limit(per_page + 1).all()
+                has_more = len(messages) > per_page
+                messages = list(reversed(messages[:per_page]))
+        else:
+            page = max(request.args.get('page', 1, type=int), 1)
+            offset = (page - 1) * per_page
+            
+            total_messages = Message.query.filter(conversation_filter).count()
+            
+            messages = Message.query.filter(conversation_filter).order_by(
+                Message.id.desc()
+            ).offset(offset).limit(per_page).all()
+            
+            # Reverse to show oldest first within the page
+            messages = list(reversed(messages))
     except Exception as e:
         return jsonify({'error': 'Failed to load conversation'}), 500
     
-    # Decrypt messages and encrypt API response
+    decrypted_messages = message_payloads(messages)
+    
+    if keyset_mode:
+        response_data = {
+            'messages': decrypted_messages,
+            'has_more': has_more,
+            # Older page when paging backwards, newer page when catching up
+            'next_cursor': (
+                encode_cursor('after' if after_id is not None else 'before',
+                              messages[-1].id if after_id is not None else messages[0].id)
+                if messages else None
+            )
+        }
+    else:
+        response_data = {
+            'messages': decrypted_messages,
+            'has_more': offset + len(messages) < total_messages,
+            'total': total_messages
+        }
+    
+    return jsonify(message_encryption.encrypt_api_response(response_data)), 200
+
+def message_payloads(messages):
+    """Client payloads for messages, text decrypted through the message cache"""
+    # Serve decrypted text from the cache; decrypt the misses in one offloaded batch
+    text_messages = [msg for msg in messages if msg.message_type == 'text']
+    decrypted = message_cache.get_many([msg.id for msg in text_messages])
+    missing = [msg for msg in text_messages if msg.id not in decrypted]
+    if missing:
+        plaintexts = cpu_offload.run(message_encryption.decrypt_messages, [msg.content for msg in missing])
+        fresh = {msg.id: content for msg, content in zip(missing, plaintexts)}
+        message_cache.put_many(fresh)
+        decrypted.update(fresh)
+    
+    # One query for the page's shared media rows (thumbnails, placeholders)
+    blob_ids = {msg.blob_id for msg in messages if msg.blob_id}
+    blobs = {blob.id: blob for blob in MediaBlob.query.filter(MediaBlob.id.in_(blob_ids))} if blob_ids else {}
+    
     decrypted_messages = []
     for msg in messages:
-        decrypted_content = message_encryption.decrypt_message(msg.content) if msg.message_type == 'text' else msg.content
+        decrypted_content = decrypted.get(msg.id, msg.content)
         message_data = {
             'id': msg.id,
             'content': decrypted_content,
             'message_type': msg.message_type,
             'timestamp': msg.timestamp.isoformat(),
             'sender_id': msg.sender_id,
+            'receiver_id': msg.receiver_id,
             'is_read': msg.is_read,
             'is_delivered': getattr(msg, 'is_delivered', False)
         }
-        # Add secure file ID for media messages
-        if msg.message_type in ['image', 'video', 'audio']:
-            message_data['secure_file_id'] = msg.id
+        # Secure file ID, upload state and thumbnails for media messages
+        message_data.update(media_fields(msg, blobs.get(msg.blob_id)))
         decrypted_messages.append(message_data)
-    
-    response_data = {
-        'messages': decrypted_messages,
-        'has_more': offset + len(messages) < total_messages,
-        'total': total_messages
-    }
-    
-    return jsonify(message_encryption.encrypt_api_response(response_data)), 200
+    return decrypted_messages
 
-@messages_bp.route('/contacts', methods=['GET'])
-@login_required
-def get_contacts():
-    try:
-        # Get users with their latest message timestamp for sorting
-        contacts_query = db.session.query(
-            User,
-            db.func.max(Message.timestamp).label('last_message_time')
-        ).join(
-            Message, 
-            (Message.sender_id == User.id) | (Message.receiver_id == User.id)
-        ).filter(
-            ((Message.sender_id == current_user.id) | (Message.receiver_id == current_user.id)) &
-            (User.id != current_user.id)
-        ).group_by(User.id).order_by(db.desc('last_message_time')).all()
-        
-        contacts = [contact[0] for contact in contacts_query]
-    except Exception as e:
-        return jsonify({'error': 'Failed to load contacts'}), 500
+def contact_summaries(user_id, peer_ids=None):
+    """Contact list entries built from the conversation summaries, newest first.
+
+    peer_ids restricts the result to those contacts.
+    """
+    # One indexed read of the conversation summaries
+    peer_join = (
+        ((Conversation.user_low_id == user_id) & (User.id == Conversation.user_high_id)) |
+        ((Conversation.user_high_id == user_id) & (User.id == Conversation.user_low_id))
+    )
+    query = db.session.query(Conversation, User).join(User, peer_join).filter(
+        (Conversation.user_low_id == user_id) | (Conversation.user_high_id == user_id)
+    )
+    if peer_ids is not None:
+        if not peer_ids:
+            return []
+        query = query.filter(User.id.in_(peer_ids))
+    contacts_query = query.order_by(Conversation.last_message_at.desc()).all()
     
+    tokens = message_encryption.create_secure_tokens(user_id, [user.id for _, user in contacts_query])
     contact_list = []
-    for user in contacts:
+    for conversation, user in contacts_query:
+        preview = conversation.last_message_preview
+        if conversation.last_message_type == 'text':
+            preview = message_encryption.decrypt_message(preview)
         contact_list.append({
             'id': user.id,
             'name': user.name,
             'phone': user.phone,
-            'avatar': user.avatar,
-            'is_online': user.is_online,
-            'last_seen': user.last_seen.isoformat() if user.last_seen else None
+            'avatar': avatar_url(user),
+            'is_online': presence.is_online(user.id, user.is_online),
+            'last_seen': user.last_seen.isoformat() if user.last_seen else None,
+            'token': tokens[user.id],
+            'unread_count': conversation.unread_for(user_id),
+            'last_message': {
+                'id': conversation.last_message_id,
+                'preview': preview,
+                'message_type': conversation.last_message_type,
+                'sender_id': conversation.last_sender_id,
+                'timestamp': conversation.last_message_at.isoformat() if conversation.last_message_at else None
+            }
         })
+    return contact_list
+
+@messages_bp.route('/contacts', methods=['GET'])
+@login_required
+def get_contacts():
+    try:
+        contact_list = contact_summaries(current_user.id)
+    except Exception as e:
+        return jsonify({'error': 'Failed to load contacts'}), 500
     
     return jsonify(contact_list), 200
 
+@messages_bp.route('/sync', methods=['GET'])
+@login_required
+def sync_changes():
+    """Everything that changed for the current user since a sync cursor.
+
+    Without since, returns the current cursor only; clients take it after a
+    full load and pass it back on reconnect. Pages hold up to limit change
+    log entries; follow next cursor while has_more. 410 means the cursor is
+    older than the retained log and the client must reload in full.
+    
+    Entries are served once they are SYNC_SETTLE_SECONDS old, see
+    settled_change_log_id; newer changes reach clients over the socket and
+    come again with the next sync.
+    """
+    limit = min(max(request.args.get('limit', 500, type=int), 1), SYNC_MAX_LIMIT)
+    since = request.args.get('since')
+    
+    try:
+        prune_change_log()
+        settled_id = settled_change_log_id()
+        if not since:
+            return jsonify({'cursor': encode_cursor('after', settled_id), 'has_more': False}), 200
+        
+        cursor = decode_cursor(since)
+        if cursor is None or cursor[0] != 'after':
+            return jsonify({'error': 'Invalid cursor'}), 400
+        since_id = cursor[1]
+        
+        # Entries after the cursor were pruned if it is below the prune watermark. A
+        # cursor past both the newest entry and the watermark predates a reset of
+        # the log (restored database) and cannot be trusted either.
+        pruned_id = ChangeLogPrune.watermark()
+        newest_id = db.session.execute(db.select(db.func.max(ChangeLog.id))).scalar() or 0
+        if since_id < pruned_id or since_id > max(newest_id, pruned_id):
+            return jsonify({'error': 'Sync cursor expired, reload required'}), 410
+        
+        entries = ChangeLog.query.filter(
+            ChangeLog.user_id == current_user.id, ChangeLog.id > since_id, ChangeLog.id <= settled_id
+        ).order_by(ChangeLog.id).limit(limit + 1).all()
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        # A complete page covers everything up to the settled id, later pages start there
+        next_id = entries[-1].id if has_more else max(since_id, settled_id)
+        
+        # Collapse repeated entries for the same row; deletes win over updates
+        deleted_ids = {entry.ref_id for entry in entries if entry.kind == 'delete'}
+        message_ids = {entry.ref_id for entry in entries if entry.kind in ('message', 'receipt')} - deleted_ids
+        full_ids = {entry.ref_id for entry in entries if entry.kind == 'message'} - deleted_ids
+        contact_ids = {entry.ref_id for entry in entries if entry.kind == 'contact'}
+        
+        messages = Message.query.filter(Message.id.in_(message_ids)).order_by(Message.id).all() if message_ids else []
+        full = [msg for msg in messages if msg.id in full_ids]
+        receipts = [
+            {'id': msg.id, 'is_delivered': bool(msg.is_delivered), 'is_read': bool(msg.is_read)}
+            for msg in messages if msg.id not in full_ids
+        ]
+        for msg in full:
+            contact_ids.add(msg.receiver_id if msg.sender_id == current_user.id else msg.sender_id)
+        
+        message_list = message_payloads(full)
+        contacts = contact_summaries(current_user.id, contact_ids)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to sync'}), 500
+    
+    response_data = {
+        'messages': message_list,
+        'receipts': receipts,
+        'deleted_message_ids': sorted(deleted_ids),
+        'contacts': contacts,
+        'cursor': encode_cursor('after', next_id),
+        'has_more': has_more
+    }
+    return jsonify(message_encryption.encrypt_api_response(response_data)), 200
+
+def latest_change_log_id(before):
+    """Id of the newest change log entry created before a time, None if there is none"""
+    return db.session.execute(
+        db.select(ChangeLog.id).where(ChangeLog.created_at < before)
+        .order_by(ChangeLog.created_at.desc(), ChangeLog.id.desc()).limit(1)
+    ).scalar()
+
+def settled_change_log_id():
+    """Highest log id a sync cursor may move to.
+
+    Ids are handed out at insert but become visible at commit, so a
+    transaction can commit id 12 while id 11 is still open; a cursor at 12
+    would skip 11 for good. Transactions are assumed to finish within
+    SYNC_SETTLE_SECONDS, so every id up to the newest entry older than that
+    is committed.
+    """
+    if SYNC_SETTLE_SECONDS > 0:
+        settled_id = latest_change_log_id(datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS))
+    else:
+        settled_id = db.session.execute(db.select(db.func.max(ChangeLog.id))).scalar()
+    return settled_id or ChangeLogPrune.watermark()
+
+def prune_change_log():
+    """Drop change log entries older than the retention window, at most once per interval"""
+    now = datetime.utcnow()
+    if now < change_log_next_prune['at']:
+        return
+    change_log_next_prune['at'] = now + timedelta(seconds=CHANGE_LOG_PRUNE_INTERVAL)
+    pruned_id = latest_change_log_id(now - timedelta(days=CHANGE_LOG_RETENTION_DAYS))
+    if pruned_id is None:
+        return
+    ChangeLog.query.filter(ChangeLog.id <= pruned_id).delete(synchronize_session=False)
+    ChangeLogPrune.advance(pruned_id)
+    db.session.commit()
+
 @messages_bp.route('/encrypt-id', methods=['POST'])
 @login_required
 def encrypt_user_id():
@@ -298,24 +655,26 @@ def get_media_file(message_id):
         if message.sender_id != current_user.id and message.receiver_id != current_user.id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        # Thumbnail variant (?size=small|thumb) when one was generated
+        size = request.args.get('size')
+        if size and message.blob is not None and size in message.blob.thumbnail_sizes():
+            thumbnail_path = thumbnails.derivative_path(message.blob.sha256, size)
+            if os.path.exists(thumbnail_path):
+                return send_file(thumbnail_path, mimetype='image/jpeg', conditional=True, max_age=86400)
+        
         # Get file URL (Telegram or local)
         file_url = message.telegram_file_url or (message.file_path and f'/wa/uploads/{message.file_path.split("/")[-1]}')
         
         if not file_url:
             return jsonify({'error': 'File not found'}), 404
         
-        # If it's a Telegram URL, proxy the request to hide the bot token
-        if file_url.startswith('https://api.telegram.org'):
-            try:
-                response = requests.get(file_url, timeout=30)
-                if response.status_code == 200:
-                    return Response(
-                        response.content,
-                        mimetype=response.headers.get('content-type', 'application/octet-stream'),
-                        headers={'Cache-Control': 'max-age=3600'}
-                    )
-            except Exception:
-                pass
+        # Telegram files are proxied to hide the bot token; the stored URL may have
+        # expired, so the download path is resolved (and cached) from the file id
+        if telegram_storage and message.telegram_file_id:
+            return serve_telegram_file(message.telegram_file_id)
+        if message.telegram_file_url and not message.file_path:
+            # Never redirect to a Telegram URL, it carries the bot token
+            return jsonify({'error': 'File temporarily unavailable'}), 502
         
         # For local files, redirect to the file
         return redirect(file_url)
@@ -323,6 +682,88 @@ def get_media_file(message_id):
     except Exception as e:
         return jsonify({'error': 'File access failed'}), 500
 
+def serve_telegram_file(file_id):
+    """Serve a Telegram file from the local disk cache, filling it on first view, or relay it"""
+    try:
+        if media_cache.enabled:
+            entry = media_cache.lookup(file_id)
+            if entry is None and 'Range' in request.headers:
+                # Seeking into a first view: stream it now, fill the cache behind it
+                media_cache.prefetch(file_id, lambda: telegram_storage.open_file(file_id))
+            elif entry is None:
+                entry = media_cache.fetch(file_id, lambda: telegram_storage.open_file(file_id))
+            if entry is not None:
+                return media_cache.send(entry)
+        return stream_upstream_file(lambda headers: telegram_storage.open_file(file_id, headers))
+    except requests.RequestException:
+        return jsonify({'error': 'File temporarily unavailable'}), 502
+
+def stream_upstream_file(open_upstream):
+    """Relay an upstream file in chunks, passing Range and conditional requests through.
+    
+    open_upstream(headers) returns a streamed requests.Response or None.
+    """
+    forward = {name: request.headers[name] for name in PROXY_REQUEST_HEADERS if name in request.headers}
+    upstream = open_upstream(forward)
+    if upstream is None or upstream.status_code not in (200, 206, 304, 416):
+        if upstream is not None:
+            upstream.close()
+        return jsonify({'error': 'File temporarily unavailable'}), 502
+    
+    headers = {name: upstream.headers[name] for name in PROXY_RESPONSE_HEADERS if name in upstream.headers}
+    headers['Cache-Control'] = 'max-age=3600'
+    
+    def generate():
+        try:
+            # Raw bytes so Content-Length and Content-Range stay accurate
+            for chunk in upstream.raw.stream(MEDIA_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+    
+    if upstream.status_code == 304:
+        upstream.close()
+        return Response(status=304, headers=headers)
+    return Response(
+        generate(),
+        status=upstream.status_code,
+        mimetype=upstream.headers.get('content-type', 'application/octet-stream'),
+        headers=headers,
+        direct_passthrough=True
+    )
+
+@messages_bp.route('/<int:message_id>', methods=['DELETE'])
+@login_required
+def delete_message_route(message_id):
+    """Sender deletes a message for both participants.
+
+    This is the path that drops media references: when the last message
+    linking a blob goes, the blob row, its local file, thumbnails and
+    disk-cache copy are reclaimed.
+    """
+    try:
+        message = db.session.get(Message, message_id)
+        if not message:
+            return jsonify({'error': 'Message not found'}), 404
+        if message.sender_id != current_user.id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        participants = {message.sender_id, message.receiver_id}
+        released = delete_message(message)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to delete message'}), 500
+    
+    # Last reference gone: reclaim the stored copies
+    reclaim_blob_files(released)
+    
+    socketio = current_app.extensions.get('socketio')
+    if socketio:
+        for user_id in participants:
+            socketio.emit('message_deleted', {'message_id': message_id}, room=f'user_{user_id}')
+    return jsonify({'message': 'Message deleted'}), 200
+
 @messages_bp.route('/mark-delivered/<int:message_id>', methods=['POST'])
 @login_required
 def mark_message_delivered(message_id):
@@ -347,6 +788,8 @@ def mark_message_read(message_id):
             if not getattr(message, 'is_delivered', False):
                 message.is_delivered = True
                 message.delivered_at = datetime.utcnow()
+            if not message.is_read:
+                Conversation.mark_read(message.receiver_id, message.sender_id, 1)
             message.is_read = True
             message.read_at = datetime.utcnow()
             db.session.commit()
@@ -354,4 +797,44 @@ def mark_message_read(message_id):
         return jsonify({'error': 'Unauthorized'}), 403
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': 'Failed to mark message as read'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to mark message as read'}), 500
+
+@messages_bp.route('/mark-read', methods=['POST'])
+@login_required
+def mark_messages_read():
+    return _apply_receipt_batch('read')
+
+@messages_bp.route('/mark-delivered', methods=['POST'])
+@login_required
+def mark_messages_delivered():
+    return _apply_receipt_batch('delivered')
+
+def _apply_receipt_batch(status):
+    """Apply a batch receipt: {peer_id, up_to_id} or {message_ids: [...]}"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid JSON data'}), 400
+    
+    message_ids = data.get('message_ids')
+    if message_ids is not None and not isinstance(message_ids, list):
+        return jsonify({'error': 'message_ids must be a list'}), 400
+    if not message_ids and (data.get('peer_id') is None or data.get('up_to_id') is None):
+        return jsonify({'error': 'peer_id and up_to_id or message_ids required'}), 400
+    
+    try:
+        changed = apply_receipts(
+            current_user.id, status,
+            peer_id=data.get('peer_id'),
+            up_to_id=data.get('up_to_id'),
+            message_ids=message_ids
+        )
+        db.session.commit()
+    except (ValueError, TypeError):
+        db.session.rollback()
+        return jsonify({'error': 'Invalid message ids'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Failed to mark messages as {status}'}), 500
+    
+    notify_senders(changed, status)
+    return jsonify({'updated': sum(len(ids) for ids in changed.values())}), 200
\ No newline at end of file
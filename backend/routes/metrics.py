@@ -0,0 +1,16 @@
+from flask import Blueprint, request, jsonify
+from backend import metrics
+import hmac
+import os
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('', methods=['GET'])
+def get_metrics():
+    # Scrapers only: METRICS_TOKEN as a bearer token; unset disables the endpoint
+    token = os.getenv('METRICS_TOKEN')
+    auth_header = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(auth_header, f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(metrics.snapshot()), 200
@@ -1,6 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, redirect, send_file
 from flask_login import login_required, current_user
 from backend.models import User, db
+from backend.encryption import message_encryption
+from backend import thumbnails
+from backend.presence import presence
+from backend.telegram_storage import telegram_storage
+from backend.media_urls import avatar_url, TELEGRAM_AVATAR_PREFIX
+from backend.routes.messages import serve_telegram_file, stream_upstream_file
+import os
+import requests
 
 users_bp = Blueprint('users', __name__)
 
@@ -20,12 +28,14 @@ def search_users():
     except Exception as e:
         return jsonify({'error': 'Search failed'}), 500
     
+    tokens = message_encryption.create_secure_tokens(current_user.id, [user.id for user in users])
     return jsonify([{
         'id': user.id,
         'name': user.name,
         'phone': user.phone,
-        'avatar': user.avatar,
-        'is_online': user.is_online
+        'avatar': avatar_url(user),
+        'is_online': presence.is_online(user.id, user.is_online),
+        'token': tokens[user.id]
     } for user in users]), 200
 
 @users_bp.route('/by-phone/<phone>', methods=['GET'])
@@ -42,6 +52,40 @@ def get_user_by_phone(phone):
         'id': user.id,
         'name': user.name,
         'phone': user.phone,
-        'avatar': user.avatar,
-        'is_online': user.is_online
-    }), 200
\ No newline at end of file
+        'avatar': avatar_url(user),
+        'is_online': presence.is_online(user.id, user.is_online),
+        'token': message_encryption.create_secure_token(current_user.id, user.id)
+    }), 200
+
+@users_bp.route('/<int:user_id>/avatar', methods=['GET'])
+@login_required
+def get_avatar(user_id):
+    # Small generated variant when there is one, the uploaded avatar otherwise
+    size = request.args.get('size', 'small')
+    if size in thumbnails.THUMBNAIL_SIZES:
+        thumbnail_path = thumbnails.derivative_path(f'avatar_{user_id}', size)
+        if os.path.exists(thumbnail_path):
+            return send_file(thumbnail_path, mimetype='image/jpeg', conditional=True)
+    
+    try:
+        user = db.session.get(User, user_id)
+    except Exception as e:
+        return jsonify({'error': 'Database error'}), 500
+    if not user or not user.avatar or user.avatar == 'default.png':
+        return jsonify({'error': 'Avatar not found'}), 404
+    
+    # Telegram-backed avatars are proxied, the download URL carries the bot token
+    avatar = user.avatar
+    if avatar.startswith(TELEGRAM_AVATAR_PREFIX) and telegram_storage:
+        return serve_telegram_file(avatar[len(TELEGRAM_AVATAR_PREFIX):])
+    if avatar.startswith('/wa/uploads/'):
+        return redirect(avatar)
+    if telegram_storage and avatar.startswith(f'{telegram_storage.api_base}/'):
+        # Stored as a download URL by older versions
+        try:
+            return stream_upstream_file(
+                lambda headers: telegram_storage.session.get(avatar, headers=headers, stream=True, timeout=(10, 30))
+            )
+        except requests.RequestException:
+            return jsonify({'error': 'Avatar temporarily unavailable'}), 502
+    return jsonify({'error': 'Avatar not found'}), 404
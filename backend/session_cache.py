@@ -0,0 +1,63 @@
+from sqlalchemy.orm import make_transient_to_detached
+from backend.models import User, db
+import os
+import threading
+import time
+
+class SessionCache:
+    """Short-TTL in-process cache of validated users for load_user.
+
+    Entries are column snapshots, re-attached to the request's session without
+    a query. Login, logout and forced logout invalidate explicitly; the TTL
+    bounds staleness on other workers of a multi-process deployment.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv('SESSION_CACHE_TTL', 5))
+        self.max_entries = int(os.getenv('SESSION_CACHE_SIZE', 100000))
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, session_id):
+        """Return an attached User if a fresh entry matches session_id, else None"""
+        if self.ttl <= 0 or not session_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic() or entry[1].get('session_id') != session_id:
+                self.misses += 1
+                return None
+            self.hits += 1
+            snapshot = entry[1]
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def put(self, user):
+        if self.ttl <= 0:
+            return
+        snapshot = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict_expired()
+            self._entries[user.id] = (time.monotonic() + self.ttl, snapshot)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for user_id in [uid for uid, entry in self._entries.items() if entry[0] < now]:
+            del self._entries[user_id]
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+# Global instance
+session_cache = SessionCache()
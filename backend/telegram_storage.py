@@ -1,5 +1,8 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import threading
+import time
 from typing import Optional, Tuple
 
 class TelegramStorage:
@@ -8,7 +11,25 @@ class TelegramStorage:
         self.chat_id = os.getenv('TELEGRAM_CHAT_ID')
         if not self.bot_token or not self.chat_id:
             raise ValueError("TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID must be set")
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        # Overridable so a local stand-in for the Bot API can be used
+        self.api_base = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+        self.base_url = f"{self.api_base}/bot{self.bot_token}"
+        
+        # Keep-alive connections shared by uploads, getFile and downloads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=int(os.getenv('TELEGRAM_POOL_CONNECTIONS', 4)),
+            pool_maxsize=int(os.getenv('TELEGRAM_POOL_SIZE', 16))
+        )
+        self.session.mount(self.api_base, adapter)
+        
+        # Download paths expire (Telegram guarantees at least an hour), cache them for less
+        self.file_url_ttl = float(os.getenv('TELEGRAM_FILE_URL_TTL', 3000))
+        self._file_urls = {}
+        self._lock = threading.Lock()
+        self.url_hits = 0
+        self.url_misses = 0
+        self.url_refreshes = 0
     
     def upload_file(self, file_path: str, file_type: str = 'photo') -> Optional[Tuple[str, str]]:
         """Upload file to Telegram and return (file_id, file_url)"""
@@ -19,21 +40,21 @@ class TelegramStorage:
         try:
             with open(file_path, 'rb') as file:
                 if file_type == 'photo':
-                    response = requests.post(
+                    response = self.session.post(
                         f"{self.base_url}/sendPhoto",
                         data={'chat_id': self.chat_id},
                         files={'photo': file},
                         timeout=30
                     )
                 elif file_type == 'video':
-                    response = requests.post(
+                    response = self.session.post(
                         f"{self.base_url}/sendVideo",
                         data={'chat_id': self.chat_id},
                         files={'video': file},
                         timeout=30
                     )
                 elif file_type == 'document':
-                    response = requests.post(
+                    response = self.session.post(
                         f"{self.base_url}/sendDocument",
                         data={'chat_id': self.chat_id},
                         files={'document': file},
@@ -61,20 +82,54 @@ class TelegramStorage:
             logging.error(f"Telegram upload error: {e}")
             return None
     
-    def get_file_url(self, file_id: str) -> Optional[str]:
-        """Get direct download URL for file_id"""
+    def get_file_url(self, file_id: str, refresh: bool = False) -> Optional[str]:
+        """Get direct download URL for file_id, cached until the path may have expired"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._file_urls.get(file_id)
+            if cached and cached[0] > now and not refresh:
+                self.url_hits += 1
+                return cached[1]
+            self.url_misses += 1
+            if refresh:
+                self.url_refreshes += 1
         try:
-            response = requests.get(f"{self.base_url}/getFile?file_id={file_id}", timeout=30)
+            response = self.session.get(f"{self.base_url}/getFile", params={'file_id': file_id}, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 if result['ok']:
                     file_path = result['result']['file_path']
-                    return f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
+                    file_url = f"{self.api_base}/file/bot{self.bot_token}/{file_path}"
+                    with self._lock:
+                        self._file_urls[file_id] = (now + self.file_url_ttl, file_url)
+                        if len(self._file_urls) > 100000:
+                            self._file_urls = {k: v for k, v in self._file_urls.items() if v[0] > now}
+                    return file_url
             return None
         except Exception as e:
             import logging
             logging.error(f"Telegram URL error: {e}")
             return None
+    
+    def open_file(self, file_id: str, headers: Optional[dict] = None) -> Optional[requests.Response]:
+        """Streamed download of file_id; an expired download path is re-resolved once"""
+        for refresh in (False, True):
+            file_url = self.get_file_url(file_id, refresh=refresh)
+            if not file_url:
+                return None
+            response = self.session.get(file_url, headers=headers, stream=True, timeout=(10, 30))
+            if response.status_code not in (400, 404) or refresh:
+                return response
+            response.close()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_urls': len(self._file_urls),
+                'url_hits': self.url_hits,
+                'url_misses': self.url_misses,
+                'url_refreshes': self.url_refreshes
+            }
 
 # Global instance - only create if credentials are available
 try:
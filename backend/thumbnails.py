@@ -0,0 +1,108 @@
+"""
+Thumbnail, poster frame and blur placeholder generation for uploaded media.
+
+Pillow is optional: without it no derivatives are made and clients fall back
+to the original files. Video poster frames additionally need an ffmpeg binary
+on the PATH.
+"""
+import base64
+import io
+import logging
+import os
+import shutil
+import subprocess
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+DERIVATIVE_DIR = os.path.join('uploads', 'thumbs')
+# Longest edge in pixels; small covers 48 px avatars on 2x screens, thumb a chat bubble
+THUMBNAIL_SIZES = {'small': 96, 'thumb': 320}
+PLACEHOLDER_EDGE = 16
+FFMPEG = shutil.which('ffmpeg')
+
+def available():
+    return Image is not None
+
+def derivative_path(key, size):
+    return os.path.join(DERIVATIVE_DIR, f'{key}_{size}.jpg')
+
+def generate(source_path, key, message_type='image'):
+    """Write the thumbnails for source_path; returns (sizes, placeholder data URI).
+
+    CPU-bound, call it through cpu_offload.run.
+    """
+    if Image is None:
+        return [], None
+    if message_type == 'video':
+        return _generate_video(source_path, key)
+    if message_type != 'image':
+        return [], None
+    try:
+        with Image.open(source_path) as image:
+            return _generate_from_image(image, key)
+    except Exception as e:
+        logging.error(f"Thumbnail generation failed for {source_path}: {e}")
+        return [], None
+
+def _generate_video(source_path, key):
+    if not FFMPEG:
+        return [], None
+    frame = derivative_path(key, 'frame')
+    os.makedirs(DERIVATIVE_DIR, exist_ok=True)
+    try:
+        subprocess.run(
+            [FFMPEG, '-y', '-loglevel', 'error', '-ss', '1', '-i', source_path, '-frames:v', '1', frame],
+            check=True, timeout=30, stdin=subprocess.DEVNULL
+        )
+        if not os.path.exists(frame):
+            # Shorter than a second, take the very first frame
+            subprocess.run(
+                [FFMPEG, '-y', '-loglevel', 'error', '-i', source_path, '-frames:v', '1', frame],
+                check=True, timeout=30, stdin=subprocess.DEVNULL
+            )
+        with Image.open(frame) as image:
+            return _generate_from_image(image, key)
+    except Exception as e:
+        logging.error(f"Poster frame extraction failed for {source_path}: {e}")
+        return [], None
+    finally:
+        remove_file(frame)
+
+def _generate_from_image(image, key):
+    os.makedirs(DERIVATIVE_DIR, exist_ok=True)
+    # Respect camera orientation and flatten transparency onto white for JPEG
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    else:
+        image = image.convert('RGB')
+
+    sizes = []
+    for size, edge in THUMBNAIL_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail((edge, edge))
+        thumbnail.save(derivative_path(key, size), 'JPEG', quality=80, optimize=True, progressive=True)
+        sizes.append(size)
+
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_EDGE, PLACEHOLDER_EDGE))
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'JPEG', quality=50)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+    return sizes, placeholder
+
+def remove_derivatives(key):
+    for size in THUMBNAIL_SIZES:
+        remove_file(derivative_path(key, size))
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,9 +1,39 @@
 // Global app utilities and socket connection
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
 class WhatsAppAPI {
     constructor() {
         this.baseURL = '/wa';
         this.socket = io({ path: '/wa/socket.io' });
         this.currentUser = null;
+        this.conversationTokens = new Map();
+        this.heartbeatTimer = null;
+        this.socket.on('connect', () => this.startHeartbeat());
+        this.socket.on('disconnect', () => this.stopHeartbeat());
+    }
+
+    startHeartbeat(interval = 30) {
+        // Presence heartbeat; the server answers with the interval it expects
+        this.stopHeartbeat();
+        this.heartbeatTimer = setInterval(() => {
+            this.socket.emit('heartbeat', {}, (ack) => {
+                if (ack && ack.interval && ack.interval !== interval) this.startHeartbeat(ack.interval);
+            });
+        }, interval * 1000);
+    }
+
+    stopHeartbeat() {
+        clearInterval(this.heartbeatTimer);
+        this.heartbeatTimer = null;
+    }
+
+    rememberTokens(users) {
+        // Contacts and search results carry per-user conversation tokens
+        if (!Array.isArray(users)) return users;
+        users.forEach(user => {
+            if (user && user.token) this.conversationTokens.set(user.id, user.token);
+        });
+        return users;
     }
 
     async request(endpoint, options = {}) {
@@ -72,13 +102,40 @@ class WhatsAppAPI {
     }
     
     startSessionMonitoring() {
-        // Check session validity every 30 seconds
-        setInterval(async () => {
-            const sessionCheck = await this.checkSession();
-            if (!sessionCheck.valid) {
-                this.handleForcedLogout();
+        if (this.sessionMonitoring) return;
+        this.sessionMonitoring = true;
+        
+        // The server pushes revocations over the socket
+        this.socket.on('session_revoked', () => this.handleForcedLogout());
+        
+        // Poll only while the socket is down, and re-check once it comes back
+        this.socket.on('disconnect', () => this.startSessionPolling());
+        this.socket.on('connect', () => {
+            if (this.sessionPollTimer) {
+                this.stopSessionPolling();
+                this.verifySession();
             }
-        }, 30000);
+        });
+        if (!this.socket.connected) {
+            this.startSessionPolling();
+        }
+    }
+    
+    startSessionPolling() {
+        if (this.sessionPollTimer) return;
+        this.sessionPollTimer = setInterval(() => this.verifySession(), 300000);
+    }
+    
+    stopSessionPolling() {
+        clearInterval(this.sessionPollTimer);
+        this.sessionPollTimer = null;
+    }
+    
+    async verifySession() {
+        const sessionCheck = await this.checkSession();
+        if (!sessionCheck.valid) {
+            this.handleForcedLogout();
+        }
     }
     
     handleForcedLogout() {
@@ -104,16 +161,42 @@ class WhatsAppAPI {
         return this.request('/api/auth/me');
     }
 
+    async bootstrap() {
+        // User, contacts with tokens, the latest messages of the top chats and a sync cursor
+        const data = await this.request('/api/bootstrap');
+        this.currentUser = data.user;
+        this.rememberTokens(data.contacts);
+        return data;
+    }
+
     // Message methods
     async sendMessage(receiverId, content) {
         const encryptedReceiverId = await this.encryptUserId(receiverId);
-        return this.request('/api/messages/send', {
-            method: 'POST',
-            body: JSON.stringify({ receiver_id: encryptedReceiverId, content })
+        if (!this.socket.connected) {
+            return this.request('/api/messages/send', {
+                method: 'POST',
+                body: JSON.stringify({ receiver_id: encryptedReceiverId, content })
+            });
+        }
+        
+        // Server persists, delivers to the receiver and acks with the stored message
+        return new Promise((resolve, reject) => {
+            const timeout = setTimeout(() => reject(new Error('Send timed out')), 10000);
+            this.socket.emit('send_message', { receiver_id: encryptedReceiverId, content }, (ack) => {
+                clearTimeout(timeout);
+                if (ack && ack.message) {
+                    resolve(ack.message);
+                } else {
+                    reject(new Error((ack && ack.error) || 'Send failed'));
+                }
+            });
         });
     }
 
     async sendMedia(receiverId, file, caption = '') {
+        if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+            return this.sendMediaResumable(receiverId, file, caption);
+        }
         const formData = new FormData();
         formData.append('file', file);
         formData.append('receiver_id', receiverId);
@@ -126,10 +209,49 @@ class WhatsAppAPI {
         });
     }
 
-    async getConversation(userId, page = 1) {
+    async sendMediaResumable(receiverId, file, caption = '') {
+        // Large files go up in chunks; a dropped connection resumes from the server's offset
+        const upload = await this.request('/api/messages/uploads', {
+            method: 'POST',
+            body: JSON.stringify({
+                receiver_id: receiverId,
+                filename: file.name,
+                size: file.size,
+                mime_type: file.type,
+                caption
+            })
+        });
+        let offset = upload.offset;
+        let failures = 0;
+        while (offset < file.size) {
+            try {
+                const response = await fetch(`${this.baseURL}/api/messages/uploads/${upload.upload_id}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file.slice(offset, offset + upload.chunk_size)
+                });
+                const result = await response.json();
+                // 409 means we were out of step, its body carries the server's offset
+                if (!response.ok && response.status !== 409) {
+                    throw new Error(result.error || 'Upload failed');
+                }
+                offset = result.offset;
+                failures = 0;
+            } catch (error) {
+                if (++failures > 5) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+                const status = await this.request(`/api/messages/uploads/${upload.upload_id}`).catch(() => null);
+                if (status) offset = status.offset;
+            }
+        }
+        return this.request(`/api/messages/uploads/${upload.upload_id}/complete`, { method: 'POST' });
+    }
+
+    async getConversation(userId, cursor = '') {
         // Encrypt user ID for API call
         const encryptedUserId = await this.encryptUserId(userId);
-        const response = await this.request(`/api/messages/conversation/${encryptedUserId}?page=${page}&limit=50`);
+        // Keyset pagination: an empty cursor loads the newest page
+        const response = await this.request(`/api/messages/conversation/${encryptedUserId}?limit=50&cursor=${encodeURIComponent(cursor || '')}`);
         // Decrypt API response
         if (response.encrypted_data) {
             const decrypted = await this.decryptResponse(response.encrypted_data);
@@ -138,7 +260,22 @@ class WhatsAppAPI {
         return response;
     }
 
+    markMessagesRead(peerId, upToId) {
+        // Batch receipt over the socket, REST fallback when it is down
+        const payload = { status: 'read', peer_id: peerId, up_to_id: upToId };
+        if (this.socket.connected) {
+            this.socket.emit('message_receipts', payload);
+            return Promise.resolve();
+        }
+        return this.request('/api/messages/mark-read', {
+            method: 'POST',
+            body: JSON.stringify({ peer_id: peerId, up_to_id: upToId })
+        });
+    }
+
     async encryptUserId(userId) {
+        const cached = this.conversationTokens.get(userId);
+        if (cached) return cached;
         try {
             const response = await fetch(`${this.baseURL}/api/messages/encrypt-id`, {
                 method: 'POST',
@@ -151,6 +288,7 @@ class WhatsAppAPI {
             }
             
             const result = await response.json();
+            if (result.encrypted_id) this.conversationTokens.set(userId, result.encrypted_id);
             return result.encrypted_id || userId;
         } catch (error) {
             console.error('ID encryption failed:', error);
@@ -175,7 +313,19 @@ class WhatsAppAPI {
     }
 
     async getContacts() {
-        return this.request('/api/messages/contacts');
+        return this.rememberTokens(await this.request('/api/messages/contacts'));
+    }
+
+    async sync(since = '') {
+        // Changes since a sync cursor; without one, just the current cursor
+        const response = await this.request(`/api/messages/sync?since=${encodeURIComponent(since || '')}`);
+        if (response.encrypted_data) {
+            const changes = await this.decryptResponse(response.encrypted_data);
+            if (!changes) throw new Error('Sync decryption failed');
+            this.rememberTokens(changes.contacts);
+            return changes;
+        }
+        return response;
     }
 
     // Call methods
@@ -198,17 +348,20 @@ class WhatsAppAPI {
         return this.request(`/api/calls/${callId}/reject`, { method: 'POST' });
     }
 
-    async getCallHistory() {
-        return this.request('/api/calls/history');
+    async getCallHistory(cursor = '') {
+        // Keyset pagination: an empty cursor loads the newest page
+        return this.request(`/api/calls/history?limit=50&cursor=${encodeURIComponent(cursor || '')}`);
     }
 
     // User methods
     async searchUsers(query) {
-        return this.request(`/api/users/search?q=${encodeURIComponent(query)}`);
+        return this.rememberTokens(await this.request(`/api/users/search?q=${encodeURIComponent(query)}`));
     }
 
     async getUserByPhone(phone) {
-        return this.request(`/api/users/by-phone/${phone}`);
+        const user = await this.request(`/api/users/by-phone/${phone}`);
+        this.rememberTokens([user]);
+        return user;
     }
 
     async updateProfile(data) {
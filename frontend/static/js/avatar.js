@@ -35,4 +35,10 @@ function setAvatar(element, name, size = 40, customAvatar = null) {
             element.src = generateAvatar(name, size);
         }
     }
-}
\ No newline at end of file
+}
+
+// Small server-side thumbnail for a user's uploaded avatar
+function avatarThumbnailUrl(user) {
+    if (!user.avatar || user.avatar === 'default.png') return user.avatar;
+    return `/wa/api/users/${user.id}/avatar?size=small`;
+}
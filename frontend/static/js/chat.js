@@ -26,10 +26,15 @@ class ChatApp {
         }
 
         try {
-            this.currentUser = await api.getCurrentUser();
+            // One round trip for first paint instead of /me, /contacts and the first conversation
+            const boot = await api.bootstrap();
+            this.currentUser = boot.user;
+            this.syncCursor = boot.sync_cursor;
+            this.contacts = boot.contacts;
+            this.preloaded = new Map(boot.conversations.map(c => [c.contact_id, c]));
             this.setupEventListeners();
             this.setupSocketListeners();
-            await this.loadContacts();
+            this.renderContacts();
             this.updateUserInfo();
             
             // Join user room for calls immediately
@@ -185,11 +190,28 @@ class ChatApp {
         });
         
         api.socket.on('message_status_update', (data) => {
-            this.updateMessageStatus(data.message_id, data.status);
+            this.updateMessageStatus(data.message_ids || [data.message_id], data.status);
+        });
+        
+        api.socket.on('message_deleted', (data) => {
+            const before = this.messages.length;
+            this.messages = this.messages.filter(m => m.id !== data.message_id);
+            if (this.messages.length !== before) this.renderMessages();
+        });
+        
+        api.socket.on('media_status', (data) => {
+            // Background upload or thumbnail step finished; carries freshly signed media URLs
+            const message = this.messages.find(m => m.id === data.message_id);
+            if (!message) return;
+            const gotThumbnails = data.thumbnails && !message.thumbnails;
+            Object.assign(message, data);
+            if (gotThumbnails) this.renderMessages();
         });
         
         api.socket.on('connect', () => {
             console.log('Socket connected');
+            // Reconnected: fetch only what changed while the socket was down
+            if (this.syncCursor) this.catchUp();
         });
         
         api.socket.on('disconnect', () => {
@@ -210,6 +232,78 @@ class ChatApp {
         });
     }
 
+    async catchUp() {
+        if (this.catchingUp) return;
+        this.catchingUp = true;
+        try {
+            let cursor = this.syncCursor;
+            let hasMore = true;
+            while (hasMore) {
+                const changes = await api.sync(cursor);
+                this.applyChanges(changes);
+                cursor = changes.cursor;
+                hasMore = changes.has_more;
+            }
+            this.syncCursor = cursor;
+        } catch (error) {
+            // Expired cursor or failed sync: fall back to a full reload
+            console.error('Sync failed, reloading:', error);
+            this.syncCursor = (await api.sync()).cursor;
+            await this.loadContacts();
+            if (this.selectedContact) await this.loadConversation(this.selectedContact.id);
+        } finally {
+            this.catchingUp = false;
+        }
+    }
+
+    applyChanges(changes) {
+        // Preloaded pages may be stale now; those chats load fresh when opened
+        if (this.preloaded) this.preloaded.clear();
+        (changes.contacts || []).forEach(contact => {
+            const index = this.contacts.findIndex(c => c.id === contact.id);
+            if (index >= 0) {
+                this.contacts[index] = contact;
+            } else {
+                this.contacts.push(contact);
+            }
+        });
+        if (changes.contacts && changes.contacts.length) {
+            const lastAt = c => (c.last_message && c.last_message.timestamp) || '';
+            this.contacts.sort((a, b) => lastAt(b).localeCompare(lastAt(a)));
+            this.renderContacts();
+        }
+
+        let changed = false;
+        const deleted = new Set(changes.deleted_message_ids || []);
+        if (deleted.size) {
+            const before = this.messages.length;
+            this.messages = this.messages.filter(m => !deleted.has(m.id));
+            changed = this.messages.length !== before;
+        }
+        const contactId = this.selectedContact && this.selectedContact.id;
+        (changes.messages || []).forEach(message => {
+            if (message.sender_id !== contactId && message.receiver_id !== contactId) return;
+            const existing = this.messages.find(m => m.id === message.id);
+            if (existing) {
+                Object.assign(existing, message);
+            } else {
+                this.messages.push(message);
+            }
+            changed = true;
+        });
+        (changes.receipts || []).forEach(receipt => {
+            const message = this.messages.find(m => m.id === receipt.id);
+            if (!message) return;
+            message.is_delivered = receipt.is_delivered;
+            message.is_read = receipt.is_read;
+            changed = true;
+        });
+        if (changed) {
+            this.messages.sort((a, b) => a.id - b.id);
+            this.renderMessages();
+        }
+    }
+
     updateUserInfo() {
         document.getElementById('userName').textContent = this.currentUser.name;
         setAvatar(document.getElementById('userAvatar'), this.currentUser.name, 40, this.currentUser.avatar);
@@ -233,10 +327,13 @@ class ChatApp {
             const contactElement = document.createElement('div');
             contactElement.className = 'contact-item flex items-center p-3 hover:bg-gray-100 cursor-pointer';
             contactElement.dataset.userId = contact.id;
+            if (this.selectedContact && this.selectedContact.id === contact.id) {
+                contactElement.classList.add('active');
+            }
             
             const avatarImg = document.createElement('img');
             avatarImg.className = 'w-12 h-12 rounded-full';
-            setAvatar(avatarImg, contact.name, 48, contact.avatar);
+            setAvatar(avatarImg, contact.name, 48, avatarThumbnailUrl(contact));
             
             const avatarContainer = document.createElement('div');
             avatarContainer.className = 'relative';
@@ -261,6 +358,13 @@ class ChatApp {
             infoContainer.appendChild(nameDiv);
             infoContainer.appendChild(phoneDiv);
             
+            if (contact.last_message && contact.last_message.preview) {
+                const previewDiv = document.createElement('div');
+                previewDiv.className = 'contact-preview text-xs text-gray-400 truncate';
+                previewDiv.textContent = contact.last_message.preview;
+                infoContainer.appendChild(previewDiv);
+            }
+            
             const rightContainer = document.createElement('div');
             rightContainer.className = 'flex flex-col items-end';
             
@@ -330,7 +434,7 @@ class ChatApp {
         // Update chat header
         document.getElementById('chatName').textContent = contact.name;
         document.getElementById('chatStatus').textContent = contact.is_online ? 'Online' : `Last seen ${formatTime(contact.last_seen)}`;
-        setAvatar(document.getElementById('chatAvatar'), contact.name, 40, contact.avatar);
+        setAvatar(document.getElementById('chatAvatar'), contact.name, 40, avatarThumbnailUrl(contact));
         
         // Load conversation
         await this.loadConversation(contact.id);
@@ -339,6 +443,8 @@ class ChatApp {
         
         // Mark unread messages as read
         this.markUnreadMessagesAsRead();
+        this.clearUnreadMessages(contact.id);
+        this.renderContacts();
         
         // Join socket room for real-time messaging
         const chatRoom = `chat_${Math.min(this.currentUser.id, contact.id)}_${Math.max(this.currentUser.id, contact.id)}`;
@@ -356,13 +462,17 @@ class ChatApp {
 
     async loadConversation(userId) {
         try {
-            this.currentPage = 1;
+            this.nextCursor = null;
             this.hasMoreMessages = true;
-            const response = await api.getConversation(userId, 1);
+            // Bootstrapped chats open without a request; used once, later opens refetch
+            const preloaded = this.preloaded && this.preloaded.get(userId);
+            if (preloaded) this.preloaded.delete(userId);
+            const response = preloaded || await api.getConversation(userId);
             
             if (response.messages) {
                 this.messages = response.messages;
                 this.hasMoreMessages = response.has_more;
+                this.nextCursor = response.next_cursor;
             } else {
                 this.messages = response;
             }
@@ -453,14 +563,25 @@ class ChatApp {
                 content += statusDiv.outerHTML;
             }
         } else if (message.message_type === 'image') {
-            const secureUrl = `/wa/api/messages/media/${message.secure_file_id || message.id}`;
+            const secureUrl = message.media_url || `/wa/api/messages/media/${message.secure_file_id || message.id}`;
             const mediaDiv = document.createElement('div');
             mediaDiv.className = 'media-message';
+            // Bubble-sized thumbnail over a blurred placeholder; the link opens the original
+            const hasThumb = (message.thumbnails || []).includes('thumb');
+            const link = document.createElement('a');
+            link.href = secureUrl;
+            link.target = '_blank';
             const img = document.createElement('img');
-            img.src = secureUrl;
+            img.src = hasThumb ? (message.thumbnail_url || `/wa/api/messages/media/${message.id}?size=thumb`) : secureUrl;
             img.alt = 'Image';
             img.className = 'rounded max-w-xs';
-            mediaDiv.appendChild(img);
+            img.loading = 'lazy';
+            if (message.placeholder) {
+                img.style.backgroundImage = `url(${message.placeholder})`;
+                img.style.backgroundSize = 'cover';
+            }
+            link.appendChild(img);
+            mediaDiv.appendChild(link);
             if (message.content && !message.content.startsWith('Sent a')) {
                 const captionDiv = document.createElement('div');
                 captionDiv.className = 'mt-2 text-sm';
@@ -469,13 +590,16 @@ class ChatApp {
             }
             content = mediaDiv.outerHTML;
         } else if (message.message_type === 'video') {
-            const secureUrl = `/wa/api/messages/media/${message.secure_file_id || message.id}`;
+            const secureUrl = message.media_url || `/wa/api/messages/media/${message.secure_file_id || message.id}`;
             const mediaDiv = document.createElement('div');
             mediaDiv.className = 'media-message';
             const video = document.createElement('video');
             video.controls = true;
             video.className = 'rounded max-w-xs';
             video.preload = 'none';
+            if ((message.thumbnails || []).includes('thumb')) {
+                video.poster = message.thumbnail_url || `/wa/api/messages/media/${message.id}?size=thumb`;
+            }
             const source = document.createElement('source');
             source.src = secureUrl;
             source.type = 'video/mp4';
@@ -489,7 +613,7 @@ class ChatApp {
             }
             content = mediaDiv.outerHTML;
         } else if (message.message_type === 'audio') {
-            const secureUrl = `/wa/api/messages/media/${message.secure_file_id || message.id}`;
+            const secureUrl = message.media_url || `/wa/api/messages/media/${message.secure_file_id || message.id}`;
             const audioDiv = document.createElement('div');
             audioDiv.className = 'audio-message';
             
@@ -544,12 +668,9 @@ class ChatApp {
             const message = await api.sendMessage(this.selectedContact.id, content);
             
             // Add to local messages immediately for instant feedback
-            const localMessage = {
-                ...message,
-                sender_id: this.currentUser.id,
-                message_type: 'text'
-            };
-            this.messages.push(localMessage);
+            if (!this.messages.find(m => m.id === message.id)) {
+                this.messages.push(message);
+            }
             this.renderMessages();
             this.scrollToBottom();
             
@@ -557,29 +678,6 @@ class ChatApp {
             this.moveContactToTop(this.selectedContact.id);
             this.renderContacts();
             
-            // Join conversation room to receive delivery confirmations
-            const roomId = `chat_${Math.min(this.currentUser.id, this.selectedContact.id)}_${Math.max(this.currentUser.id, this.selectedContact.id)}`;
-            api.socket.emit('join_room', { room: roomId });
-            
-            // Emit to socket for real-time delivery
-            const messageData = {
-                room: roomId,
-                message: {
-                    ...message,
-                    sender_id: this.currentUser.id,
-                    message_type: 'text'
-                },
-                sender: this.currentUser
-            };
-            
-            api.socket.emit('send_message', messageData);
-            
-            // Also emit to receiver's room
-            api.socket.emit('send_message', {
-                room: `user_${this.selectedContact.id}`,
-                ...messageData
-            });
-            
             messageText.value = '';
         } catch (error) {
             console.error('Failed to send message:', error);
@@ -638,16 +736,7 @@ class ChatApp {
             this.renderMessages();
             this.scrollToBottom();
             
-            // Join conversation room to receive delivery confirmations
-            const roomId = `chat_${Math.min(this.currentUser.id, this.selectedContact.id)}_${Math.max(this.currentUser.id, this.selectedContact.id)}`;
-            api.socket.emit('join_room', { room: roomId });
-            
-            api.socket.emit('send_message', {
-                room: roomId,
-                message: message,
-                sender: this.currentUser
-            });
-            
+            // The server delivers the message to the receiver
             this.hideMediaCaption();
             
         } catch (error) {
@@ -658,6 +747,12 @@ class ChatApp {
     handleIncomingMessage(data) {
         console.log('Incoming message:', data);
         
+        // A preloaded page of this chat no longer ends at the newest message
+        if (this.preloaded) {
+            const peerId = data.message.sender_id === this.currentUser.id ? data.message.receiver_id : data.message.sender_id;
+            this.preloaded.delete(peerId);
+        }
+        
         // Mark message as delivered if it's for current user
         if (data.message.receiver_id === this.currentUser.id) {
             api.socket.emit('message_delivered', { message_id: data.message.id });
@@ -971,7 +1066,7 @@ class ChatApp {
                 userDiv.className = 'flex items-center p-2 hover:bg-gray-100 cursor-pointer rounded';
                 const userAvatar = document.createElement('img');
                 userAvatar.className = 'w-8 h-8 rounded-full mr-3';
-                setAvatar(userAvatar, user.name, 32, user.avatar);
+                setAvatar(userAvatar, user.name, 32, avatarThumbnailUrl(user));
                 
                 const userInfo = document.createElement('div');
                 
@@ -1029,22 +1124,31 @@ class ChatApp {
         return div.innerHTML;
     }
     
-    updateMessageStatus(messageId, status) {
-        const message = this.messages.find(m => m.id === messageId);
-        if (message) {
+    updateMessageStatus(messageIds, status) {
+        const ids = new Set(messageIds);
+        let changed = false;
+        this.messages.forEach(message => {
+            if (!ids.has(message.id)) return;
             if (status === 'delivered') {
                 message.is_delivered = true;
             } else if (status === 'read') {
                 message.is_delivered = true;
                 message.is_read = true;
             }
+            changed = true;
+        });
+        if (changed) {
             this.renderMessages();
         }
     }
     
     getUnreadCount(contactId) {
         if (!this.unreadMessages) this.unreadMessages = {};
-        return this.unreadMessages[contactId] ? this.unreadMessages[contactId].length : 0;
+        const localCount = this.unreadMessages[contactId] ? this.unreadMessages[contactId].length : 0;
+        // Server-side counter from the conversation summary
+        const contact = this.contacts.find(c => c.id === contactId);
+        const serverCount = contact && contact.unread_count ? contact.unread_count : 0;
+        return Math.max(localCount, serverCount);
     }
     
     addUnreadMessage(senderId, message) {
@@ -1057,6 +1161,10 @@ class ChatApp {
         if (this.unreadMessages && this.unreadMessages[contactId]) {
             delete this.unreadMessages[contactId];
         }
+        const contact = this.contacts.find(c => c.id === contactId);
+        if (contact) {
+            contact.unread_count = 0;
+        }
     }
     
     moveContactToTop(contactId) {
@@ -1117,13 +1225,13 @@ class ChatApp {
         const scrollHeight = messagesList.scrollHeight;
         
         try {
-            const nextPage = this.currentPage + 1;
-            const response = await api.getConversation(this.selectedContact.id, nextPage);
+            const response = await api.getConversation(this.selectedContact.id, this.nextCursor);
             
             let olderMessages = [];
             if (response.messages) {
                 olderMessages = response.messages;
                 this.hasMoreMessages = response.has_more;
+                this.nextCursor = response.next_cursor;
             } else {
                 olderMessages = response;
                 this.hasMoreMessages = olderMessages.length === 50;
@@ -1131,7 +1239,6 @@ class ChatApp {
             
             if (olderMessages.length > 0) {
                 this.messages = [...olderMessages, ...this.messages];
-                this.currentPage = nextPage;
                 this.renderMessages();
                 
                 // Maintain scroll position
@@ -1165,14 +1272,16 @@ class ChatApp {
             !msg.is_read
         );
         
+        if (unreadMessages.length === 0) return;
+        
+        // One batch receipt covering everything up to the newest unread message
+        const upToId = Math.max(...unreadMessages.map(msg => msg.id));
+        api.markMessagesRead(this.selectedContact.id, upToId);
         unreadMessages.forEach(msg => {
-            api.socket.emit('message_read', { message_id: msg.id });
             msg.is_read = true;
         });
         
-        if (unreadMessages.length > 0) {
-            this.renderMessages();
-        }
+        this.renderMessages();
     }
     
     showErrorMessage(message) {
@@ -1211,22 +1320,36 @@ class ChatApp {
         if (mainChatArea) mainChatArea.classList.remove('hidden');
     }
     
-    async loadCallHistory() {
+    async loadCallHistory(cursor = '') {
         try {
-            const calls = await api.getCallHistory();
-            this.renderCallHistory(calls);
+            const page = await api.getCallHistory(cursor);
+            this.renderCallHistory(page.calls, Boolean(cursor));
+            this.renderCallHistoryMore(page.next_cursor);
         } catch (error) {
             console.error('Failed to load call history:', error);
         }
     }
     
+    renderCallHistoryMore(nextCursor) {
+        const historyList = document.getElementById('callHistoryList');
+        if (!historyList) return;
+        historyList.querySelector('.call-history-more')?.remove();
+        if (!nextCursor) return;
+        const moreBtn = document.createElement('button');
+        moreBtn.className = 'call-history-more w-full p-3 text-sm';
+        moreBtn.style.color = 'var(--green-primary)';
+        moreBtn.textContent = 'Load older calls';
+        moreBtn.onclick = () => this.loadCallHistory(nextCursor);
+        historyList.appendChild(moreBtn);
+    }
+    
 
     
-    renderCallHistory(calls) {
+    renderCallHistory(calls, append = false) {
         const historyList = document.getElementById('callHistoryList');
         if (!historyList) return;
         
-        historyList.innerHTML = '';
+        if (!append) historyList.innerHTML = '';
         
         calls.forEach(call => {
             const callDiv = document.createElement('div');
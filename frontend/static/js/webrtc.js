@@ -24,6 +24,7 @@ class WebRTCManager {
         this.socket.on('webrtc_offer', (data) => this.handleOffer(data));
         this.socket.on('webrtc_answer', (data) => this.handleAnswer(data));
         this.socket.on('webrtc_ice', (data) => this.handleIceCandidate(data));
+        this.socket.on('webrtc_ice_batch', (data) => this.handleIceBatch(data));
         this.socket.on('call_signal', (data) => this.handleCallSignal(data));
     }
 
@@ -204,12 +205,7 @@ class WebRTCManager {
 
         // Handle ICE candidates
         peerConnection.onicecandidate = (event) => {
-            if (event.candidate) {
-                this.socket.emit('webrtc_ice', {
-                    candidate: event.candidate,
-                    room: `call_${callId}`
-                });
-            }
+            this.queueIceCandidate(callId, `call_${callId}`, event.candidate);
         };
 
         // Create and send offer
@@ -246,12 +242,7 @@ class WebRTCManager {
 
         // Handle ICE candidates
         peerConnection.onicecandidate = (event) => {
-            if (event.candidate) {
-                this.socket.emit('webrtc_ice', {
-                    candidate: event.candidate,
-                    room: data.room
-                });
-            }
+            this.queueIceCandidate(this.currentCallId, data.room, event.candidate);
         };
 
         // Set remote description and create answer
@@ -279,6 +270,55 @@ class WebRTCManager {
         }
     }
 
+    queueIceCandidate(callId, room, candidate) {
+        // Trickle ICE in small batches; a null candidate means gathering finished
+        if (!this.iceBatch) {
+            this.iceBatch = { callId, room, candidates: [] };
+        }
+        if (!candidate) {
+            this.flushIceCandidates(true);
+            return;
+        }
+        this.iceBatch.candidates.push(candidate);
+        if (!this.iceBatchTimer) {
+            this.iceBatchTimer = setTimeout(() => this.flushIceCandidates(false), 50);
+        }
+    }
+
+    flushIceCandidates(done) {
+        clearTimeout(this.iceBatchTimer);
+        this.iceBatchTimer = null;
+        const batch = this.iceBatch;
+        this.iceBatch = null;
+        if (!batch || (!batch.candidates.length && !done)) return;
+        this.socket.emit('webrtc_ice_batch', {
+            call_id: batch.callId,
+            room: batch.room,
+            candidates: batch.candidates,
+            done: done
+        });
+    }
+
+    async handleIceBatch(data) {
+        const peerConnection = this.peers[this.currentCallId];
+        if (!peerConnection) return;
+        for (const candidate of data.candidates || []) {
+            try {
+                await peerConnection.addIceCandidate(candidate);
+            } catch (error) {
+                console.error('Failed to add ICE candidate:', error);
+            }
+        }
+        if (data.done) {
+            try {
+                // End-of-candidates; browsers without support simply reject it
+                await peerConnection.addIceCandidate();
+            } catch (error) {
+                console.warn('End-of-candidates not supported:', error);
+            }
+        }
+    }
+
     toggleAudio() {
         this.isAudioMuted = !this.isAudioMuted;
         if (this.localStream) {
@@ -362,6 +402,9 @@ class WebRTCManager {
             peer.close();
         });
         this.peers = {};
+        clearTimeout(this.iceBatchTimer);
+        this.iceBatchTimer = null;
+        this.iceBatch = null;
 
         // Clear video elements
         const localVideo = document.getElementById('local-video');
@@ -584,6 +627,14 @@ class WebRTCManager {
                 this.hideIncomingCallPopup();
                 this.cleanup();
                 break;
+            case 'call_missed':
+                // Nobody answered before the server's ring timeout
+                if (data.call_id == this.currentCallId) {
+                    this.hideIncomingCallPopup();
+                    this.cleanup();
+                    this.hideCallScreen();
+                }
+                break;
         }
     }
 
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+WhatsApp Clone Migration Script
+Brings an existing database (SQLite or MySQL) up to the current models:
+adds missing columns, backfills derived data in batches and creates indexes.
+Run it once before starting a new version of the app.
+"""
+
+import logging
+import os
+import sys
+from flask import Flask
+from sqlalchemy import inspect, text
+from backend.models import db, Message, Conversation, ChangeLog, conversation_key_for
+from backend.messaging import message_preview
+from backend.call_stats import record_finished_calls
+from backend.encryption import message_encryption
+from dotenv import load_dotenv
+
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', 5000))
+
+def add_missing_columns():
+    """Add model columns that older databases don't have yet"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            print(f"Adding column {table.name}.{column.name} ({column_type})")
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column.default is not None and column.default.is_scalar:
+                    connection.execute(
+                        text(f'UPDATE {table.name} SET {column.name} = :value'),
+                        {'value': column.default.arg}
+                    )
+
+def rebuild_sqlite_change_log():
+    """Recreate an SQLite change_log created without AUTOINCREMENT, keeping its rows.
+
+    Without it SQLite hands out ids from max(id) + 1, so once pruning empties
+    the log new entries reuse ids that outstanding sync cursors point past.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    table = ChangeLog.__table__
+    with db.engine.begin() as connection:
+        sql = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+        ).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return
+        print(f"Rebuilding {table.name} with AUTOINCREMENT")
+        connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+        for index in table.indexes:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        table.create(bind=connection)
+        columns = ', '.join(column.name for column in table.columns)
+        connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old'))
+        connection.execute(text(f'DROP TABLE {table.name}_old'))
+
+def create_missing_indexes():
+    """Create model indexes that don't exist in the database yet"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name} on {table.name}")
+                index.create(bind=db.engine)
+
+def backfill_conversation_keys():
+    """Assign conversation_key and per-conversation seq to existing messages"""
+    next_seq = {}
+    last_id = 0
+    updated = 0
+
+    while True:
+        rows = db.session.execute(
+            db.select(Message.id, Message.sender_id, Message.receiver_id)
+            .where((Message.id > last_id) & (Message.conversation_key.is_(None)))
+            .order_by(Message.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        params = []
+        for message_id, sender_id, receiver_id in rows:
+            key = conversation_key_for(sender_id, receiver_id)
+            if key not in next_seq:
+                # Continue after any rows that already have a seq
+                last_seq = db.session.execute(
+                    db.select(db.func.max(Message.seq)).where(Message.conversation_key == key)
+                ).scalar()
+                next_seq[key] = (last_seq or 0) + 1
+            params.append({'id': message_id, 'conversation_key': key, 'seq': next_seq[key]})
+            next_seq[key] += 1
+
+        db.session.execute(
+            text('UPDATE messages SET conversation_key = :conversation_key, seq = :seq WHERE id = :id'),
+            params
+        )
+        db.session.commit()
+
+        last_id = rows[-1][0]
+        updated += len(rows)
+        print(f"Backfilled {updated} messages (up to id {last_id})")
+
+def backfill_conversations():
+    """Build conversation summaries for conversations that don't have one yet"""
+    last_key = ''
+    created = 0
+
+    while True:
+        groups = db.session.execute(
+            db.select(Message.conversation_key, db.func.max(Message.id), db.func.max(Message.seq))
+            .where(Message.conversation_key > last_key)
+            .group_by(Message.conversation_key)
+            .order_by(Message.conversation_key)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not groups:
+            break
+
+        keys = [key for key, _, _ in groups]
+        last_seqs = {key: last_seq or 0 for key, _, last_seq in groups}
+        existing = set(db.session.execute(
+            db.select(Conversation.conversation_key).where(Conversation.conversation_key.in_(keys))
+        ).scalars())
+        last_ids = [last_id for key, last_id, _ in groups if key not in existing]
+
+        unread = {}
+        for key, receiver_id, count in db.session.execute(
+            db.select(Message.conversation_key, Message.receiver_id, db.func.count(Message.id))
+            .where(Message.conversation_key.in_(keys))
+            .where(db.or_(Message.is_read == False, Message.is_read.is_(None)))
+            .group_by(Message.conversation_key, Message.receiver_id)
+        ).all():
+            unread[(key, receiver_id)] = count
+
+        for message in Message.query.filter(Message.id.in_(last_ids)).all():
+            low, high = sorted((message.sender_id, message.receiver_id))
+            content = message.content
+            if message.message_type == 'text':
+                content = message_encryption.decrypt_message(content)
+            db.session.add(Conversation(
+                conversation_key=message.conversation_key,
+                user_low_id=low,
+                user_high_id=high,
+                last_message_id=message.id,
+                last_message_at=message.timestamp,
+                last_message_type=message.message_type,
+                last_message_preview=message_preview(message.message_type, content),
+                last_sender_id=message.sender_id,
+                unread_low=unread.get((message.conversation_key, low), 0),
+                unread_high=unread.get((message.conversation_key, high), 0),
+                last_seq=last_seqs[message.conversation_key]
+            ))
+        db.session.commit()
+
+        last_key = keys[-1]
+        created += len(last_ids)
+        print(f"Created {created} conversation summaries")
+
+def backfill_conversation_seq():
+    """Start the seq counter of summaries created before it existed after their last message"""
+    last_id = 0
+    updated = 0
+    table = Conversation.__table__
+    messages = Message.__table__
+    last_seq = db.select(db.func.coalesce(db.func.max(messages.c.seq), 0)).where(
+        messages.c.conversation_key == table.c.conversation_key
+    ).scalar_subquery()
+
+    while True:
+        ids = db.session.execute(
+            db.select(table.c.id).where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(
+            table.update().where(table.c.id.in_(ids), table.c.last_seq < last_seq).values(last_seq=last_seq)
+        )
+        db.session.commit()
+        last_id = ids[-1]
+        updated += len(ids)
+        print(f"Checked seq counters of {updated} conversations")
+
+def backfill_call_stats():
+    """Fold finished calls that predate the per-contact aggregate into it"""
+    counted = 0
+    while True:
+        batch = record_finished_calls()
+        if not batch:
+            break
+        db.session.commit()
+        counted += batch
+        print(f"Counted {counted} calls into call stats")
+
+def run_migrations():
+    """Run all migration steps against the configured database"""
+
+    # Load environment variables
+    load_dotenv()
+
+    # Create Flask app
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///whatsapp.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # Initialize database
+    db.init_app(app)
+
+    with app.app_context():
+        try:
+            print("Creating new tables...")
+            db.create_all()
+
+            print("Adding missing columns...")
+            add_missing_columns()
+
+            print("Checking change log ids...")
+            rebuild_sqlite_change_log()
+
+            # Backfill before indexing so the unique seq index is built once
+            print("Backfilling conversation keys...")
+            backfill_conversation_keys()
+
+            print("Creating missing indexes...")
+            create_missing_indexes()
+
+            print("Backfilling conversation summaries...")
+            backfill_conversations()
+
+            print("Backfilling conversation seq counters...")
+            backfill_conversation_seq()
+
+            print("Backfilling call stats...")
+            backfill_call_stats()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Migration failed: {e}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    print("WhatsApp Clone Migration")
+    print("========================")
+
+    run_migrations()
+
+    print("\nMigration completed successfully!")
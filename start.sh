@@ -28,6 +28,10 @@ pip install -r requirements.txt
 echo "🗄️ Setting up database..."
 python setup.py
 
+# Apply schema migrations
+echo "🔧 Applying migrations..."
+python migrate.py
+
 # Start application in background
 echo "🌐 Starting application in background..."
 nohup python app.py > $LOG_FILE 2>&1 &
@@ -0,0 +1,61 @@
+#!/bin/bash
+
+# Runs several Socket.IO workers on one box, sharing rooms through the local broker.
+# Put a sticky-session load balancer in front of them (see nginx.conf.example).
+
+PID_FILE="whatsapp_cluster.pid"
+WORKERS=${WORKERS:-$(nproc)}
+BASE_PORT=${BASE_PORT:-5001}
+BROKER_SOCKET=${BROKER_SOCKET:-/tmp/whatsapp-broker.sock}
+
+echo "🚀 Starting WhatsApp Clone Cluster ($WORKERS workers)"
+echo "=================================================="
+
+if [ -f "$PID_FILE" ]; then
+    echo "❌ Cluster PID file exists. Use ./stop.sh to stop it first"
+    exit 1
+fi
+
+# Optional virtualenv, e.g. VENV=./venv ./start_cluster.sh
+if [ -n "$VENV" ]; then
+    source "$VENV/bin/activate"
+fi
+
+# The app reads .env itself; the broker choice below has to see it too (the shell still wins)
+if [ -z "${SOCKETIO_MESSAGE_QUEUE+x}" ] && [ -f .env ]; then
+    SOCKETIO_MESSAGE_QUEUE=$(grep -E '^SOCKETIO_MESSAGE_QUEUE=' .env | tail -n 1 | cut -d= -f2- | tr -d "\"'")
+fi
+
+# Install dependencies
+echo "📦 Installing dependencies..."
+pip install -r requirements.txt
+
+# Setup database
+echo "🗄️ Setting up database..."
+python setup.py
+
+# Apply schema migrations
+echo "🔧 Applying migrations..."
+python migrate.py
+
+# Start the local broker unless an external queue (redis://, amqp://, ...) is configured
+if [ -z "$SOCKETIO_MESSAGE_QUEUE" ]; then
+    echo "📮 Starting local message broker on $BROKER_SOCKET..."
+    nohup python -m backend.broker "$BROKER_SOCKET" > whatsapp_broker.log 2>&1 &
+    echo $! >> $PID_FILE
+    export SOCKETIO_MESSAGE_QUEUE="unix://$BROKER_SOCKET"
+    sleep 1
+fi
+
+# One eventlet worker per process: Flask-SocketIO needs sticky sessions per process
+for i in $(seq 0 $((WORKERS - 1))); do
+    PORT=$((BASE_PORT + i))
+    echo "🌐 Starting worker on port $PORT..."
+    nohup gunicorn -k eventlet -w 1 -b 127.0.0.1:$PORT app:app > whatsapp_$PORT.log 2>&1 &
+    echo $! >> $PID_FILE
+done
+
+echo "✅ Cluster started successfully!"
+echo "📋 PIDs: $(tr '\n' ' ' < $PID_FILE)"
+echo "🌐 Workers: 127.0.0.1:$BASE_PORT-$((BASE_PORT + WORKERS - 1))"
+echo "🛑 Stop with: ./stop.sh"
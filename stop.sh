@@ -6,6 +6,15 @@ LOG_FILE="whatsapp.log"
 echo "🛑 Stopping WhatsApp Clone"
 echo "=========================="
 
+# Cluster mode: stop the broker and every worker started by start_cluster.sh
+if [ -f "whatsapp_cluster.pid" ]; then
+    echo "🔄 Stopping cluster processes..."
+    kill $(cat whatsapp_cluster.pid) 2>/dev/null
+    rm -f whatsapp_cluster.pid
+    echo "✅ Cluster stopped successfully!"
+    exit 0
+fi
+
 if [ ! -f "$PID_FILE" ]; then
     echo "❌ PID file not found. Application may not be running."
     exit 1
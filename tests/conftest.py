@@ -0,0 +1,101 @@
+import io
+import os
+import sys
+
+# Isolated in-memory database, inline CPU work, no cross-test caching and changes synced at once
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['CPU_OFFLOAD_WORKERS'] = '0'
+os.environ['MESSAGE_CACHE_MAX_BYTES'] = '0'
+os.environ['SESSION_CACHE_TTL'] = '0'
+os.environ['SYNC_SETTLE_SECONDS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+import pytest
+from app import app as flask_app, socketio
+from backend import media_blobs
+from backend.media_pipeline import media_pipeline
+from backend.models import db, User
+from backend.routes import messages
+from backend.telegram_storage import TelegramStorage
+from telegram_stub import TelegramStub
+
+PASSWORD = 'pw'
+# Low cost factor so creating users does not dominate the suite
+PASSWORD_HASH = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        for index, name in enumerate(['alice', 'bob', 'carol']):
+            db.session.add(User(phone=f'+100{index}', name=name, password_hash=PASSWORD_HASH))
+        db.session.commit()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def login(app):
+    """login(user_id) -> test client logged in as that user"""
+    def login_as(user_id):
+        client = app.test_client()
+        response = client.post('/wa/api/auth/login', json={
+            'phone': f'+100{user_id - 1}', 'password': PASSWORD, 'force_login': True
+        })
+        assert response.status_code == 200, response.data
+        return client
+    return login_as
+
+@pytest.fixture
+def stub():
+    """Local Telegram Bot API, see telegram_stub.py"""
+    server = TelegramStub().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def storage(stub, monkeypatch):
+    """TelegramStorage talking to the stub"""
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', stub.token)
+    monkeypatch.setenv('TELEGRAM_CHAT_ID', '1')
+    monkeypatch.setenv('TELEGRAM_API_BASE', stub.url)
+    return TelegramStorage()
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    """Media stored under tmp_path, without background pipeline jobs"""
+    monkeypatch.setattr(media_blobs, 'UPLOAD_DIR', str(tmp_path))
+    monkeypatch.setattr(messages, 'UPLOAD_PARTIAL_DIR', str(tmp_path / 'partial'))
+    # No thumbnail or upload jobs outliving the test database
+    monkeypatch.setattr(media_pipeline, 'workers', 0)
+    return tmp_path
+
+def decrypt(client, response):
+    """Payload of an encrypt_api_response body"""
+    body = response.get_json()
+    if 'encrypted_data' not in body:
+        return body
+    return client.post('/wa/api/messages/decrypt', json=body).get_json()['data']
+
+def send_text(client, receiver_id, content):
+    token = client.post('/wa/api/messages/encrypt-id', json={'user_id': receiver_id}).get_json()['encrypted_id']
+    response = client.post('/wa/api/messages/send', json={'receiver_id': token, 'content': content})
+    assert response.status_code == 201, response.data
+    return response.get_json()
+
+def send_media(client, receiver_id, content, filename='clip.mp3'):
+    """Id of the media message sent through /send-media"""
+    response = client.post('/wa/api/messages/send-media', data={
+        'receiver_id': str(receiver_id), 'file': (io.BytesIO(content), filename)
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201, response.data
+    return response.get_json()['id']
+
+def socket_client(client):
+    """Socket.IO test client sharing the HTTP client's login cookie"""
+    cookie = '; '.join(f'{c.key}={c.value}' for c in client._cookies.values())
+    return socketio.test_client(flask_app, headers={'Cookie': cookie})
@@ -0,0 +1,25 @@
+"""Minimal Socket.IO worker for the broker tests: python fanout_worker.py <port> <broker url>"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio
+from werkzeug.serving import run_simple
+from backend.broker import socketio_queue_options
+
+port, queue_url = int(sys.argv[1]), sys.argv[2]
+server = socketio.Server(async_mode='threading', **socketio_queue_options(queue_url))
+
+@server.on('join')
+def join(sid, room):
+    server.enter_room(sid, room)
+    return 'joined'
+
+@server.on('shout')
+def shout(sid, data):
+    # Delivered through the broker to the room's sockets on every worker
+    server.emit('shouted', data['text'], room=data['room'])
+    return 'sent'
+
+run_simple('127.0.0.1', port, socketio.WSGIApp(server), threaded=True)
@@ -0,0 +1,113 @@
+"""Local stand-in for the Telegram Bot API used by the media tests"""
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import threading
+import time
+
+UPLOAD_FIELDS = {'sendPhoto': 'photo', 'sendVideo': 'video', 'sendDocument': 'document'}
+
+class TelegramStub:
+    """Serves sendPhoto/sendVideo/sendDocument, getFile and file downloads.
+
+    Uploaded bytes are kept in memory; fail_uploads makes the next uploads
+    answer 500, upload_delay and download_delay hold each upload or file
+    download for that many seconds. Downloads honour a single Range and
+    record it in ranges.
+    """
+
+    def __init__(self, token='123:stub'):
+        self.token = token
+        self.files = {}  # file_id -> bytes
+        self.uploads = []  # (method, file bytes) in arrival order
+        self.downloads = 0
+        self.ranges = []  # Range headers of file downloads
+        self.fail_uploads = 0
+        self.upload_delay = 0
+        self.download_delay = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                field = UPLOAD_FIELDS.get(method)
+                if field is None or not self.path.startswith(f'/bot{stub.token}/'):
+                    return self._json(404, {'ok': False})
+                time.sleep(stub.upload_delay)
+                with stub.lock:
+                    if stub.fail_uploads:
+                        stub.fail_uploads -= 1
+                        return self._json(500, {'ok': False})
+                    content = _multipart_file(self.headers['Content-Type'], body)
+                    file_id = f'file{len(stub.files) + 1}'
+                    stub.files[file_id] = content
+                    stub.uploads.append((method, content))
+                result = {'file_id': file_id}
+                return self._json(200, {'ok': True, 'result': {field: [result] if field == 'photo' else result}})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == f'/bot{stub.token}/getFile':
+                    file_id = parse_qs(url.query).get('file_id', [''])[0]
+                    if file_id not in stub.files:
+                        return self._json(400, {'ok': False})
+                    return self._json(200, {'ok': True, 'result': {'file_path': f'files/{file_id}'}})
+                prefix = f'/file/bot{stub.token}/files/'
+                file_id = url.path[len(prefix):] if url.path.startswith(prefix) else None
+                if file_id not in stub.files:
+                    return self._json(404, {'ok': False})
+                time.sleep(stub.download_delay)
+                with stub.lock:
+                    stub.downloads += 1
+                data = stub.files[file_id]
+                byte_range = self.headers.get('Range')
+                if byte_range:
+                    stub.ranges.append(byte_range)
+                    start, _, end = byte_range[len('bytes='):].partition('-')
+                    end = min(int(end) if end else len(data) - 1, len(data) - 1)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                    data = data[int(start):end + 1]
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+def _multipart_file(content_type, body):
+    """Bytes of the first file part of a multipart/form-data body"""
+    message = message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+    for part in message.get_payload():
+        if part.get_filename():
+            return part.get_payload(decode=True)
+    return b''
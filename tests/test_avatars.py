@@ -0,0 +1,79 @@
+import pytest
+
+from app import socketio
+from backend import thumbnails
+from backend.media_cache import MediaDiskCache
+from backend.media_pipeline import MediaUploadPipeline
+from backend.models import db, User
+from backend.routes import messages, users
+from conftest import decrypt, send_text
+
+@pytest.fixture
+def telegram(app, storage, tmp_path, monkeypatch):
+    """Routes talking to the stub, with a disk cache of their own"""
+    monkeypatch.setenv('UPLOAD_FOLDER', str(tmp_path))
+    cache = MediaDiskCache()
+    cache.init_app(socketio)
+    monkeypatch.setattr(messages, 'media_cache', cache)
+    monkeypatch.setattr(messages, 'telegram_storage', storage)
+    monkeypatch.setattr(users, 'telegram_storage', storage)
+    return storage
+
+def set_avatar(app, user_id, avatar, **columns):
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.avatar = avatar
+        for name, value in columns.items():
+            setattr(user, name, value)
+        db.session.commit()
+
+def test_uploaded_avatar_is_stored_by_file_id(app, storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'available', lambda: False)
+    path = tmp_path / 'avatar_1_x.png'
+    path.write_bytes(b'avatar bytes')
+    set_avatar(app, 1, '/wa/uploads/avatar_1_x.png')
+    pipeline = MediaUploadPipeline()
+    pipeline.storage = storage
+    pipeline.init_app(app, socketio)
+
+    with app.app_context():
+        assert pipeline._upload_avatar(1, str(path))
+        avatar = db.session.get(User, 1).avatar
+    assert avatar.startswith('tg:') and storage.bot_token not in avatar
+
+def test_telegram_avatar_is_proxied_not_redirected(app, login, telegram, stub):
+    stub.files['file1'] = b'avatar bytes'
+    set_avatar(app, 1, 'tg:file1')
+    bob = login(2)
+
+    response = bob.get('/wa/api/users/1/avatar?size=original')
+
+    assert response.status_code == 200
+    assert response.data == b'avatar bytes'
+    assert 'Location' not in response.headers
+
+def test_legacy_telegram_url_is_proxied(app, login, telegram, stub):
+    stub.files['file1'] = b'old avatar'
+    set_avatar(app, 1, f'{stub.url}/file/bot{stub.token}/files/file1')
+
+    response = login(2).get('/wa/api/users/1/avatar?size=original')
+
+    assert response.status_code == 200
+    assert b''.join(response.response) == b'old avatar'
+    assert 'Location' not in response.headers
+
+def test_payloads_never_carry_the_telegram_url(app, login, telegram, stub):
+    set_avatar(app, 1, f'{stub.url}/file/bot{stub.token}/files/file1', is_private=False)
+    alice, bob = login(1), login(2)
+    send_text(alice, 2, 'hi')
+
+    me = alice.get('/wa/api/auth/me').get_json()
+    contacts = decrypt(bob, bob.get('/wa/api/messages/contacts'))
+    found = bob.get('/wa/api/users/by-phone/+1000').get_json()
+    for user in (me, contacts[0], found):
+        assert user['avatar'] == '/wa/api/users/1/avatar?size=original'
+
+def test_local_avatar_redirects_to_the_upload(app, login):
+    set_avatar(app, 1, '/wa/uploads/avatar_1_x.png')
+    response = login(2).get('/wa/api/users/1/avatar?size=original')
+    assert response.status_code == 302 and response.headers['Location'] == '/wa/uploads/avatar_1_x.png'
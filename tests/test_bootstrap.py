@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from backend.models import db, User
+from conftest import PASSWORD_HASH, decrypt, send_text
+
+@contextmanager
+def counted_queries(app):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+def add_contacts(app, count):
+    """Ids of count extra users"""
+    with app.app_context():
+        users = [User(phone=f'+2000{index}', name=f'peer {index}', password_hash=PASSWORD_HASH) for index in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+def bootstrap_queries(app, client, conversations):
+    with counted_queries(app) as statements:
+        response = client.get('/wa/api/bootstrap', query_string={'conversations': conversations, 'messages': 5})
+    assert response.status_code == 200, response.data
+    return len(statements), response.get_json()
+
+def test_query_count_does_not_grow_with_conversations(app, login):
+    alice = login(1)
+    for peer_id in [2, 3] + add_contacts(app, 6):
+        for index in range(3):
+            send_text(alice, peer_id, f'to {peer_id} #{index}')
+
+    one, _ = bootstrap_queries(app, alice, 1)
+    many, body = bootstrap_queries(app, alice, 8)
+
+    assert len(body['conversations']) == 8
+    assert many == one
+
+def test_latest_messages_per_conversation(app, login):
+    alice, bob = login(1), login(2)
+    for index in range(7):
+        send_text(alice, 2, f'bob #{index}')
+    send_text(bob, 1, 'reply')
+    send_text(alice, 3, 'carol #0')
+
+    _, body = bootstrap_queries(app, alice, 5)
+
+    assert body['user']['id'] == 1
+    assert [contact['id'] for contact in body['contacts']] == [3, 2]
+    conversations = {conversation['contact_id']: conversation for conversation in body['conversations']}
+    bob_chat = conversations[2]
+    assert [message['content'] for message in bob_chat['messages']] == [
+        'bob #3', 'bob #4', 'bob #5', 'bob #6', 'reply'
+    ]
+    assert bob_chat['has_more'] is True and bob_chat['next_cursor']
+    assert [message['content'] for message in conversations[3]['messages']] == ['carol #0']
+    assert conversations[3]['has_more'] is False
+
+    # The sync cursor picks up exactly what happened after the bootstrap
+    send_text(bob, 1, 'after bootstrap')
+    changes = decrypt(alice, alice.get('/wa/api/messages/sync', query_string={'since': body['sync_cursor']}))
+    assert [message['content'] for message in changes['messages']] == ['after bootstrap']
@@ -0,0 +1,82 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import socketio
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+def port_open(port):
+    with socket.socket() as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+@pytest.fixture
+def cluster(tmp_path):
+    """A broker process and two worker processes sharing it; yields the worker ports"""
+    broker_path = str(tmp_path / 'broker.sock')
+    processes = [subprocess.Popen([sys.executable, '-m', 'backend.broker', broker_path], cwd=ROOT)]
+    try:
+        assert wait_for(lambda: os.path.exists(broker_path)), 'broker did not start'
+        ports = [free_port(), free_port()]
+        for port in ports:
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(HERE, 'fanout_worker.py'), str(port), f'unix://{broker_path}'],
+                cwd=ROOT, stderr=subprocess.DEVNULL
+            ))
+        assert wait_for(lambda: all(port_open(port) for port in ports)), 'workers did not start'
+        yield ports
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+def connect(port):
+    client = socketio.Client()
+    client.connect(f'http://127.0.0.1:{port}', transports=['polling'])
+    return client
+
+def test_room_emit_reaches_sockets_on_another_worker(cluster):
+    listener_port, sender_port = cluster
+    received = []
+    arrived = threading.Event()
+    listener = connect(listener_port)
+    other = connect(listener_port)
+    sender = connect(sender_port)
+    try:
+        @listener.on('shouted')
+        def on_shouted(text):
+            received.append(text)
+            arrived.set()
+
+        stray = []
+        other.on('shouted', stray.append)
+        assert listener.call('join', 'user_1', timeout=5) == 'joined'
+        # The subscriber connection to the broker is opened in the background
+        time.sleep(0.5)
+        assert sender.call('shout', {'room': 'user_1', 'text': 'hello'}, timeout=5) == 'sent'
+
+        assert arrived.wait(5), 'emit was not fanned out to the other worker'
+        time.sleep(0.3)
+        assert received == ['hello']
+        assert stray == []  # Not in the room
+    finally:
+        for client in (listener, other, sender):
+            client.disconnect()
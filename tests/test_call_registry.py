@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.call_registry import CallRegistry
+from backend.models import db, Call
+
+class RecordingSocketIO:
+    """Collects emits; background tasks are driven by the test"""
+
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, data, room=None):
+        self.emitted.append((event, data, room))
+
+    def start_background_task(self, fn, *args):
+        self.tasks.append((fn, args))
+
+@pytest.fixture
+def workers(app):
+    """Two registries over one database, as two worker processes would have them"""
+    def worker():
+        registry = CallRegistry()
+        registry.init_app(app, RecordingSocketIO())
+        return registry
+    return worker(), worker()
+
+@pytest.fixture
+def ringing(app, workers):
+    caller_worker, _ = workers
+    with app.app_context():
+        call = Call(caller_id=1, receiver_id=2, call_type='audio', status='initiated')
+        db.session.add(call)
+        db.session.commit()
+        caller_worker.register(call)
+        return call.id
+
+def stored_status(app, call_id):
+    with app.app_context():
+        return db.session.get(Call, call_id).status
+
+def test_answer_on_another_worker_survives_the_ring_timeout(app, workers, ringing):
+    caller_worker, callee_worker = workers
+    with app.app_context():
+        assert callee_worker.transition(callee_worker.get(ringing), 2, 'answer') is None
+    # Written at once, not at the next flush
+    assert stored_status(app, ringing) == 'answered'
+
+    caller_worker._expire([caller_worker.peek(ringing)])
+
+    assert stored_status(app, ringing) == 'answered'
+    assert caller_worker.socketio.emitted == []
+    assert caller_worker.peek(ringing).status == 'answered'
+    assert caller_worker.stats()['timeouts'] == 0
+
+def test_timeout_before_the_answer_wins(app, workers, ringing):
+    caller_worker, callee_worker = workers
+    caller_worker._expire([caller_worker.peek(ringing)])
+
+    assert stored_status(app, ringing) == 'missed'
+    assert [room for event, data, room in caller_worker.socketio.emitted if data['type'] == 'call_missed'] == [
+        'user_1', 'user_2'
+    ]
+    with app.app_context():
+        assert callee_worker.transition(callee_worker.get(ringing), 2, 'answer') == 'Call already missed'
+    assert stored_status(app, ringing) == 'missed'
+
+def test_ringing_lookup_picks_up_an_answer_from_another_worker(app, workers, ringing):
+    caller_worker, callee_worker = workers
+    with app.app_context():
+        callee_worker.transition(callee_worker.get(ringing), 2, 'answer')
+        state = caller_worker.get(ringing)
+        assert state.status == 'answered'
+        assert caller_worker.stats()['ringing'] == 0
+        # Hanging up now ends an answered call instead of recording a missed one
+        assert caller_worker.transition(state, 1, 'end') is None
+    caller_worker.flush()
+    assert stored_status(app, ringing) == 'ended'
+
+def test_call_history_limit_is_clamped(app, login):
+    with app.app_context():
+        db.session.add_all([Call(caller_id=1, receiver_id=2, call_type='audio', status='missed') for _ in range(3)])
+        db.session.commit()
+    alice = login(1)
+    page = alice.get('/wa/api/calls/history', query_string={'limit': -2, 'cursor': ''}).get_json()
+    assert len(page['calls']) == 1 and page['has_more']
+
+class Stop(Exception):
+    pass
+
+def test_start_expires_calls_left_ringing(app):
+    with app.app_context():
+        call = Call(caller_id=1, receiver_id=2, call_type='audio', status='initiated',
+                    started_at=datetime.utcnow() - timedelta(hours=1))
+        db.session.add(call)
+        db.session.commit()
+        call_id = call.id
+    registry = CallRegistry()
+    registry.init_app(app, RecordingSocketIO())
+
+    registry.start()
+
+    [(task, args)] = registry.socketio.tasks
+    def stop(seconds):
+        raise Stop
+    registry.socketio.sleep = stop
+    with pytest.raises(Stop):
+        task(*args)
+    assert stored_status(app, call_id) == 'missed'
@@ -0,0 +1,35 @@
+from backend.routes import messages
+from conftest import decrypt, send_text
+
+def conversation(client, peer_id, **query):
+    token = client.post('/wa/api/messages/encrypt-id', json={'user_id': peer_id}).get_json()['encrypted_id']
+    response = client.get(f'/wa/api/messages/conversation/{token}', query_string=query)
+    assert response.status_code == 200, response.data
+    return decrypt(client, response)
+
+def contents(page):
+    return [message['content'] for message in page['messages']]
+
+def test_cursor_pages_walk_back_through_history(login):
+    alice = login(1)
+    for index in range(5):
+        send_text(alice, 2, f'm{index}')
+
+    newest = conversation(alice, 2, limit=2, cursor='')
+    assert contents(newest) == ['m3', 'm4'] and newest['has_more']
+    older = conversation(alice, 2, limit=2, cursor=newest['next_cursor'])
+    assert contents(older) == ['m1', 'm2'] and older['has_more']
+    oldest = conversation(alice, 2, limit=2, cursor=older['next_cursor'])
+    assert contents(oldest) == ['m0'] and not oldest['has_more']
+
+def test_limit_is_clamped(login, monkeypatch):
+    alice = login(1)
+    for index in range(4):
+        send_text(alice, 2, f'm{index}')
+
+    # A negative LIMIT is unbounded in SQLite; it must not return the whole history
+    assert contents(conversation(alice, 2, limit=-2, cursor='')) == ['m3']
+    assert contents(conversation(alice, 2, limit=0, page=0)) == ['m3']
+    monkeypatch.setattr(messages, 'CONVERSATION_MAX_LIMIT', 3)
+    page = conversation(alice, 2, limit=10_000, cursor='')
+    assert contents(page) == ['m1', 'm2', 'm3'] and page['has_more']
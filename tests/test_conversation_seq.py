@@ -0,0 +1,62 @@
+from unittest import mock
+from backend.models import db, Message, Conversation, conversation_key_for
+from conftest import send_text
+
+def seqs(key):
+    return [seq for (seq,) in db.session.query(Message.seq).filter_by(conversation_key=key).order_by(Message.id)]
+
+def test_seq_counts_per_conversation(app, login):
+    alice = login(1)
+    bob = login(2)
+    send_text(alice, 2, 'a1')
+    send_text(bob, 1, 'b1')
+    send_text(alice, 3, 'c1')
+    send_text(alice, 2, 'a2')
+
+    with app.app_context():
+        assert seqs(conversation_key_for(1, 2)) == [1, 2, 3]
+        assert seqs(conversation_key_for(1, 3)) == [1]
+        conversation = Conversation.query.filter_by(conversation_key=conversation_key_for(1, 2)).one()
+        assert conversation.last_seq == 3
+        assert conversation.unread_for(1) == 1
+        assert conversation.unread_for(2) == 2
+
+def test_seq_comes_from_the_conversation_counter(app):
+    with app.app_context():
+        key = conversation_key_for(1, 2)
+        db.session.add(Message(sender_id=1, receiver_id=2, content='x'))
+        db.session.commit()
+        # Simulates seqs handed out to messages since deleted
+        Conversation.query.filter_by(conversation_key=key).update({'last_seq': 10})
+        db.session.commit()
+
+        message = Message(sender_id=2, receiver_id=1, content='y')
+        db.session.add(message)
+        db.session.commit()
+        assert message.seq == 11
+
+def test_seq_allocation_creates_the_summary_row_once(app):
+    with app.app_context():
+        db.session.add_all([Message(sender_id=1, receiver_id=2, content=str(i)) for i in range(3)])
+        db.session.commit()
+        assert Conversation.query.count() == 1
+        assert seqs(conversation_key_for(1, 2)) == [1, 2, 3]
+
+def test_get_or_create_reuses_a_concurrently_created_summary(app, monkeypatch):
+    with app.app_context():
+        key = conversation_key_for(1, 2)
+        # Another transaction inserts the row after this one looked for it
+        db.session.execute(Conversation.__table__.insert().values(
+            conversation_key=key, user_low_id=1, user_high_id=2, unread_low=0, unread_high=0, last_seq=0
+        ))
+        existing = Conversation.query.filter_by(conversation_key=key)
+        lookup = mock.Mock()
+        lookup.filter_by.return_value.first.return_value = None
+        lookup.filter_by.return_value.one.side_effect = existing.one
+        monkeypatch.setattr(Conversation, 'query', lookup)
+
+        conversation = Conversation.get_or_create(2, 1)
+        monkeypatch.undo()
+        db.session.commit()
+        assert conversation.conversation_key == key
+        assert Conversation.query.count() == 1
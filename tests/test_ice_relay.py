@@ -0,0 +1,65 @@
+from backend.ice_relay import IceRelay
+
+class RecordingSocketIO:
+    """Collects emits and the delayed flushes the relay schedules"""
+
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, data, room=None, skip_sid=None):
+        self.emitted.append((event, data, room, skip_sid))
+
+    def start_background_task(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def sleep(self, seconds):
+        pass
+
+    def run_tasks(self):
+        tasks, self.tasks = self.tasks, []
+        for fn, args in tasks:
+            fn(*args)
+
+def relay():
+    ice_relay = IceRelay()
+    ice_relay.init_app(RecordingSocketIO())
+    return ice_relay
+
+def test_client_batches_are_forwarded_without_waiting():
+    ice_relay = relay()
+    ice_relay.forward(7, 'sid-a', ['c1', 'c2'])
+
+    [(event, data, room, skip_sid)] = ice_relay.socketio.emitted
+    assert (event, room, skip_sid) == ('webrtc_ice_batch', 'call_7', 'sid-a')
+    assert data['candidates'] == ['c1', 'c2'] and data['done'] is False
+    assert ice_relay.socketio.tasks == []
+
+def test_single_candidates_are_coalesced_for_the_window():
+    ice_relay = relay()
+    ice_relay.add(7, 'sid-a', ['c1'])
+    ice_relay.add(7, 'sid-a', ['c2'])
+    ice_relay.add(7, 'sid-b', ['c3'])
+    assert ice_relay.socketio.emitted == []
+
+    ice_relay.socketio.run_tasks()
+    assert sorted((data['candidates'], skip_sid) for _, data, _, skip_sid in ice_relay.socketio.emitted) == [
+        (['c1', 'c2'], 'sid-a'), (['c3'], 'sid-b')
+    ]
+    assert ice_relay.stats()['batches_relayed'] == 2
+
+def test_batch_carries_buffered_candidates_and_done():
+    ice_relay = relay()
+    ice_relay.add(7, 'sid-a', ['c1'])
+    ice_relay.forward(7, 'sid-a', ['c2'], done=True)
+
+    [(_, data, _, _)] = ice_relay.socketio.emitted
+    assert data['candidates'] == ['c1', 'c2'] and data['done'] is True
+    # The pending window flush finds nothing left to send
+    ice_relay.socketio.run_tasks()
+    assert len(ice_relay.socketio.emitted) == 1
+
+def test_done_without_candidates_is_delivered():
+    ice_relay = relay()
+    ice_relay.forward(7, 'sid-a', [], done=True)
+    assert ice_relay.socketio.emitted[0][1] == {'call_id': 7, 'room': 'call_7', 'candidates': [], 'done': True}
@@ -0,0 +1,40 @@
+import os
+
+from backend.models import db, Message, MediaBlob
+from conftest import send_media
+
+def blob_state(app):
+    with app.app_context():
+        return [(blob.refcount, blob.local_path) for blob in MediaBlob.query.all()]
+
+def test_repeat_sends_share_one_blob(app, login, uploads):
+    client = login(1)
+    first = send_media(client, 2, b'same audio')
+    second = send_media(client, 3, b'same audio', filename='forwarded.mp3')
+
+    [(refcount, local_path)] = blob_state(app)
+    assert refcount == 2
+    assert [name for name in os.listdir(uploads) if os.path.isfile(uploads / name)] == [os.path.basename(local_path)]
+    with app.app_context():
+        assert {db.session.get(Message, first).blob_id, db.session.get(Message, second).blob_id} == {
+            MediaBlob.query.one().id
+        }
+
+def test_deleting_the_last_reference_reclaims_the_file(app, login, uploads):
+    client = login(1)
+    first = send_media(client, 2, b'voice note')
+    second = send_media(client, 2, b'voice note')
+    [(_, local_path)] = blob_state(app)
+
+    assert client.delete(f'/wa/api/messages/{first}').status_code == 200
+    assert blob_state(app) == [(1, local_path)]
+    assert os.path.exists(local_path)
+
+    assert client.delete(f'/wa/api/messages/{second}').status_code == 200
+    assert blob_state(app) == []
+    assert not os.path.exists(local_path)
+
+def test_only_the_sender_can_delete(app, login, uploads):
+    message_id = send_media(login(1), 2, b'private clip')
+    assert login(2).delete(f'/wa/api/messages/{message_id}').status_code == 403
+    assert blob_state(app)[0][0] == 1
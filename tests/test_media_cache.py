@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import socketio
+from backend.media_cache import MediaDiskCache
+from backend.models import db, Message
+from backend.routes import messages
+from test_media_pipeline import wait_for
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def cache(app, tmp_path, monkeypatch):
+    monkeypatch.setenv('UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setenv('MEDIA_CACHE_MAX_BYTES', str(1024 * 1024))
+    cache = MediaDiskCache()
+    cache.init_app(socketio)
+    return cache
+
+def test_concurrent_first_views_share_one_download(cache, storage, stub):
+    stub.files['file1'] = b'picture bytes'
+    stub.download_delay = 0.3
+    results = []
+    for _ in range(4):
+        socketio.start_background_task(lambda: results.append(cache.fetch('file1', lambda: storage.open_file('file1'))))
+
+    assert wait_for(lambda: len(results) == 4)
+    assert stub.downloads == 1
+    assert len({entry.digest for entry in results}) == 1
+    with open(results[0].path, 'rb') as blob:
+        assert blob.read() == b'picture bytes'
+    stats = cache.stats()
+    assert stats['downloads'] == 1 and stats['shared_downloads'] == 3
+    # Later views are served from disk
+    assert cache.lookup('file1').digest == results[0].digest
+    assert stub.downloads == 1
+
+def test_failed_download_is_not_cached(cache, storage, stub):
+    assert cache.fetch('missing', lambda: storage.open_file('missing')) is None
+    assert cache.lookup('missing') is None
+    assert cache.stats()['entries'] == 0
+
+# Runs in a fresh interpreter: monkey patching cannot be undone inside the test process
+TPOOL_SCRIPT = '''
+import eventlet
+eventlet.monkey_patch()
+from eventlet import patcher, tpool
+import os, tempfile
+os.environ['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+from backend.media_cache import MediaDiskCache
+from backend.offload import io_offload
+
+native_sleep = patcher.original('time').sleep
+
+class Upstream:
+    status_code = 200
+    headers = {'content-type': 'image/jpeg'}
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def iter_content(self, size):
+        # Blocks the pool thread, not the hub
+        native_sleep(0.2)
+        yield b'x' * 1000
+
+opened = []
+def open_upstream():
+    opened.append(1)
+    return Upstream()
+
+io_offload.mode = 'tpool'
+tpool.set_num_threads(4)
+cache = MediaDiskCache()
+pool = eventlet.GreenPool()
+keys = ['a', 'b'] * 25
+entries = list(pool.imap(lambda key: cache.fetch(key, open_upstream), keys))
+assert all(entry is not None for entry in entries), entries
+assert len(opened) == 2, opened
+stats = cache.stats()
+assert stats['downloads'] == 2 and stats['shared_downloads'] == 48, stats
+'''
+
+def test_downloads_on_tpool_threads_share_flights_with_the_hub():
+    # Green events or locks touched from tpool threads stall or raise
+    result = subprocess.run([sys.executable, '-c', TPOOL_SCRIPT], cwd=ROOT, capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+def test_ranged_first_view_streams_and_fills_the_cache_behind(app, login, cache, storage, stub, monkeypatch):
+    monkeypatch.setattr(messages, 'telegram_storage', storage)
+    monkeypatch.setattr(messages, 'media_cache', cache)
+    stub.files['file1'] = b'0123456789' * 100
+    with app.app_context():
+        message = Message(sender_id=1, receiver_id=2, content='Sent a video', message_type='video',
+                          telegram_file_id='file1', telegram_file_url=f'{stub.url}/expired', media_status='ready')
+        db.session.add(message)
+        db.session.commit()
+        message_id = message.id
+    client = login(2)
+
+    response = client.get(f'/wa/api/messages/media/{message_id}', headers={'Range': 'bytes=10-19'})
+
+    assert response.status_code == 206
+    assert response.data == b'0123456789'
+    # Relayed from upstream rather than after a full download
+    assert stub.ranges == ['bytes=10-19']
+    assert wait_for(lambda: cache.stats()['downloads'] == 1)
+
+    # Later views, ranged or not, come from disk
+    again = client.get(f'/wa/api/messages/media/{message_id}', headers={'Range': 'bytes=0-3'})
+    assert again.status_code == 206 and again.data == b'0123'
+    assert client.get(f'/wa/api/messages/media/{message_id}').data == stub.files['file1']
+    assert stub.ranges == ['bytes=10-19'] and stub.downloads == 2
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+import os
+import time
+
+import pytest
+
+from app import socketio
+from backend.media_pipeline import MediaUploadPipeline
+from backend.models import db, Message, MediaBlob
+from backend.offload import io_offload
+
+@pytest.fixture
+def make_pipeline(app, storage):
+    """make_pipeline() -> a started-up pipeline as another worker process would have it"""
+    pipelines = []
+    def make():
+        pipeline = MediaUploadPipeline()
+        pipeline.storage = storage
+        pipeline.backoff = 0.05
+        pipeline.init_app(app, socketio)
+        pipelines.append(pipeline)
+        return pipeline
+    yield make
+    # Let retries still scheduled finish before the database goes away
+    assert wait_for(lambda: all(pipeline.stats()['in_flight'] == 0 for pipeline in pipelines))
+
+def wait_for(check, timeout=10):
+    """Let the pipeline's green threads run until check() holds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        socketio.sleep(0.02)
+    return False
+
+def pending_message(app, path, content, blob=None, **columns):
+    path.write_bytes(content)
+    with app.app_context():
+        message = Message(sender_id=1, receiver_id=2, content='Sent a image', message_type='image',
+                          file_path=None if blob else str(path), blob_id=blob, media_status='pending', **columns)
+        db.session.add(message)
+        db.session.commit()
+        return message.id
+
+def status(app, message_id):
+    with app.app_context():
+        return db.session.get(Message, message_id).media_status
+
+def test_pending_uploads_resume_at_start(app, make_pipeline, stub, tmp_path):
+    message_id = pending_message(app, tmp_path / 'a.jpg', b'first image')
+    uploads_before = io_offload.stats()['completed']
+
+    make_pipeline().start()
+
+    assert wait_for(lambda: status(app, message_id) == 'ready')
+    with app.app_context():
+        message = db.session.get(Message, message_id)
+        assert stub.files[message.telegram_file_id] == b'first image'
+        assert message.telegram_file_url.endswith(f'/files/{message.telegram_file_id}')
+        assert message.file_path is None
+    assert not (tmp_path / 'a.jpg').exists()
+    # Network calls go to the I/O pool, not the bcrypt-sized CPU pool
+    assert io_offload.stats()['completed'] == uploads_before + 1
+
+def test_failed_uploads_are_retried(app, make_pipeline, stub, tmp_path):
+    stub.fail_uploads = 2
+    message_id = pending_message(app, tmp_path / 'a.jpg', b'flaky')
+    pipeline = make_pipeline()
+    pipeline.start()
+
+    assert wait_for(lambda: status(app, message_id) == 'ready')
+    assert pipeline.stats()['retried'] == 2
+    assert len(stub.uploads) == 1
+
+def test_workers_resuming_the_same_rows_upload_each_once(app, make_pipeline, stub, tmp_path):
+    stub.upload_delay = 0.2
+    message_ids = [pending_message(app, tmp_path / f'{i}.jpg', f'image {i}'.encode()) for i in range(3)]
+    workers = [make_pipeline(), make_pipeline()]
+    for pipeline in workers:
+        pipeline.start()
+
+    assert wait_for(lambda: all(status(app, message_id) == 'ready' for message_id in message_ids))
+    assert sorted(content for _, content in stub.uploads) == [b'image 0', b'image 1', b'image 2']
+
+def test_a_live_lease_of_another_worker_is_respected(app, make_pipeline, stub, tmp_path):
+    held = pending_message(app, tmp_path / 'held.jpg', b'held', upload_owner='other:1:x',
+                           upload_lease_until=datetime.utcnow() + timedelta(minutes=5))
+    expired = pending_message(app, tmp_path / 'expired.jpg', b'expired', upload_owner='other:1:x',
+                              upload_lease_until=datetime.utcnow() - timedelta(minutes=5))
+    pipeline = make_pipeline()
+    pipeline.start()
+    pipeline.submit_message(held)  # E.g. queued again by a client retry
+
+    assert wait_for(lambda: status(app, expired) == 'ready')
+    wait_for(lambda: False, timeout=0.3)
+    assert status(app, held) == 'pending'
+    assert [content for _, content in stub.uploads] == [b'expired']
+    assert pipeline.stats()['claimed_elsewhere'] == 1
+
+def test_shared_content_is_uploaded_once_for_all_its_messages(app, make_pipeline, stub, tmp_path):
+    stub.upload_delay = 0.2
+    path = tmp_path / 'shared.jpg'
+    path.write_bytes(b'shared image')
+    with app.app_context():
+        blob = MediaBlob(sha256='0' * 64, size=12, local_path=str(path), refcount=2, thumbnails='')
+        db.session.add(blob)
+        db.session.commit()
+        blob_id = blob.id
+    message_ids = [pending_message(app, tmp_path / f'unused{i}', b'', blob=blob_id) for i in range(2)]
+    for pipeline in (make_pipeline(), make_pipeline()):
+        pipeline.start()
+
+    assert wait_for(lambda: all(status(app, message_id) == 'ready' for message_id in message_ids))
+    assert [content for _, content in stub.uploads] == [b'shared image']
+    with app.app_context():
+        assert db.session.get(MediaBlob, blob_id).local_path is None
+    assert not os.path.exists(path)
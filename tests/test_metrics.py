@@ -0,0 +1,15 @@
+def test_metrics_need_the_scraper_token(app, login, monkeypatch):
+    monkeypatch.setenv('METRICS_TOKEN', 's3cret')
+    client = app.test_client()
+    assert client.get('/wa/api/metrics').status_code == 401
+    # A logged-in user is not a scraper
+    assert login(1).get('/wa/api/metrics').status_code == 401
+    assert client.get('/wa/api/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    response = client.get('/wa/api/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert 'cpu_offload' in response.get_json()
+
+def test_metrics_are_off_without_a_token(app, monkeypatch):
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    assert app.test_client().get('/wa/api/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
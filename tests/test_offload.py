@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: monkey patching cannot be undone inside the test process
+TPOOL_SCRIPT = '''
+import eventlet
+eventlet.monkey_patch()
+from eventlet import tpool
+from backend.offload import CPUOffload
+
+offload = CPUOffload()
+offload.mode = 'tpool'
+offload.workers = 16
+tpool.set_num_threads(16)
+pool = eventlet.GreenPool()
+results = list(pool.imap(lambda n: offload.run(abs, -n), range(20000)))
+assert results == list(range(20000)), results[:10]
+stats = offload.stats()
+assert stats['completed'] == 20000 and stats['failed'] == 0 and stats['queue_depth'] == 0, stats
+'''
+
+def test_tpool_jobs_share_the_stats_lock_with_the_hub():
+    # Green locks contended between the hub and tpool threads stall or raise
+    result = subprocess.run([sys.executable, '-c', TPOOL_SCRIPT], cwd=ROOT, capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+def test_inline_mode_runs_in_the_caller():
+    from backend.offload import CPUOffload
+    offload = CPUOffload()
+    offload.mode = 'inline'
+    assert offload.run(sum, [1, 2, 3]) == 6
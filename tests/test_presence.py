@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.models import db, User, PresenceClaim
+from backend.presence import PresenceRegistry
+from conftest import send_text
+
+class RecordingSocketIO:
+    """Collects emits; background tasks are driven by the test"""
+
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, room=None):
+        self.emitted.append((event, data, room))
+
+    def start_background_task(self, *args, **kwargs):
+        pass
+
+@pytest.fixture
+def workers(app, login):
+    """Two registries over one database, as two worker processes would have them"""
+    send_text(login(1), 2, 'hi')
+    def worker():
+        registry = PresenceRegistry()
+        registry.offline_grace = 0
+        registry.init_app(app, RecordingSocketIO())
+        return registry
+    return worker(), worker()
+
+def offline_pushes(registry):
+    return [room for event, data, room in registry.socketio.emitted if event == 'user_status' and not data['isOnline']]
+
+def stored_online(app, user_id):
+    with app.app_context():
+        return db.session.get(User, user_id).is_online
+
+def test_closing_a_tab_on_one_worker_keeps_the_user_online(app, workers):
+    first, second = workers
+    first.connect(1, 'tab-a')
+    second.connect(1, 'tab-b')
+
+    first.disconnect('tab-a')
+    assert first._sweep(time.monotonic())
+    first.flush()
+
+    assert offline_pushes(first) == []
+    assert stored_online(app, 1) is True
+    assert first.stats()['held_elsewhere'] == 1
+
+    # The last tab anywhere takes the user offline
+    second.disconnect('tab-b')
+    assert second._sweep(time.monotonic())
+    second.flush()
+
+    assert offline_pushes(second) == ['user_2']
+    assert stored_online(app, 1) is False
+
+def test_stale_claims_of_a_crashed_worker_are_ignored(app, workers):
+    first, crashed = workers
+    crashed.connect(1, 'tab-b')
+    first.connect(1, 'tab-a')
+    with app.app_context():
+        claim = db.session.get(PresenceClaim, (crashed.worker_id, 1))
+        claim.seen_at = datetime.utcnow() - timedelta(seconds=first.timeout + 1)
+        db.session.commit()
+
+    first.disconnect('tab-a')
+    first._sweep(time.monotonic())
+
+    assert offline_pushes(first) == ['user_2']
@@ -0,0 +1,82 @@
+from sqlalchemy import event
+
+from backend.models import db, Message, ChangeLog
+from conftest import decrypt, send_text, socket_client
+
+def unread_from(client, peer_id):
+    contacts = decrypt(client, client.get('/wa/api/messages/contacts'))
+    return next(contact['unread_count'] for contact in contacts if contact['id'] == peer_id)
+
+def read_state(app, message_ids):
+    with app.app_context():
+        return [bool(db.session.get(Message, message_id).is_read) for message_id in message_ids]
+
+def status_updates(socket):
+    return [event['args'][0] for event in socket.get_received() if event['name'] == 'message_status_update']
+
+def test_read_up_to_an_id_in_one_update(app, login):
+    alice, bob, carol = login(1), login(2), login(3)
+    ids = [send_text(alice, 2, f'message {index}')['id'] for index in range(3)]
+    send_text(carol, 2, 'from carol')
+    assert unread_from(bob, 1) == 3
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = bob.post('/wa/api/messages/mark-read', json={'peer_id': 1, 'up_to_id': ids[1]})
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.get_json() == {'updated': 2}
+    assert len([sql for sql in statements if sql.startswith('UPDATE messages')]) == 1
+    assert read_state(app, ids) == [True, True, False]
+    assert unread_from(bob, 1) == 1
+    assert unread_from(bob, 3) == 1
+
+def test_sender_gets_one_coalesced_status_update(app, login):
+    alice, bob = login(1), login(2)
+    ids = [send_text(alice, 2, f'message {index}')['id'] for index in range(3)]
+    alice_socket, bob_socket = socket_client(alice), socket_client(bob)
+    status_updates(alice_socket)
+
+    ack = bob_socket.emit('message_receipts', {'status': 'read', 'peer_id': 1, 'up_to_id': ids[-1]}, callback=True)
+
+    assert ack == {'updated': 3}
+    [update] = status_updates(alice_socket)
+    assert update['message_ids'] == ids and update['status'] == 'read'
+    # Replaying the receipt changes nothing and notifies nobody
+    assert bob_socket.emit('message_receipts', {'status': 'read', 'peer_id': 1, 'up_to_id': ids[-1]}, callback=True) == {
+        'updated': 0
+    }
+    assert status_updates(alice_socket) == []
+    with app.app_context():
+        assert ChangeLog.query.filter_by(user_id=1, kind='receipt').count() == 3
+
+def test_delivered_by_id_list(app, login):
+    alice, bob = login(1), login(2)
+    ids = [send_text(alice, 2, f'message {index}')['id'] for index in range(2)]
+
+    response = bob.post('/wa/api/messages/mark-delivered', json={'message_ids': ids})
+
+    assert response.get_json() == {'updated': 2}
+    with app.app_context():
+        messages = [db.session.get(Message, message_id) for message_id in ids]
+        assert all(message.is_delivered and message.delivered_at for message in messages)
+        assert not any(message.is_read for message in messages)
+
+def test_only_the_receiver_can_acknowledge(app, login):
+    alice, carol = login(1), login(3)
+    message_id = send_text(alice, 2, 'for bob')['id']
+
+    assert carol.post('/wa/api/messages/mark-read', json={'message_ids': [message_id]}).get_json() == {'updated': 0}
+    assert read_state(app, [message_id]) == [False]
+
+def test_malformed_batches_are_rejected(login):
+    bob = login(2)
+    assert bob.post('/wa/api/messages/mark-read', json={'peer_id': 1}).status_code == 400
+    assert bob.post('/wa/api/messages/mark-read', json={'message_ids': 'all'}).status_code == 400
+    assert bob.post('/wa/api/messages/mark-read', json={'message_ids': ['x']}).status_code == 400
@@ -0,0 +1,24 @@
+from conftest import socket_client
+
+def received(socket, name):
+    return [event['args'][0] for event in socket.get_received() if event['name'] == name]
+
+def test_send_message_cannot_relay_into_other_rooms(login):
+    alice, bob = socket_client(login(1)), socket_client(login(2))
+    alice.get_received()
+
+    ack = bob.emit('send_message', {'room': 'user_1', 'content': 'spoofed', 'sender_id': 3}, callback=True)
+
+    assert ack == {'error': 'Receiver token required'}
+    assert received(alice, 'receive_message') == []
+
+def test_only_own_rooms_can_be_joined(login):
+    bob = socket_client(login(2))
+    assert bob.emit('join_room', {'room': 'user_1'}, callback=True) == {'error': 'Unauthorized'}
+    assert bob.emit('join_room', {'room': 'session_someone-else'}, callback=True) == {'error': 'Unauthorized'}
+    assert bob.emit('join_room', {'room': 'chat_1_3'}, callback=True) == {'error': 'Unauthorized'}
+    bob.get_received()
+
+    bob.emit('join_room', {'room': 'chat_1_2'})
+    bob.emit('join_room', {'room': 'user_2'})
+    assert [event['room'] for event in received(bob, 'room_joined')] == ['chat_1_2', 'user_2']
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+from backend.models import db, ChangeLog
+from backend.routes import messages
+from backend.routes.messages import encode_cursor
+from conftest import decrypt, send_text
+
+def sync(client, since=None, limit=None):
+    query = {} if since is None else {'since': since}
+    if limit is not None:
+        query['limit'] = limit
+    return client.get('/wa/api/messages/sync', query_string=query)
+
+def age_change_log(app, delta):
+    with app.app_context():
+        for entry in ChangeLog.query.all():
+            entry.created_at -= delta
+        db.session.commit()
+
+def current_cursor(client):
+    response = sync(client)
+    assert response.status_code == 200
+    return response.get_json()['cursor']
+
+def test_changes_since_the_cursor(app, login):
+    alice, bob = login(1), login(2)
+    cursor = current_cursor(bob)
+    sent = send_text(alice, 2, 'hello bob')
+
+    changes = decrypt(bob, sync(bob, cursor))
+    assert [message['content'] for message in changes['messages']] == ['hello bob']
+    assert [contact['id'] for contact in changes['contacts']] == [1]
+    assert changes['has_more'] is False
+
+    # Nothing new past the returned cursor
+    again = decrypt(bob, sync(bob, changes['cursor']))
+    assert again['messages'] == [] and again['cursor'] == changes['cursor']
+    # Other users' entries are not visible
+    carol = login(3)
+    assert decrypt(carol, sync(carol, cursor))['messages'] == []
+    assert sent['id'] == changes['messages'][0]['id']
+
+def test_pages_follow_the_cursor(app, login):
+    alice, bob = login(1), login(2)
+    cursor = current_cursor(bob)
+    for index in range(3):
+        send_text(alice, 2, f'message {index}')
+
+    contents = []
+    pages = 0
+    has_more = True
+    while has_more:
+        changes = decrypt(bob, sync(bob, cursor, limit=2))
+        contents += [message['content'] for message in changes['messages']]
+        cursor, has_more = changes['cursor'], changes['has_more']
+        pages += 1
+    assert contents == ['message 0', 'message 1', 'message 2']
+    assert pages > 1
+
+def test_cursor_below_the_retained_log_is_gone(app, login, monkeypatch):
+    alice, bob = login(1), login(2)
+    cursor = current_cursor(bob)
+    send_text(alice, 2, 'first')
+    age_change_log(app, timedelta(days=messages.CHANGE_LOG_RETENTION_DAYS + 1))
+    send_text(alice, 2, 'second')
+    monkeypatch.setitem(messages.change_log_next_prune, 'at', datetime.min)
+
+    assert sync(bob, cursor).status_code == 410
+    # A cursor taken after the pruned entries still works
+    assert decrypt(bob, sync(bob, current_cursor(bob)))['messages'] == []
+
+def test_gaps_in_the_log_are_not_expiry(app, login):
+    alice, bob = login(1), login(2)
+    cursor = current_cursor(bob)
+    send_text(alice, 2, 'rolled back')
+    send_text(alice, 2, 'kept')
+    with app.app_context():
+        # Ids a rolled back transaction took are never filled
+        oldest = db.session.execute(db.select(db.func.min(ChangeLog.id))).scalar()
+        ChangeLog.query.filter(ChangeLog.id == oldest).delete()
+        db.session.commit()
+
+    response = sync(bob, cursor)
+    assert response.status_code == 200
+    assert [message['content'] for message in decrypt(bob, response)['messages']] == ['rolled back', 'kept']
+
+def test_cursor_trails_entries_that_may_not_be_settled(app, login, monkeypatch):
+    monkeypatch.setattr(messages, 'SYNC_SETTLE_SECONDS', 60)
+    alice, bob = login(1), login(2)
+    send_text(alice, 2, 'settled')
+    age_change_log(app, timedelta(minutes=2))
+    cursor = current_cursor(bob)
+    send_text(alice, 2, 'recent')
+
+    # Lower ids may still commit, so neither the page nor the cursor passes a recent entry
+    changes = decrypt(bob, sync(bob, cursor))
+    assert changes['messages'] == [] and changes['cursor'] == cursor
+
+    age_change_log(app, timedelta(minutes=2))
+    changes = decrypt(bob, sync(bob, cursor))
+    assert [message['content'] for message in changes['messages']] == ['recent']
+
+def test_cursor_past_the_log_is_gone(app, login):
+    alice, bob = login(1), login(2)
+    send_text(alice, 2, 'hello')
+    assert sync(bob, encode_cursor('after', 10_000)).status_code == 410
+
+def test_cursor_into_an_empty_log_is_gone(app, login):
+    alice, bob = login(1), login(2)
+    send_text(alice, 2, 'hello')
+    cursor = current_cursor(bob)
+    with app.app_context():
+        ChangeLog.query.delete()
+        db.session.commit()
+
+    assert sync(bob, cursor).status_code == 410
+    # A client that never saw an entry is still in step
+    assert sync(bob, encode_cursor('after', 0)).status_code == 200
+
+def test_log_ids_are_not_reused_after_pruning(app, login):
+    alice = login(1)
+    send_text(alice, 2, 'hello')
+    with app.app_context():
+        last_id = db.session.execute(db.select(db.func.max(ChangeLog.id))).scalar()
+        ChangeLog.query.delete()
+        db.session.commit()
+    send_text(alice, 2, 'again')
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.min(ChangeLog.id))).scalar() > last_id
+
+def test_invalid_cursor_is_rejected(login):
+    bob = login(2)
+    assert sync(bob, 'not-a-cursor').status_code == 400
+    assert sync(bob, encode_cursor('before', 1)).status_code == 400
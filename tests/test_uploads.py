@@ -0,0 +1,42 @@
+import io
+
+from backend.models import db, Message, UploadSession
+
+def start_upload(client, filename, size, receiver_id=2):
+    return client.post('/wa/api/messages/uploads', json={
+        'receiver_id': receiver_id, 'filename': filename, 'size': size
+    })
+
+def test_resumable_upload_becomes_a_media_message(app, login, uploads):
+    client = login(1)
+    content = b'0123456789' * 10
+    upload_id = start_upload(client, 'holiday.mp4', len(content)).get_json()['upload_id']
+
+    assert client.put(f'/wa/api/messages/uploads/{upload_id}?offset=0', data=content[:40]).status_code == 200
+    # A repeated chunk is answered with where to resume
+    stale = client.put(f'/wa/api/messages/uploads/{upload_id}?offset=0', data=content[:40])
+    assert stale.status_code == 409 and stale.get_json()['offset'] == 40
+    assert client.put(f'/wa/api/messages/uploads/{upload_id}?offset=40', data=content[40:]).status_code == 200
+
+    response = client.post(f'/wa/api/messages/uploads/{upload_id}/complete')
+    assert response.status_code == 201, response.data
+    with app.app_context():
+        message = db.session.get(Message, response.get_json()['id'])
+        assert message.message_type == 'video'
+        with open(message.file_path, 'rb') as stored:
+            assert stored.read() == content
+        assert UploadSession.query.count() == 0
+
+def test_name_without_extension_after_sanitizing_is_rejected(app, login, uploads):
+    client = login(1)
+    # secure_filename turns this into "png"
+    assert start_upload(client, '日本.png', 10).status_code == 400
+    response = client.post('/wa/api/messages/send-media', data={
+        'receiver_id': '2', 'file': (io.BytesIO(b'bytes'), '日本.png')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+    with app.app_context():
+        assert UploadSession.query.count() == 0 and Message.query.count() == 0
+
+def test_disallowed_extension_is_rejected(login, uploads):
+    assert start_upload(login(1), 'script.exe', 10).status_code == 400